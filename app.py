@@ -1,20 +1,1055 @@
 import os
+import re
+import atexit
+import contextvars
+import cProfile
+import functools
+import gzip
+import hashlib
+import io
+import itertools
 import json
+import logging
+import logging.handlers
+import mimetypes
+import pstats
+import queue
 import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from urllib.parse import urlencode
+from flask import Flask, Blueprint, Response, abort, current_app, g, has_request_context, render_template, request, jsonify, redirect, url_for, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from urllib.parse import urlencode, urlparse
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
 import random
 from flask_cors import CORS
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+# Optional speedups: orjson for JSON responses, brotli for compression
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Same output as the default provider (sorted keys, dates through
+    # default()), serialized by orjson
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS |
+               orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        # jsonify() asks for compact separators, which is all orjson writes;
+        # other keyword arguments (e.g. indent for debug pretty-printing)
+        # need the stdlib encoder
+        if kwargs.get('separators') == (',', ':'):
+            kwargs.pop('separators')
+        if not kwargs:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self.options).decode()
+            except (orjson.JSONEncodeError, TypeError):
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+# Routes live on this blueprint; create_app() builds the application
+bp = Blueprint('main', __name__, cli_group=None)
+
+# Logging: one JSON object per line on stdout, with level, logger and the
+# id of the request being served. Records are formatted in the calling
+# thread and handed to a queue; a background listener does the writing, so
+# a request never blocks on stdout. DEBUG records are sampled at
+# LOG_DEBUG_SAMPLE_RATE, and tokens and passwords are masked before a line
+# leaves the process. Use %-style arguments (log.debug("x %s", y)) so that
+# disabled levels cost nothing but the level check.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.1))
+LOG_REDACTIONS = [
+    (re.compile(r'(Bearer\s+)[\w.~+/=-]+', re.I), r'\1[redacted]'),
+    (re.compile(r'((?:access_token|refresh_token|password|token)\\?"?\s*[:=]\s*\\?"?)[^\s"\\,&}]+', re.I), r'\1[redacted]'),
+    (re.compile(r'\beyJ[\w-]+\.[\w-]+\.[\w-]*'), '[redacted]'),  # JWTs
+]
+LOG_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'request_id'}
+
+log = logging.getLogger('retro_money')
+_log_listener = None
+
+class RequestLogFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return False
+        record.request_id = request.environ.get('request_id') if has_request_context() else None
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        # Structured fields passed with extra={...}
+        entry.update((key, value) for key, value in vars(record).items() if key not in LOG_RECORD_FIELDS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        line = json.dumps(entry, default=str)
+        for pattern, replacement in LOG_REDACTIONS:
+            line = pattern.sub(replacement, line)
+        return line
+
+def start_log_listener():
+    # Also run in each forked worker: the parent's listener thread does
+    # not survive the fork
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    _log_listener.start()
+
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(RequestLogFilter())
+    handler.setFormatter(JsonLogFormatter())
+    log.handlers = [handler]
+
+def stop_log_listener():
+    # Writes out whatever is still queued
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+def configure_logging():
+    if log.handlers:
+        return
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+    start_log_listener()
+    os.register_at_fork(after_in_child=start_log_listener)
+    atexit.register(stop_log_listener)
+
+@bp.before_app_request
+def assign_request_id():
+    # Kept from the caller (e.g. a proxy) when it sends one
+    request.environ['request_id'] = request.headers.get('X-Request-ID') or os.urandom(8).hex()
+
+@bp.after_app_request
+def send_request_id(response):
+    response.headers['X-Request-ID'] = request.environ.get('request_id', '')
+    return response
+
+# Metrics, served at /metrics in the Prometheus text format: request latency
+# per route, SQLite queries and time per route, upstream latency and errors
+# per host, and shared cache hits/misses. Values live in this process; with
+# several workers each one also writes a snapshot to METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds, and /metrics adds them all up.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by route'),
+    'sqlite_queries_total': ('counter', 'SQLite statements executed, by route'),
+    'sqlite_query_seconds_total': ('counter', 'Time spent in SQLite statements, by route'),
+    'sqlite_lock_errors_total': ('counter', 'SQLite "database is locked" errors, by route'),
+    'upstream_request_duration_seconds': ('histogram', 'Outbound HTTP latency by upstream host'),
+    'upstream_errors_total': ('counter', 'Outbound HTTP failures (errors and 5xx) by upstream host'),
+    'cache_lookups_total': ('counter', 'Shared cache lookups by cache and result'),
+}
+
+_metrics_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [count per bucket..., sum]
+_metrics_flushed_at = 0
+
+def inc_counter(name, labels, amount=1):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, labels, value):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(LATENCY_BUCKETS)] += 1
+        histogram[-1] += value
+
+def request_metrics():
+    # Per-request totals, kept in the WSGI environ
+    return request.environ.get('metrics') if has_request_context() else None
+
+# SQL tracer: every statement run through connect_db() is timed and
+# aggregated by its text (see /debug/sql). Statements slower than
+# SLOW_QUERY_SECONDS are logged with their parameters and query plan, and a
+# statement run N_PLUS_ONE_THRESHOLD times or more in one request is
+# reported as a likely N+1 pattern.
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_MS', 100)) / 1000
+N_PLUS_ONE_THRESHOLD = 20
+SQL_STATS_MAX_STATEMENTS = 500
+
+_sql_stats = {}
+
+def normalize_sql(sql):
+    # One entry per statement shape: whitespace collapsed and IN (?, ?, ...)
+    # lists of any length folded together
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', sql)
+
+def explain_query_plan(connection, sql, parameters):
+    try:
+        # A plain cursor, so the EXPLAIN itself is not traced
+        cursor = sqlite3.Cursor(connection)
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except (sqlite3.Error, ValueError) as e:
+        return [f'unavailable: {str(e)}']
+
+def record_query(connection, sql, parameters, seconds):
+    key = normalize_sql(sql)
+    with _metrics_lock:
+        stats = _sql_stats.get(key)
+        if stats is None and len(_sql_stats) < SQL_STATS_MAX_STATEMENTS:
+            stats = _sql_stats[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'max_per_request': 0}
+        if stats is not None:
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['sql'], stats['parameters'] = sql, parameters
+
+    metrics = request_metrics()
+    if metrics is not None:
+        metrics['sql_queries'] += 1
+        metrics['sql_seconds'] += seconds
+        metrics['statements'][key] = metrics['statements'].get(key, 0) + 1
+
+    if seconds >= SLOW_QUERY_SECONDS and parameters is not None:
+        route = request.path if has_request_context() else '-'
+        plan = '; '.join(explain_query_plan(connection, sql, parameters))
+        # Broker tokens stay out of the logs
+        shown = '<redacted>' if 'broker_tokens' in key else repr(parameters)
+        log.warning("Slow query (%.1f ms) on %s: %s", seconds * 1000, route, key,
+                    extra={'duration_ms': round(seconds * 1000, 3), 'params': shown, 'plan': plan})
+
+def check_statement_repeats(metrics, route):
+    # Called once per request: flags statements repeated inside a loop
+    for key, count in metrics['statements'].items():
+        with _metrics_lock:
+            if key in _sql_stats:
+                _sql_stats[key]['max_per_request'] = max(_sql_stats[key]['max_per_request'], count)
+        if count >= N_PLUS_ONE_THRESHOLD:
+            log.warning("Possible N+1 on %s: %s ran %d times in one request", route, key, count)
+
+def record_lock_error(e):
+    # A write that waited out the busy timeout behind another writer (or a
+    # commit that did): the sign of lock contention between workers
+    if 'locked' in str(e):
+        route = request.url_rule.rule if has_request_context() and request.url_rule else '-'
+        inc_counter('sqlite_lock_errors_total', {'route': route})
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            record_lock_error(e)
+            raise
+        finally:
+            record_query(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            record_lock_error(e)
+            raise
+        finally:
+            # No single parameter set to explain
+            record_query(self.connection, sql, None, time.perf_counter() - started)
+
+class TimedConnection(sqlite3.Connection):
+    # connect_db() connections: every statement goes through TimedCursor
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            record_lock_error(e)
+            raise
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+@bp.before_app_request
+def start_request_metrics():
+    request.environ['metrics'] = {
+        'started': time.perf_counter(),
+        'sql_queries': 0,
+        'sql_seconds': 0.0,
+        'statements': {},
+        'upstream_seconds': 0.0,
+    }
+
+# Registered before compress_response, so it runs after it and the latency
+# includes compression
+@bp.after_app_request
+def record_request_metrics(response):
+    metrics = request_metrics()
+    if metrics is None:
+        return response
+
+    elapsed = time.perf_counter() - metrics['started']
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    inc_counter('http_requests_total', {'route': route, 'method': request.method, 'status': str(response.status_code)})
+    observe('http_request_duration_seconds', {'route': route}, elapsed)
+    if metrics['sql_queries']:
+        inc_counter('sqlite_queries_total', {'route': route}, metrics['sql_queries'])
+        inc_counter('sqlite_query_seconds_total', {'route': route}, metrics['sql_seconds'])
+        check_statement_repeats(metrics, route)
+
+    # The same breakdown for the browser's network panel
+    response.headers['Server-Timing'] = (
+        f'db;dur={metrics["sql_seconds"] * 1000:.1f};desc="{metrics["sql_queries"]} queries", '
+        f'upstream;dur={metrics["upstream_seconds"] * 1000:.1f}, '
+        f'total;dur={elapsed * 1000:.1f}'
+    )
+
+    if METRICS_DIR and time.time() - _metrics_flushed_at >= METRICS_FLUSH_INTERVAL:
+        flush_metrics()
+    return response
+
+def metrics_snapshot():
+    with _metrics_lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+def flush_metrics():
+    global _metrics_flushed_at
+    _metrics_flushed_at = time.time()
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metrics_snapshot(), f)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        log.warning("Error writing metrics snapshot: %s", e)
+
+def collect_metrics():
+    # This process's live values plus the last snapshot of every other
+    # worker (including ones that have exited: counters only go up)
+    snapshots = [metrics_snapshot()]
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        own = f'{os.getpid()}.json'
+        for name in os.listdir(METRICS_DIR):
+            if name.endswith('.json') and name != own:
+                try:
+                    with open(os.path.join(METRICS_DIR, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    counters, histograms = collect_metrics()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        else:
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {values[-1]}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+# Top statements by total time, with their current query plan (run again
+# on demand, so it reflects the schema as it is now). Stats are per worker
+# process. DELETE resets them. Only served with DEBUG_ENDPOINTS on.
+@bp.route('/debug/sql', methods=['GET', 'DELETE'])
+def debug_sql():
+    if not current_app.config['DEBUG_ENDPOINTS']:
+        abort(404)
+
+    if request.method == 'DELETE':
+        with _metrics_lock:
+            _sql_stats.clear()
+        return jsonify({"status": "success"})
+
+    limit = request.args.get('limit', 20, type=int)
+    with _metrics_lock:
+        top = sorted(((key, dict(stats)) for key, stats in _sql_stats.items()),
+                     key=lambda item: item[1]['total'], reverse=True)[:limit]
+
+    conn = connect_db()
+    statements = []
+    for key, stats in top:
+        statements.append({
+            "statement": key,
+            "count": stats['count'],
+            "total_ms": round(stats['total'] * 1000, 3),
+            "avg_ms": round(stats['total'] * 1000 / stats['count'], 3),
+            "max_ms": round(stats['max'] * 1000, 3),
+            "max_per_request": stats['max_per_request'],
+            "plan": explain_query_plan(conn, stats['sql'], stats['parameters'])
+                    if stats['parameters'] is not None else []
+        })
+    conn.close()
+    return jsonify({"pid": os.getpid(), "slow_query_ms": SLOW_QUERY_SECONDS * 1000, "statements": statements})
+
+# On-demand profiling. With DEBUG_ENDPOINTS on, a request is profiled when
+# a client in PROFILE_CLIENTS adds ?profile=1 or an X-Profile: 1 header
+# (profile=cprofile for cProfile instead), or at random for a
+# PROFILE_SAMPLE_RATE share of requests. The default profiler samples the
+# request thread's stack every PROFILE_INTERVAL seconds, weighting each
+# sample by the time since the last one (the sampler waits for the GIL
+# during pure-Python stretches). Profiles are written to PROFILE_DIR, so any
+# worker can serve them, and listed at /debug/profiles with a flame graph
+# and speedscope JSON each; the response's X-Profile-URL links to its own.
+PROFILE_INTERVAL = 0.001
+PROFILE_KEEP = 100
+PROFILE_SKIPPED_PREFIXES = ('/debug/', '/metrics', '/static/')
+
+_profiling = threading.local()
+
+class StackSampler:
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = {}  # (function, file, line) -> index
+        self.stacks = {}  # frame indexes, outermost first -> seconds
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                stack.append(self.frames.setdefault(key, len(self.frames)))
+                frame = frame.f_back
+            if self._stop.is_set():
+                # The request thread is in stop(), waiting for this thread
+                break
+            stack = tuple(reversed(stack))
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + now - last
+            self.samples += 1
+            last = now
+
+def requested_profile():
+    # (mode, trigger) for this request, or (None, None)
+    if not current_app.config['DEBUG_ENDPOINTS'] or request.path.startswith(PROFILE_SKIPPED_PREFIXES):
+        return None, None
+    flag = request.args.get('profile') or request.headers.get('X-Profile')
+    if flag and request.remote_addr in current_app.config['PROFILE_CLIENTS']:
+        return ('cprofile' if flag == 'cprofile' else 'sample'), 'requested'
+    if random.random() < current_app.config['PROFILE_SAMPLE_RATE']:
+        return 'sample', 'sampled'
+    return None, None
+
+@bp.before_app_request
+def start_profiling():
+    mode, trigger = requested_profile()
+    if mode is None:
+        return
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    _profiling.active = {'mode': mode, 'trigger': trigger, 'profiler': profiler,
+                         'environ': request.environ, 'started': time.perf_counter()}
+
+def stop_profiling():
+    active = getattr(_profiling, 'active', None)
+    if not active or active['environ'] is not request.environ:
+        return None
+    _profiling.active = None
+    if active['mode'] == 'cprofile':
+        active['profiler'].disable()
+    else:
+        active['profiler'].stop()
+    active['duration'] = time.perf_counter() - active['started']
+    return active
+
+# Registered before compress_response, so compression is in the profile
+@bp.after_app_request
+def finish_profiling(response):
+    active = stop_profiling()
+    if active is None:
+        return response
+
+    profile = {
+        'id': f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.urandom(4).hex()}",
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'request_id': request.environ.get('request_id'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'route': request.url_rule.rule if request.url_rule else None,
+        'status': response.status_code,
+        'duration_ms': round(active['duration'] * 1000, 3),
+        'mode': active['mode'],
+        'trigger': active['trigger'],
+        'pid': os.getpid(),
+    }
+    profiler = active['profiler']
+    if active['mode'] == 'cprofile':
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(60)
+        profile['stats'] = output.getvalue()
+    else:
+        profile['samples'] = profiler.samples
+        profile['frames'] = [list(key) for key in profiler.frames]
+        profile['stacks'] = [[list(stack), seconds] for stack, seconds in profiler.stacks.items()]
+
+    if save_profile(profile):
+        response.headers['X-Profile-URL'] = url_for('main.debug_profile', profile_id=profile['id'])
+    return response
+
+@bp.teardown_app_request
+def abandon_profiling(exc=None):
+    # Unhandled errors skip finish_profiling; don't leave a profiler running
+    stop_profiling()
+
+def save_profile(profile):
+    directory = current_app.config['PROFILE_DIR']
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, profile['id'] + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(profile, f)
+        os.replace(path + '.tmp', path)
+
+        # Ids start with the time, so the oldest sort first
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+        for name in names[:-PROFILE_KEEP]:
+            os.remove(os.path.join(directory, name))
+    except OSError as e:
+        log.warning("Error saving profile: %s", e)
+        return False
+    log.info("Profiled %s %s in %.1f ms", profile['method'], profile['path'], profile['duration_ms'],
+             extra={'profile_id': profile['id']})
+    return True
+
+def load_profile(profile_id):
+    path = safe_join(current_app.config['PROFILE_DIR'], profile_id + '.json')
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    with open(path) as f:
+        return json.load(f)
+
+def profile_tree(profile):
+    # Merge the sampled stacks into a call tree, starting at Flask's
+    # wsgi_app (the server and thread frames above it are the same in
+    # every sample)
+    frames = profile['frames']
+    root = {'name': f"{profile['method']} {profile['path']}", 'file': '', 'line': 0,
+            'seconds': 0.0, 'children': {}}
+    for stack, seconds in profile['stacks']:
+        start = next((i for i, index in enumerate(stack) if frames[index][0] == 'wsgi_app'), 0)
+        root['seconds'] += seconds
+        node = root
+        for index in stack[start:]:
+            name, file, line = frames[index]
+            node = node['children'].setdefault(index, {
+                'name': name, 'file': file, 'line': line, 'seconds': 0.0, 'children': {}
+            })
+            node['seconds'] += seconds
+    return root
+
+def speedscope_profile(profile):
+    # https://www.speedscope.app/file-format-schema.json, "sampled" type
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': f"{profile['method']} {profile['path']}",
+        'exporter': 'retro-money',
+        'shared': {'frames': [{'name': name, 'file': file, 'line': line}
+                              for name, file, line in profile['frames']]},
+        'profiles': [{
+            'type': 'sampled',
+            'name': f"{profile['method']} {profile['path']} ({profile['id']})",
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': round(sum(seconds for _, seconds in profile['stacks']) * 1000, 3),
+            'samples': [stack for stack, _ in profile['stacks']],
+            'weights': [round(seconds * 1000, 3) for _, seconds in profile['stacks']],
+        }],
+    }
+
+@bp.route('/debug/profiles', methods=['GET', 'DELETE'])
+def debug_profiles():
+    if not current_app.config['DEBUG_ENDPOINTS']:
+        abort(404)
+
+    directory = current_app.config['PROFILE_DIR']
+    names = sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True) \
+        if os.path.isdir(directory) else []
+
+    if request.method == 'DELETE':
+        for name in names:
+            os.remove(os.path.join(directory, name))
+        return jsonify({"status": "success", "deleted": len(names)})
+
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({key: profile.get(key) for key in (
+            'id', 'created_at', 'request_id', 'method', 'path', 'route', 'status',
+            'duration_ms', 'mode', 'trigger', 'pid', 'samples'
+        )})
+
+    if request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html':
+        return render_template('debug_profiles.html', profiles=profiles)
+    return jsonify({"profiles": profiles})
+
+@bp.route('/debug/profiles/<profile_id>', methods=['GET'])
+def debug_profile(profile_id):
+    if not current_app.config['DEBUG_ENDPOINTS']:
+        abort(404)
+
+    profile = load_profile(profile_id)
+    output = request.args.get('format', 'html')
+    if output == 'json':
+        return jsonify(profile)
+    if output == 'speedscope':
+        if profile['mode'] != 'sample':
+            abort(404)
+        response = jsonify(speedscope_profile(profile))
+        response.headers['Content-Disposition'] = f'attachment; filename="{profile_id}.speedscope.json"'
+        return response
+    tree = profile_tree(profile) if profile['mode'] == 'sample' else None
+    return render_template('debug_profile.html', profile=profile, tree=tree, app_file=__file__)
+
+# Negotiated compression for dynamic responses (API JSON and pages) above
+# COMPRESS_MIN_SIZE bytes. Static bundles are precompressed (build_assets.py).
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/javascript', 'application/javascript'}
+
+@bp.after_app_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli and accepted['br']:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Compact list payloads: ?format=columnar turns a list of row dicts into
+# {"columns": [...], "rows": [[...], ...]}, so keys are sent once instead of
+# once per row
+def wants_columnar():
+    return request.args.get('format') == 'columnar'
+
+def columnar(items):
+    columns = []
+    for item in items:
+        columns.extend(key for key in item if key not in columns)
+    return {"columns": columns, "rows": [[item.get(column) for column in columns] for item in items]}
+
+def jsonify_rows(items):
+    return jsonify(columnar(items) if wants_columnar() else items)
+
+# Upstream APIs, the defaults for the DOLARAPI_URL and IOL_URL config keys
+# (point them at benchmarks/stub_server.py to run offline)
+DOLARAPI_URL = os.environ.get('DOLARAPI_URL', 'https://dolarapi.com/v1')
+IOL_URL = os.environ.get('IOL_URL', 'https://api.invertironline.com')
+
+# Outbound HTTP: one pooled keep-alive session shared by every handler
+UPSTREAM_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+UPSTREAM_MAX_CONCURRENCY = 4  # in-flight requests per upstream host
+UPSTREAM_QUEUE_TIMEOUT = 5  # seconds to wait for a free slot before giving up
+
+_http_session = None
+_http_lock = threading.Lock()
+_host_slots = {}
+
+def get_http_session():
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            session = requests.Session()
+            # Only idempotent GETs are retried; token POSTs fail straight through
+            retry = Retry(
+                total=2,
+                backoff_factor=0.2,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET'])
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_MAX_CONCURRENCY, max_retries=retry)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+def _host_slot(host):
+    with _http_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(UPSTREAM_MAX_CONCURRENCY)
+        return _host_slots[host]
+
+# Circuit breaker per upstream host: after BREAKER_FAILURE_THRESHOLD
+# consecutive failures the host is skipped (calls raise UpstreamUnavailable
+# immediately) while a background thread probes it every BREAKER_COOLDOWN
+# seconds. A successful probe closes the breaker again.
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN = 30
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    pass
+
+_breakers = {}
+
+def _breaker(host):
+    with _http_lock:
+        if host not in _breakers:
+            _breakers[host] = {'state': 'closed', 'failures': 0, 'probe_url': None}
+        return _breakers[host]
+
+def _record_upstream_success(host):
+    breaker = _breaker(host)
+    with _http_lock:
+        breaker['state'] = 'closed'
+        breaker['failures'] = 0
+
+def _record_upstream_failure(host, method, url):
+    breaker = _breaker(host)
+    with _http_lock:
+        breaker['failures'] += 1
+        if method == 'GET':
+            breaker['probe_url'] = url
+        should_open = breaker['state'] == 'half_open' or (
+            breaker['state'] == 'closed' and breaker['failures'] >= BREAKER_FAILURE_THRESHOLD
+        )
+        if should_open:
+            breaker['state'] = 'open'
+    if should_open:
+        log.warning("Circuit opened for %s after %d failures", host, breaker['failures'])
+        threading.Thread(target=_probe_upstream, args=(host,), daemon=True).start()
+
+def _probe_upstream(host):
+    breaker = _breaker(host)
+    while True:
+        time.sleep(BREAKER_COOLDOWN)
+        url = breaker['probe_url']
+        if url is None:
+            # Nothing safe to replay (e.g. only token POSTs failed): let the
+            # next real request through as the probe
+            with _http_lock:
+                breaker['state'] = 'half_open'
+            return
+        try:
+            healthy = get_http_session().get(url, timeout=UPSTREAM_TIMEOUT).status_code < 500
+        except requests.exceptions.RequestException:
+            healthy = False
+        if healthy:
+            log.info("Circuit closed for %s", host)
+            _record_upstream_success(host)
+            return
+
+def upstream_request(method, url, **kwargs):
+    host = urlparse(url).netloc
+    if _breaker(host)['state'] == 'open':
+        raise UpstreamUnavailable(f"Circuit open for {host}")
+
+    kwargs.setdefault('timeout', UPSTREAM_TIMEOUT)
+    slot = _host_slot(host)
+    if not slot.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT):
+        inc_counter('upstream_errors_total', {'host': host})
+        raise requests.exceptions.ConnectTimeout(f"Too many concurrent requests to {host}")
+    started = time.perf_counter()
+    try:
+        response = get_http_session().request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        _record_upstream_failure(host, method, url)
+        inc_counter('upstream_errors_total', {'host': host})
+        raise
+    finally:
+        slot.release()
+        elapsed = time.perf_counter() - started
+        observe('upstream_request_duration_seconds', {'host': host}, elapsed)
+        metrics = request_metrics()
+        if metrics is not None:
+            metrics['upstream_seconds'] += elapsed
+
+    if response.status_code >= 500:
+        _record_upstream_failure(host, method, url)
+        inc_counter('upstream_errors_total', {'host': host})
+    else:
+        _record_upstream_success(host)
+    return response
+
+def upstream_get(url, **kwargs):
+    return upstream_request('GET', url, **kwargs)
+
+def upstream_post(url, **kwargs):
+    return upstream_request('POST', url, **kwargs)
+
+# Bulkhead for views that wait on an upstream API: per process, at most
+# UPSTREAM_VIEW_CONCURRENCY requests per pool ('broker', 'rates') are inside
+# such a view at once, so however slow IOL or dolarapi get, the remaining
+# worker threads stay free for the local expense and todo endpoints. Over
+# the limit a request waits UPSTREAM_VIEW_QUEUE_TIMEOUT seconds, then gets 503.
+UPSTREAM_VIEW_CONCURRENCY = int(os.environ.get('UPSTREAM_VIEW_CONCURRENCY', 2))
+UPSTREAM_VIEW_QUEUE_TIMEOUT = 1
+
+_view_slots = {}
+
+def upstream_view(pool):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Views calling each other (broker_prices -> broker_portfolio ->
+            # broker_refresh_token) run on the slot already held
+            held = g.get('upstream_pools', frozenset())
+            if pool in held:
+                return view(*args, **kwargs)
+
+            with _http_lock:
+                if pool not in _view_slots:
+                    _view_slots[pool] = threading.BoundedSemaphore(UPSTREAM_VIEW_CONCURRENCY)
+                slot = _view_slots[pool]
+            if not slot.acquire(timeout=UPSTREAM_VIEW_QUEUE_TIMEOUT):
+                return jsonify({
+                    "status": "error",
+                    "message": "Too many requests waiting on upstream services, try again shortly"
+                }), 503, {'Retry-After': '1'}
+
+            g.upstream_pools = held | {pool}
+            try:
+                return view(*args, **kwargs)
+            finally:
+                g.upstream_pools = held
+                slot.release()
+        return wrapper
+    return decorator
+
+# Cache shared by all worker processes (see gunicorn.conf.py): a table in the
+# app database, so a quote or portfolio fetched by one worker is reused by the
+# others instead of each of them calling the upstream API. Values are stored
+# as JSON with the time they were fetched. Errors only cost a cache miss.
+def shared_cache_get_many(keys):
+    try:
+        conn = connect_db()
+        try:
+            rows = conn.execute(
+                f"SELECT key, value, stored_at FROM shared_cache WHERE key IN ({', '.join('?' * len(keys))})",
+                list(keys)
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.warning("Error reading shared cache: %s", e)
+        return {}
+    return {key: (json.loads(value), stored_at) for key, value, stored_at in rows}
+
+def shared_cache_get(key):
+    return shared_cache_get_many([key]).get(key, (None, 0))
+
+# replaces is a LIKE pattern for entries this one supersedes (e.g. the
+# portfolio cached under a token that has since been refreshed); they are
+# deleted along with the write so the table doesn't keep growing.
+def shared_cache_set(key, value, stored_at=None, replaces=None):
+    try:
+        conn = connect_db()
+        try:
+            if replaces:
+                conn.execute("DELETE FROM shared_cache WHERE key LIKE ? AND key != ?", (replaces, key))
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), stored_at or time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.warning("Error writing shared cache: %s", e)
+
+# Exchange rates: quotes are cached for RATE_CACHE_TTL seconds. When dolarapi
+# cannot be reached the last known good quote is served with stale=True, and
+# only if we have never seen one do we fall back to FALLBACK_DOLAR_RATES.
+RATE_CACHE_TTL = 60
+FALLBACK_DOLAR_RATES = {
+    'blue': {'compra': 1150, 'venta': 1150},
+    'tarjeta': {'compra': 1150, 'venta': 1150},
+    'cripto': {'compra': 1225, 'venta': 1230}
+}
+
+def get_dolar_rate(kind):
+    now = time.time()
+    cached, fetched_at = shared_cache_get(f'rate:{kind}')
+    if cached and now - fetched_at < RATE_CACHE_TTL:
+        inc_counter('cache_lookups_total', {'cache': 'rates', 'result': 'hit'})
+        return dict(cached, stale=False, fallback=False)
+    inc_counter('cache_lookups_total', {'cache': 'rates', 'result': 'miss'})
+
+    try:
+        response = upstream_get(f"{current_app.config['DOLARAPI_URL']}/dolares/{kind}")
+        if response.status_code == 200:
+            data = response.json()
+            quote = {
+                'compra': data.get('compra') or FALLBACK_DOLAR_RATES[kind]['compra'],
+                'venta': data.get('venta') or FALLBACK_DOLAR_RATES[kind]['venta'],
+                'updated': data.get('fechaActualizacion', '')
+            }
+            shared_cache_set(f'rate:{kind}', quote, now)
+            return dict(quote, stale=False, fallback=False)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log.warning("Error getting %s exchange rate: %s", kind, e)
+
+    if cached:
+        return dict(cached, stale=True, fallback=False)
+    return dict(FALLBACK_DOLAR_RATES[kind], updated='', stale=True, fallback=True)
+
+_rate_executor = ThreadPoolExecutor(max_workers=len(FALLBACK_DOLAR_RATES), thread_name_prefix='rates')
+
+def get_dolar_rates(kinds=None):
+    # Fetch several quote types at once: fresh cache hits are answered inline
+    # and the misses go out in parallel, so a cold cache costs the slowest
+    # upstream call rather than the sum of them
+    kinds = list(kinds or FALLBACK_DOLAR_RATES)
+    now = time.time()
+    cache = shared_cache_get_many([f'rate:{kind}' for kind in kinds])
+    quotes = {}
+    pending = {}
+    for kind in kinds:
+        cached, fetched_at = cache.get(f'rate:{kind}', (None, 0))
+        if cached and now - fetched_at < RATE_CACHE_TTL:
+            inc_counter('cache_lookups_total', {'cache': 'rates', 'result': 'hit'})
+            quotes[kind] = dict(cached, stale=False, fallback=False)
+        else:
+            # Counted as a miss by get_dolar_rate()
+            # The worker thread needs the app context to reach the database
+            pending[kind] = _rate_executor.submit(contextvars.copy_context().run, get_dolar_rate, kind)
+    for kind, future in pending.items():
+        quotes[kind] = future.result()
+    return quotes
 
 # Database setup
-def init_db():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
+def backfill_investment_expenses(c):
+    # One-time match of existing investments to their "Investment: <name>"
+    # expense. Each expense is claimed at most once, so two investments with
+    # the same name and date end up linked to two different rows.
+    c.execute("SELECT id, name, purchase_date FROM investments WHERE expense_id IS NULL ORDER BY id")
+    claimed = set()
+    for investment_id, name, purchase_date in c.fetchall():
+        c.execute(
+            "SELECT id FROM expenses WHERE description = ? AND date = ? AND category = 'Investments' ORDER BY id",
+            (f"Investment: {name}", purchase_date)
+        )
+        for (expense_id,) in c.fetchall():
+            if expense_id not in claimed:
+                claimed.add(expense_id)
+                c.execute("UPDATE investments SET expense_id = ? WHERE id = ?", (expense_id, investment_id))
+                break
+
+def open_db(path):
+    # file: URIs allow shared in-memory databases (file:name?mode=memory&cache=shared)
+    conn = sqlite3.connect(path, uri=path.startswith('file:'), factory=TimedConnection)
+    # Enough for durability in WAL mode (set by migrate_db). Connection
+    # setup, so kept out of the SQL tracer.
+    sqlite3.Cursor(conn).execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def connect_db():
+    return open_db(current_app.config['DATABASE'])
+
+# Schema migrations. migrate_db() applies the steps after the version stored
+# in schema_version, in order, each one exactly once. Append new steps to
+# MIGRATIONS; never change one that has shipped. The first step only uses
+# conditional statements so that it also adopts databases created before
+# versioning.
+def migrate_base_schema(c):
     c.execute('''
     CREATE TABLE IF NOT EXISTS user_info (
         id INTEGER PRIMARY KEY,
@@ -31,6 +1066,13 @@ def init_db():
         category TEXT
     )
     ''')
+
+    # Expenses from before categories default to Fixed Expenses
+    c.execute("PRAGMA table_info(expenses)")
+    if 'category' not in [col[1] for col in c.fetchall()]:
+        c.execute("ALTER TABLE expenses ADD COLUMN category TEXT DEFAULT 'Fixed Expenses'")
+        log.info("Added category column to expenses table")
+    c.execute("UPDATE expenses SET category = 'Fixed Expenses' WHERE category IS NULL")
     c.execute('''
     CREATE TABLE IF NOT EXISTS budget_categories (
         id INTEGER PRIMARY KEY,
@@ -59,10 +1101,52 @@ def init_db():
         current_price REAL DEFAULT 0,
         last_updated TEXT,
         notes TEXT,
-        investment_type TEXT
+        investment_type TEXT,
+        expense_id INTEGER DEFAULT NULL,
+        FOREIGN KEY (expense_id) REFERENCES expenses (id)
     )
     ''')
-    
+
+    # Link investments created before expense_id existed to their expense row
+    c.execute("PRAGMA table_info(investments)")
+    if "expense_id" not in [col[1] for col in c.fetchall()]:
+        c.execute("ALTER TABLE investments ADD COLUMN expense_id INTEGER DEFAULT NULL")
+        backfill_investment_expenses(c)
+        log.info("Added expense_id column to investments table")
+
+    # Append-only price history, one row per observed price
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS price_ticks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT NOT NULL,
+        ts TEXT NOT NULL,
+        price REAL NOT NULL
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_price_ticks_symbol_ts ON price_ticks (symbol, ts)")
+
+    # Daily OHLC bars folded from price_ticks (see downsample_price_ticks)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS price_bars (
+        symbol TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        open_ts TEXT NOT NULL,
+        close_ts TEXT NOT NULL,
+        tick_count INTEGER DEFAULT 0,
+        last_tick_id INTEGER DEFAULT 0,
+        PRIMARY KEY (symbol, bucket)
+    )
+    ''')
+
+    # Indexes used by the formula aggregates (see /api/formula/eval)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses (category, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_investments_name ON investments (name)")
+
     # Check if todos table already exists
     c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='todos'")
     todos_exists = c.fetchone() is not None
@@ -90,27 +1174,48 @@ def init_db():
         
         if "parent_id" not in columns:
             c.execute("ALTER TABLE todos ADD COLUMN parent_id INTEGER DEFAULT NULL")
-            print("Added parent_id column to todos table")
+            log.info("Added parent_id column to todos table")
             
         if "level" not in columns:
             c.execute("ALTER TABLE todos ADD COLUMN level INTEGER DEFAULT 0")
-            print("Added level column to todos table")
+            log.info("Added level column to todos table")
             
         if "planned_date" not in columns:
             c.execute("ALTER TABLE todos ADD COLUMN planned_date TEXT DEFAULT NULL")
-            print("Added planned_date column to todos table")
+            log.info("Added planned_date column to todos table")
             
         if "time_spent" not in columns:
             c.execute("ALTER TABLE todos ADD COLUMN time_spent INTEGER DEFAULT 0")
-            print("Added time_spent column to todos table")
-    
-    conn.commit()
-    
+            log.info("Added time_spent column to todos table")
+
+    # Change feed for delta sync (see /api/sync). Rows that exist when the
+    # feed is first created are recorded once so that since=0 returns them.
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='changes'")
+    changes_exists = c.fetchone() is not None
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_changes_tbl_row ON changes (tbl, row_id)")
+    for table in SYNC_TABLES:
+        # accounts and transfers are created (with their triggers) by
+        # migrate_accounts_transfers
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        if c.fetchone() is None:
+            continue
+        if not changes_exists:
+            c.execute(f"INSERT INTO changes (tbl, row_id, op) SELECT '{table}', id, 'upsert' FROM {table} ORDER BY id")
+        install_change_triggers(c, table)
+
     # Add default user info if not exists
     c.execute("SELECT COUNT(*) FROM user_info")
     if c.fetchone()[0] == 0:
         c.execute("INSERT INTO user_info (id, monthly_salary) VALUES (1, 0)")
-        conn.commit()
     
     # Add default budget categories if not exists
     c.execute("SELECT COUNT(*) FROM budget_categories")
@@ -122,199 +1227,395 @@ def init_db():
             (4, "Investments", 0.1)
         ]
         c.executemany("INSERT INTO budget_categories (id, name, percentage) VALUES (?, ?, ?)", categories)
-        conn.commit()
+
+def migrate_accounts_transfers(c):
+    # Tables that used to be created by their handlers on first use
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='accounts'")
+    accounts_exists = c.fetchone() is not None
+    c.execute('''CREATE TABLE IF NOT EXISTS accounts
+        (id INTEGER PRIMARY KEY,
+        name TEXT,
+        currency TEXT,
+        balance REAL,
+        fee_percent REAL)''')
+    install_change_triggers(c, 'accounts')
+
+    if not accounts_exists:
+        # Cuentas predeterminadas
+        accounts_data = [
+            ('Payoneer', 'USD', 1500.0, 0.01),
+            ('Belo', 'USD', 0.0, 0.001),
+            ('Cuenta ARS', 'ARS', 0.0, 0.0)
+        ]
+        c.executemany("INSERT INTO accounts (name, currency, balance, fee_percent) VALUES (?, ?, ?, ?)", accounts_data)
+
+    c.execute('''CREATE TABLE IF NOT EXISTS transfers
+        (id INTEGER PRIMARY KEY,
+        date TEXT,
+        amount REAL,
+        from_account TEXT,
+        to_account TEXT,
+        gross_amount REAL,
+        total_fees REAL,
+        description TEXT)''')
+    install_change_triggers(c, 'transfers')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS broker_tokens (
+    id INTEGER PRIMARY KEY,
+    access_token TEXT,
+    refresh_token TEXT,
+    expires_in INTEGER,
+    last_updated TEXT
+    )''')
+
+def migrate_shared_cache(c):
+    # See shared_cache_get()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS shared_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        stored_at REAL NOT NULL
+    )
+    ''')
+
+def migrate_drop_data_version(c):
+    # Formula results are keyed on the change feed's seq now; the per-table
+    # counters and their triggers only duplicated it
+    for table in FORMULA_SOURCES:
+        for event in ('insert', 'update', 'delete'):
+            c.execute(f"DROP TRIGGER IF EXISTS {table}_{event}_version")
+    c.execute("DROP TABLE IF EXISTS data_version")
+
+MIGRATIONS = [
+    migrate_base_schema,
+    migrate_accounts_transfers,
+    migrate_shared_cache,
+    migrate_drop_data_version,
+]
+
+def migrate_db(path):
+    conn = open_db(path)
+    conn.isolation_level = None  # transactions are managed explicitly below
+    c = conn.cursor()
+    try:
+        # Readers and the writer no longer block each other, which lets
+        # several worker processes share the database. Persistent, and it
+        # cannot change inside a transaction.
+        c.execute("PRAGMA journal_mode=WAL")
+
+        # Taken before reading the version, so that workers starting at the
+        # same time apply each step once
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        c.execute("SELECT MAX(version) FROM schema_version")
+        version = c.fetchone()[0] or 0
+
+        for number in range(version + 1, len(MIGRATIONS) + 1):
+            MIGRATIONS[number - 1](c)
+            c.execute("DELETE FROM schema_version")
+            c.execute("INSERT INTO schema_version (version) VALUES (?)", (number,))
+            log.info("Applied migration %d: %s", number, MIGRATIONS[number - 1].__name__)
+
+        c.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+# First-screen data rendered into the pages. Each page gets the API
+# responses its scripts request right after loading, keyed by URL, so that
+# AppStorage.request() can answer them without a round trip. Everything is
+# read over one connection and only cached exchange rates are used: a page
+# never waits on dolarapi, and whatever is missing is fetched as before.
+BOOTSTRAP_EXPENSE_PAGE = 100  # GRID_PAGE_SIZE in grid.js
+
+def cached_dolar_quotes(kinds):
+    now = time.time()
+    quotes = {}
+    for key, (quote, fetched_at) in shared_cache_get_many([f'rate:{kind}' for kind in kinds]).items():
+        quotes[key.split(':', 1)[1]] = dict(quote, stale=now - fetched_at >= RATE_CACHE_TTL, fallback=False)
+    return quotes
+
+def bootstrap_rates(bootstrap, kinds):
+    # The client asks only for the types it has not cached itself, so
+    # answer every combination it may request
+    quotes = cached_dolar_quotes(kinds)
+    for size in range(1, len(kinds) + 1):
+        for combo in itertools.combinations(kinds, size):
+            if all(kind in quotes for kind in combo):
+                bootstrap[f"/api/exchange-rates?types={','.join(combo)}"] = {
+                    "body": {kind: exchange_rate_entry(quotes[kind]) for kind in combo}
+                }
+    return quotes
+
+def bootstrap_data(page):
+    bootstrap = {}
+    conn = connect_db()
+    c = conn.cursor()
+    try:
+        if page == 'expenses':
+            quotes = bootstrap_rates(bootstrap, ['blue', 'tarjeta'])
+
+            c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
+            bootstrap['/api/salary'] = {"body": {"salary": c.fetchone()[0]}}
+
+            seq = current_change_seq(c)
+            c.execute("SELECT COUNT(*) FROM expenses")
+            total = c.fetchone()[0]
+            c.execute(EXPENSE_LIST_QUERY + " LIMIT ?", (BOOTSTRAP_EXPENSE_PAGE,))
+            bootstrap[f'/api/expenses?offset=0&limit={BOOTSTRAP_EXPENSE_PAGE}&format=columnar'] = {
+                "body": {"columns": [d[0] for d in c.description], "rows": c.fetchall()},
+                "headers": {"X-Total-Count": str(total), "X-Sync-Seq": str(seq)}
+            }
+            bootstrap['/api/expenses/summary'] = {"body": expense_summary(c)}
+
+            if 'blue' in quotes:
+                month = datetime.now().strftime("%Y-%m")
+                bootstrap['/api/budget-allocations'] = {
+                    "body": budget_allocation_summary(c, month, quotes['blue']['venta'])
+                }
+                conn.commit()
+
+        elif page == 'todos':
+            seq = current_change_seq(c)
+            bootstrap['/api/todos?format=columnar'] = {
+                "body": columnar(fetch_todos(c)),
+                "headers": {"X-Sync-Seq": str(seq)}
+            }
+            bootstrap['/api/todos/stats/weekly'] = {"body": weekly_completion_stats(c)}
+
+        elif page == 'transfers':
+            bootstrap_rates(bootstrap, ['cripto'])
+
+            seq = current_change_seq(c)
+            c.execute(f"SELECT {', '.join(SYNC_TABLES['transfers'])} FROM transfers ORDER BY date DESC")
+            bootstrap['/api/transfers?format=columnar'] = {
+                "body": {"columns": SYNC_TABLES['transfers'], "rows": c.fetchall()},
+                "headers": {"X-Sync-Seq": str(seq)}
+            }
+    except sqlite3.Error as e:
+        # The page still works, its scripts just fetch everything
+        log.warning("Error building bootstrap data for %s: %s", page, e)
+    conn.close()
+    return bootstrap
+
+# Routes
+@bp.route('/')
+def index():
+    return render_template('index.html', active_page="expenses", bootstrap=bootstrap_data('expenses'))
+
+@bp.route('/todos')
+def todos():
+    return render_template('todos.html', active_page="todos", bootstrap=bootstrap_data('todos'))
+
+@bp.route('/investments')
+def investments():
+    return render_template('investments.html', active_page="investments")
+
+@bp.route('/transfers')
+def transfers():
+    return render_template('transfers.html', active_page='transfers', bootstrap=bootstrap_data('transfers'))
+
+# The service worker is served from the root so its scope covers every page
+@bp.route('/sw.js')
+def service_worker():
+    response = send_from_directory(os.path.join(current_app.static_folder, 'js'), 'sw.js', mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Fingerprinted static bundles built by build_assets.py. When a bundle exists,
+# url_for('static', filename=...) points at it instead of the source file;
+# without a build, the plain files are served as before.
+ASSET_DIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist')
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def load_asset_manifest():
+    try:
+        with open(os.path.join(ASSET_DIST_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@bp.app_url_defaults
+def fingerprint_static_url(endpoint, values):
+    asset_manifest = current_app.extensions['asset_manifest']
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = 'dist/' + asset_manifest[values['filename']]
+
+@bp.route('/static/dist/<path:filename>')
+def static_bundle(filename):
+    # The manifest keeps its name between builds
+    if filename == 'manifest.json':
+        return send_from_directory(ASSET_DIST_DIR, filename)
+
+    # Bundle names change with their content, so they can be cached forever
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in ASSET_ENCODINGS:
+        path = safe_join(ASSET_DIST_DIR, filename + suffix)
+        if request.accept_encodings[encoding] and path and os.path.isfile(path):
+            response = send_from_directory(ASSET_DIST_DIR, filename + suffix, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSET_DIST_DIR, filename, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/api/salary', methods=['GET', 'POST'])
+def salary():
+    if request.method == 'POST':
+        return save_salary(request.json)
     
+    conn = connect_db()
+    c = conn.cursor()
+    c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
+    salary = c.fetchone()[0]
     conn.close()
+    return jsonify({"salary": salary})
 
-def migrate_data():
-    conn = sqlite3.connect('expenses.db')
+def save_salary(data):
+    conn = connect_db()
     c = conn.cursor()
     
-    # Check if expenses table has category column
-    c.execute("PRAGMA table_info(expenses)")
-    columns = [col[1] for col in c.fetchall()]
-    
-    if 'category' not in columns:
-        # Add category column to expenses table
-        c.execute("ALTER TABLE expenses ADD COLUMN category TEXT DEFAULT 'Fixed Expenses'")
-        conn.commit()
-        print("Added category column to expenses table")
-    
-    # Assign all existing expenses to Fixed Expenses category (default)
-    c.execute("UPDATE expenses SET category = 'Fixed Expenses' WHERE category IS NULL")
-    conn.commit()
-    print("Updated existing expenses with default category")
-    
-    # Initialize budget allocations for current month
-    current_month = datetime.now().strftime("%Y-%m")
+    new_salary = data.get('salary', 0)
+    old_salary = 0
     
-    # Get monthly salary
+    # Get the old salary
     c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
-    monthly_salary = c.fetchone()[0]
+    old_salary = c.fetchone()[0]
     
-    # Get budget categories
-    c.execute("SELECT id, name, percentage FROM budget_categories")
-    categories = c.fetchall()
+    # Update the salary
+    c.execute("UPDATE user_info SET monthly_salary = ? WHERE id = 1", (new_salary,))
+    conn.commit()
     
-    # For each category, set up allocation for current month
-    for cat_id, cat_name, percentage in categories:
-        # Calculate allocated amount
-        allocated_amount = monthly_salary * percentage
+    # Get current month
+    current_month = datetime.now().strftime("%Y-%m")
+    
+    # Recalculate budget allocations for the current month
+    c.execute("SELECT id, percentage FROM budget_categories")
+    for cat_id, percentage in c.fetchall():
+        allocated_amount = new_salary * percentage
         
-        # Check if allocation exists
+        # Check if an allocation exists for the current month
         c.execute(
-            "SELECT COUNT(*) FROM budget_allocations WHERE month = ? AND category_id = ?",
+            "SELECT id, allocated_amount, actual_amount FROM budget_allocations WHERE month = ? AND category_id = ?",
             (current_month, cat_id)
         )
+        allocation = c.fetchone()
         
-        if c.fetchone()[0] == 0:
-            # Create new allocation, default actual to 0
+        if allocation:
+            alloc_id, old_allocated, actual = allocation
+            
+            # If we have existing transactions, we need to recalculate proportionally
+            if old_salary > 0 and actual > 0:
+                # Calculate the percentage of the actual spend relative to old allocation
+                proportion_spent = actual / old_allocated
+                
+                # Only adjust if the proportion is significant (to avoid division by zero issues)
+                if proportion_spent > 0:
+                    # Determine if we need to adjust the actual spend
+                    if new_salary > old_salary:
+                        # If salary increased, keep actual the same
+                        pass
+                    else:
+                        # If salary decreased and proportion spent is high, adjust actual proportionally
+                        # but only if it would exceed the new allocation
+                        if actual > allocated_amount:
+                            # Ensure we don't reduce below what's already spent
+                            new_actual = max(actual, allocated_amount)
+                            c.execute(
+                                "UPDATE budget_allocations SET actual_amount = ? WHERE id = ?",
+                                (new_actual, alloc_id)
+                            )
+            
+            # Update the allocated amount regardless
             c.execute(
-                "INSERT INTO budget_allocations (month, category_id, allocated_amount, actual_amount) VALUES (?, ?, ?, 0)",
-                (current_month, cat_id, allocated_amount)
+                "UPDATE budget_allocations SET allocated_amount = ? WHERE id = ?",
+                (allocated_amount, alloc_id)
             )
-    
-    # Calculate actual amounts for each category
-    c.execute("SELECT category, SUM(amount) FROM expenses GROUP BY category")
-    category_totals = c.fetchall()
-    
-    for category, total in category_totals:
-        # Get category ID
-        c.execute("SELECT id FROM budget_categories WHERE name = ?", (category,))
-        cat_id_result = c.fetchone()
-        
-        if cat_id_result:
-            cat_id = cat_id_result[0]
-            
-            # Update all budgets for this category
+        else:
+            # Create a new allocation
             c.execute(
-                "UPDATE budget_allocations SET actual_amount = ? WHERE category_id = ? AND month = ?",
-                (total, cat_id, current_month)
+                "INSERT INTO budget_allocations (month, category_id, allocated_amount, actual_amount) VALUES (?, ?, ?, ?)",
+                (current_month, cat_id, allocated_amount, 0)
             )
     
     conn.commit()
     conn.close()
-    print("Migration complete")
+    return jsonify({"status": "success"})
 
-# Routes
-@app.route('/')
-def index():
-    return render_template('index.html', active_page="expenses")
+# Newest first; the grid pages through it with LIMIT/OFFSET
+EXPENSE_LIST_QUERY = "SELECT id, date, description, amount, currency, category FROM expenses ORDER BY date DESC, id DESC"
 
-@app.route('/todos')
-def todos():
-    return render_template('todos.html', active_page="todos")
+@bp.route('/api/expenses', methods=['GET'])
+def get_expenses():
+    conn = connect_db()
+    c = conn.cursor()
+    
+    query = EXPENSE_LIST_QUERY
+    params = []
 
-@app.route('/investments')
-def investments():
-    return render_template('investments.html', active_page="investments")
+    # Change-feed position of this snapshot, for later /api/sync calls
+    seq = current_change_seq(c)
 
-@app.route('/transfers')
-def transfers():
-    return render_template('transfers.html', active_page='transfers')
+    # Optional paging (?limit=&offset=) for the grid; the total row count
+    # goes in X-Total-Count so the body stays a plain list
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if limit is not None:
+        c.execute("SELECT COUNT(*) FROM expenses")
+        total = c.fetchone()[0]
+        query += " LIMIT ? OFFSET ?"
+        params = [max(limit, 0), max(offset, 0)]
 
-@app.route('/api/salary', methods=['GET', 'POST'])
-def salary():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    if request.method == 'POST':
-        data = request.json
-        new_salary = data.get('salary', 0)
-        old_salary = 0
-        
-        # Get the old salary
-        c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
-        old_salary = c.fetchone()[0]
-        
-        # Update the salary
-        c.execute("UPDATE user_info SET monthly_salary = ? WHERE id = 1", (new_salary,))
-        conn.commit()
-        
-        # Get current month
-        current_month = datetime.now().strftime("%Y-%m")
-        
-        # Recalculate budget allocations for the current month
-        c.execute("SELECT id, percentage FROM budget_categories")
-        for cat_id, percentage in c.fetchall():
-            allocated_amount = new_salary * percentage
-            
-            # Check if an allocation exists for the current month
-            c.execute(
-                "SELECT id, allocated_amount, actual_amount FROM budget_allocations WHERE month = ? AND category_id = ?",
-                (current_month, cat_id)
-            )
-            allocation = c.fetchone()
-            
-            if allocation:
-                alloc_id, old_allocated, actual = allocation
-                
-                # If we have existing transactions, we need to recalculate proportionally
-                if old_salary > 0 and actual > 0:
-                    # Calculate the percentage of the actual spend relative to old allocation
-                    proportion_spent = actual / old_allocated
-                    
-                    # Only adjust if the proportion is significant (to avoid division by zero issues)
-                    if proportion_spent > 0:
-                        # Determine if we need to adjust the actual spend
-                        if new_salary > old_salary:
-                            # If salary increased, keep actual the same
-                            pass
-                        else:
-                            # If salary decreased and proportion spent is high, adjust actual proportionally
-                            # but only if it would exceed the new allocation
-                            if actual > allocated_amount:
-                                # Ensure we don't reduce below what's already spent
-                                new_actual = max(actual, allocated_amount)
-                                c.execute(
-                                    "UPDATE budget_allocations SET actual_amount = ? WHERE id = ?",
-                                    (new_actual, alloc_id)
-                                )
-                
-                # Update the allocated amount regardless
-                c.execute(
-                    "UPDATE budget_allocations SET allocated_amount = ? WHERE id = ?",
-                    (allocated_amount, alloc_id)
-                )
-            else:
-                # Create a new allocation
-                c.execute(
-                    "INSERT INTO budget_allocations (month, category_id, allocated_amount, actual_amount) VALUES (?, ?, ?, ?)",
-                    (current_month, cat_id, allocated_amount, 0)
-                )
-        
-        conn.commit()
-        conn.close()
-        return jsonify({"status": "success"})
+    c.execute(query, params)
+    if wants_columnar():
+        # Rows go out as they come from SQLite
+        expenses = {"columns": [d[0] for d in c.description], "rows": c.fetchall()}
     else:
-        c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
-        salary = c.fetchone()[0]
-        conn.close()
-        return jsonify({"salary": salary})
+        expenses = [
+            {
+                "id": row[0],
+                "date": row[1],
+                "description": row[2],
+                "amount": row[3],
+                "currency": row[4],
+                "category": row[5]
+            }
+            for row in c.fetchall()
+        ]
+    conn.close()
 
-@app.route('/api/expenses', methods=['GET'])
-def get_expenses():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    
-    c.execute("SELECT id, date, description, amount, currency, category FROM expenses ORDER BY date DESC")
-    expenses = [
-        {
-            "id": row[0],
-            "date": row[1],
-            "description": row[2],
-            "amount": row[3],
-            "currency": row[4],
-            "category": row[5]
-        }
-        for row in c.fetchall()
+    response = jsonify(expenses)
+    response.headers['X-Sync-Seq'] = str(seq)
+    if limit is not None:
+        response.headers['X-Total-Count'] = str(total)
+    return response
+
+def expense_summary(c):
+    c.execute("SELECT currency, category, SUM(amount), COUNT(*) FROM expenses GROUP BY currency, category")
+    return [
+        {"currency": currency, "category": category, "amount": amount, "count": count}
+        for currency, category, amount, count in c.fetchall()
     ]
+
+@bp.route('/api/expenses/summary', methods=['GET'])
+def get_expense_summary():
+    # Totals per currency and category over every expense, so the grid's
+    # totals and budgets don't need the full list while it loads pages
+    conn = connect_db()
+    c = conn.cursor()
+    summary = expense_summary(c)
     conn.close()
-    return jsonify(expenses)
+    return jsonify(summary)
 
-@app.route('/api/expenses/<int:expense_id>', methods=['DELETE'])
+@bp.route('/api/expenses/<int:expense_id>', methods=['DELETE'])
 def delete_expense(expense_id):
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # First get the expense details for updating allocations
@@ -331,17 +1632,8 @@ def delete_expense(expense_id):
     # If expense was in ARS, we need to restore the balance in the Belo account
     if currency == 'ARS':
         try:
-            # Get current exchange rate from cripto API
-            try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    # Use "compra" rate (when buying ARS / selling USD)
-                    rate = response.json().get("compra", 1225)
-                else:
-                    rate = 1225
-            except Exception as e:
-                print(f"Error getting exchange rate: {str(e)}")
-                rate = 1225
+            # Use the cripto "compra" rate (when buying ARS / selling USD)
+            rate = get_dolar_rate('cripto')['compra']
             
             # Calculate USD equivalent of the ARS expense
             usd_amount = amount / rate
@@ -364,7 +1656,7 @@ def delete_expense(expense_id):
                 new_ars_balance = ars_balance + amount
                 c.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_ars_balance, ars_id))
         except Exception as e:
-            print(f"Error updating account balances for deleted ARS expense: {str(e)}")
+            log.error("Error updating account balances for deleted ARS expense: %s", e)
             # Continue with expense deletion even if account update fails
     
     # Get category ID
@@ -381,18 +1673,7 @@ def delete_expense(expense_id):
         # Convert amount to USD if needed
         amount_in_usd = amount
         if currency == 'ARS':
-            # Get current exchange rate
-            try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    rate = response.json().get("compra", 1225)
-                    amount_in_usd = amount / rate
-                else:
-                    # Fallback rate
-                    amount_in_usd = amount / 1225
-            except:
-                # Fallback rate if API fails
-                amount_in_usd = amount / 1225
+            amount_in_usd = amount / get_dolar_rate('cripto')['compra']
         
         c.execute(
             "SELECT id, actual_amount FROM budget_allocations WHERE month = ? AND category_id = ?", 
@@ -413,9 +1694,11 @@ def delete_expense(expense_id):
     return jsonify({"status": "success"})
 
 # Backward compatibility route for DELETE
-@app.route('/api/expenses', methods=['DELETE'])
+@bp.route('/api/expenses', methods=['DELETE'])
 def delete_expense_compat():
-    data = request.json
+    return delete_expense_by_body(request.json)
+
+def delete_expense_by_body(data):
     expense_id = data.get('id')
     
     if not expense_id:
@@ -423,47 +1706,67 @@ def delete_expense_compat():
     
     return delete_expense(expense_id)
 
-@app.route('/api/exchange-rate/blue', methods=['GET'])
+def exchange_rate_response(kind):
+    quote = get_dolar_rate(kind)
+    if quote['fallback']:
+        return jsonify({"error": "Failed to fetch exchange rate"}), 500
+    return jsonify({
+        "usd_to_ars": quote['venta'],
+        "updated": quote['updated'],
+        "stale": quote['stale']
+    })
+
+@bp.route('/api/exchange-rate/blue', methods=['GET'])
+@upstream_view('rates')
 def exchange_rate_blue():
-    try:
-        response = requests.get('https://dolarapi.com/v1/dolares/blue')
-        if response.status_code == 200:
-            data = response.json()
-            return jsonify({
-                "usd_to_ars": data.get("venta", 0),
-                "updated": data.get("fechaActualizacion", "")
-            })
-        else:
-            return jsonify({"error": "Failed to fetch exchange rate"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return exchange_rate_response('blue')
 
-@app.route('/api/exchange-rate/tarjeta', methods=['GET'])
+@bp.route('/api/exchange-rate/tarjeta', methods=['GET'])
+@upstream_view('rates')
 def exchange_rate_tarjeta():
-    try:
-        response = requests.get('https://dolarapi.com/v1/dolares/tarjeta')
-        if response.status_code == 200:
-            data = response.json()
-            return jsonify({
-                "usd_to_ars": data.get("venta", 0),
-                "updated": data.get("fechaActualizacion", "")
-            })
-        else:
-            return jsonify({"error": "Failed to fetch exchange rate"}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return exchange_rate_response('tarjeta')
+
+def exchange_rate_entry(quote):
+    return {
+        "usd_to_ars": quote['venta'],
+        "compra": quote['compra'],
+        "venta": quote['venta'],
+        "updated": quote['updated'],
+        "stale": quote['stale']
+    }
+
+@bp.route('/api/exchange-rates', methods=['GET'])
+@upstream_view('rates')
+def exchange_rates():
+    kinds = request.args.get('types')
+    kinds = [k for k in kinds.split(',') if k in FALLBACK_DOLAR_RATES] if kinds else None
+
+    rates = {}
+    for kind, quote in get_dolar_rates(kinds).items():
+        # Quotes we have never actually fetched are left out, same as the
+        # single-rate endpoints answering with an error
+        if quote['fallback']:
+            continue
+        rates[kind] = exchange_rate_entry(quote)
+
+    if not rates:
+        return jsonify({"error": "Failed to fetch exchange rates"}), 500
+    return jsonify(rates)
 
 # Legacy endpoint for backward compatibility
-@app.route('/api/exchange-rate', methods=['GET'])
+@bp.route('/api/exchange-rate', methods=['GET'])
+@upstream_view('rates')
 def exchange_rate():
     return exchange_rate_blue()
 
-@app.route('/api/expenses/<int:expense_id>', methods=['PUT'])
+@bp.route('/api/expenses/<int:expense_id>', methods=['PUT'])
 def update_expense(expense_id):
-    conn = sqlite3.connect('expenses.db')
+    return save_expense_changes(expense_id, request.json)
+
+def save_expense_changes(expense_id, data):
+    conn = connect_db()
     c = conn.cursor()
     
-    data = request.json
     date = data.get('date')
     description = data.get('description')
     amount = data.get('amount')
@@ -487,11 +1790,7 @@ def update_expense(expense_id):
         # Case 1: Was ARS before -> Need to restore USD in Belo account
         if old_currency == 'ARS':
             try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    old_rate = response.json().get("compra", 1225)
-                else:
-                    old_rate = 1225
+                old_rate = get_dolar_rate('cripto')['compra']
                 
                 # Calculate the USD that was deducted
                 old_usd_amount = old_amount / old_rate
@@ -516,16 +1815,12 @@ def update_expense(expense_id):
                         updated_ars_balance = ars_balance + old_amount
                         c.execute("UPDATE accounts SET balance = ? WHERE id = ?", (updated_ars_balance, ars_id))
             except Exception as e:
-                print(f"Error refunding Belo account for old ARS expense: {str(e)}")
+                log.error("Error refunding Belo account for old ARS expense: %s", e)
         
         # Case 2: Is ARS now -> Need to deduct USD from Belo account
         if currency == 'ARS':
             try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    new_rate = response.json().get("compra", 1225)
-                else:
-                    new_rate = 1225
+                new_rate = get_dolar_rate('cripto')['compra']
                 
                 # Calculate new USD amount to deduct
                 new_usd_amount = amount / new_rate
@@ -568,7 +1863,7 @@ def update_expense(expense_id):
                             
                         c.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_ars_balance, ars_id))
             except Exception as e:
-                print(f"Error updating Belo account for new ARS expense: {str(e)}")
+                log.error("Error updating Belo account for new ARS expense: %s", e)
                 # Continue with expense update
         
         # Update the expense
@@ -580,34 +1875,12 @@ def update_expense(expense_id):
         # Convert old amount to USD if needed
         old_amount_in_usd = old_amount
         if old_currency == 'ARS':
-            # Get current exchange rate
-            try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    rate = response.json().get("compra", 1225)
-                    old_amount_in_usd = old_amount / rate
-                else:
-                    # Fallback rate
-                    old_amount_in_usd = old_amount / 1225
-            except:
-                # Fallback rate if API fails
-                old_amount_in_usd = old_amount / 1225
+            old_amount_in_usd = old_amount / get_dolar_rate('cripto')['compra']
         
         # Convert new amount to USD if needed
         amount_in_usd = amount
         if currency == 'ARS':
-            # Get current exchange rate
-            try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    rate = response.json().get("compra", 1225)
-                    amount_in_usd = amount / rate
-                else:
-                    # Fallback rate
-                    amount_in_usd = amount / 1225
-            except:
-                # Fallback rate if API fails
-                amount_in_usd = amount / 1225
+            amount_in_usd = amount / get_dolar_rate('cripto')['compra']
         
         # Update budget allocations - first remove from old category
         if old_category:
@@ -677,9 +1950,9 @@ def update_expense(expense_id):
         conn.close()
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/api/budget-allocations', methods=['GET'])
+@bp.route('/api/budget-allocations', methods=['GET'])
 def budget_allocations():
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Get query parameters or use current month
@@ -688,22 +1961,20 @@ def budget_allocations():
         # Default to current month
         month = datetime.now().strftime("%Y-%m")
     
-    # Get the monthly salary
+    # Get current exchange rates for conversions
+    rates = get_dolar_rates(['blue', 'tarjeta'])
+    response = budget_allocation_summary(c, month, rates['blue']['venta'])
+    conn.commit()
+    
+    conn.close()
+    return jsonify(response)
+
+def budget_allocation_summary(c, month, blue_rate):
+    # Actual spend per category for the month (ARS converted at the blue
+    # rate), also stored in budget_allocations; the caller commits
     c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
     monthly_salary = c.fetchone()[0]
     
-    # Get current exchange rates for conversions
-    try:
-        blue_response = requests.get('https://dolarapi.com/v1/dolares/blue')
-        tarjeta_response = requests.get('https://dolarapi.com/v1/dolares/tarjeta')
-        
-        blue_rate = blue_response.json().get("venta", 1150) if blue_response.status_code == 200 else 1150
-        tarjeta_rate = tarjeta_response.json().get("venta", 1150) if tarjeta_response.status_code == 200 else 1150
-    except:
-        # Fallback rates if API fails
-        blue_rate = 1150
-        tarjeta_rate = 1150
-    
     # Get all budget categories
     c.execute("SELECT id, name, percentage FROM budget_categories")
     categories = c.fetchall()
@@ -760,8 +2031,6 @@ def budget_allocations():
                 (month, cat_id, allocated, actual)
             )
         
-        conn.commit()
-        
         total_actual += actual
         
         # Calculate remaining balance
@@ -788,7 +2057,7 @@ def budget_allocations():
     total_allocated = monthly_salary
     total_remaining = total_allocated - total_actual
     
-    response = {
+    return {
         "month": month,
         "salary": monthly_salary,
         "total_allocated": total_allocated,
@@ -796,13 +2065,10 @@ def budget_allocations():
         "total_remaining": total_remaining,
         "allocations": allocations
     }
-    
-    conn.close()
-    return jsonify(response)
 
-@app.route('/api/budget-categories', methods=['GET'])
+@bp.route('/api/budget-categories', methods=['GET'])
 def budget_categories():
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     c.execute("SELECT id, name, percentage FROM budget_categories")
@@ -818,27 +2084,29 @@ def budget_categories():
     conn.close()
     return jsonify(categories)
 
-@app.route('/api/budget-allocations/redistribute', methods=['POST'])
+@bp.route('/api/budget-allocations/redistribute', methods=['POST'])
 def redistribute_budget():
-    conn = sqlite3.connect('expenses.db')
+    return apply_budget_redistribution(request.json)
+
+def apply_budget_redistribution(data):
+    conn = connect_db()
     c = conn.cursor()
     
-    data = request.json
     adjustments = data.get('adjustments', [])
     month = data.get('month', datetime.now().strftime("%Y-%m"))
     
-    print(f"Received budget redistribution request: {len(adjustments)} categories")
+    log.debug("Received budget redistribution request: %d categories", len(adjustments))
     
     # Validate total percentage still equals 100%
     total_percentage = 0
     for adj in adjustments:
         total_percentage += adj.get('percentage', 0) / 100  # Convert from percentage to decimal
     
-    print(f"Total percentage: {total_percentage * 100}%")
+    log.debug("Total percentage: %s%%", total_percentage * 100)
     
     if abs(total_percentage - 1.0) > 0.01:  # Allow small rounding errors
         conn.close()
-        print(f"Error: Total percentage ({total_percentage * 100}%) must equal 100%")
+        log.warning("Budget redistribution rejected: total percentage %s%% must equal 100%%", total_percentage * 100)
         return jsonify({
             "status": "error", 
             "message": f"Total percentage ({total_percentage * 100}%) must equal 100%"
@@ -849,7 +2117,7 @@ def redistribute_budget():
         cat_id = adj.get('id')
         percentage = adj.get('percentage') / 100  # Convert from percentage to decimal
         
-        print(f"Updating category {cat_id} to {percentage * 100}%")
+        log.debug("Updating category %s to %s%%", cat_id, percentage * 100)
         
         c.execute(
             "UPDATE budget_categories SET percentage = ? WHERE id = ?",
@@ -860,7 +2128,7 @@ def redistribute_budget():
     c.execute("SELECT monthly_salary FROM user_info WHERE id = 1")
     monthly_salary = c.fetchone()[0]
     
-    print(f"Monthly salary: ${monthly_salary}")
+    log.debug("Monthly salary: $%s", monthly_salary)
     
     # Recalculate all allocations for the current month
     c.execute("SELECT id, percentage FROM budget_categories")
@@ -876,14 +2144,14 @@ def redistribute_budget():
         
         if allocation:
             # Update existing allocation
-            print(f"Updating allocation for category {cat_id}, month {month}: ${allocated_amount}")
+            log.debug("Updating allocation for category %s, month %s: $%s", cat_id, month, allocated_amount)
             c.execute(
                 "UPDATE budget_allocations SET allocated_amount = ? WHERE id = ?",
                 (allocated_amount, allocation[0])
             )
         else:
             # Create new allocation
-            print(f"Creating new allocation for category {cat_id}, month {month}: ${allocated_amount}")
+            log.debug("Creating new allocation for category %s, month %s: $%s", cat_id, month, allocated_amount)
             c.execute(
                 "INSERT INTO budget_allocations (month, category_id, allocated_amount, actual_amount) VALUES (?, ?, ?, ?)",
                 (month, cat_id, allocated_amount, 0)
@@ -892,15 +2160,17 @@ def redistribute_budget():
     conn.commit()
     conn.close()
     
-    print("Budget redistribution completed successfully")
+    log.info("Budget redistribution completed for %d categories", len(adjustments))
     return jsonify({"status": "success"})
 
-@app.route('/api/expenses', methods=['POST'])
+@bp.route('/api/expenses', methods=['POST'])
 def add_expense():
-    conn = sqlite3.connect('expenses.db')
+    return create_expense(request.json)
+
+def create_expense(data):
+    conn = connect_db()
     c = conn.cursor()
     
-    data = request.json
     date = data.get('date', datetime.now().strftime("%Y-%m-%d"))
     description = data.get('description', '')
     amount = data.get('amount', 0)
@@ -925,17 +2195,8 @@ def add_expense():
             if belo_account:
                 belo_id, belo_balance = belo_account
                 
-                # Get current exchange rate from cripto API
-                try:
-                    response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                    if response.status_code == 200:
-                        # Use "compra" rate (when buying ARS / selling USD)
-                        rate = response.json().get("compra", 1225)
-                    else:
-                        rate = 1225
-                except Exception as e:
-                    print(f"Error getting exchange rate: {str(e)}")
-                    rate = 1225
+                # Use the cripto "compra" rate (when buying ARS / selling USD)
+                rate = get_dolar_rate('cripto')['compra']
                 
                 # Calculate USD equivalent of the ARS expense
                 usd_amount = amount / rate
@@ -959,7 +2220,7 @@ def add_expense():
                     conn.close()
                     return jsonify({"status": "error", "message": "Insufficient balance in Belo account for this expense"}), 400
         except Exception as e:
-            print(f"Error updating account balances for ARS expense: {str(e)}")
+            log.error("Error updating account balances for ARS expense: %s", e)
             # Continue with expense creation even if account update fails
     
     # Insert the expense
@@ -990,18 +2251,7 @@ def add_expense():
         # Convert amount to USD if needed
         amount_in_usd = amount
         if currency == 'ARS':
-            # Get current exchange rate
-            try:
-                response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                if response.status_code == 200:
-                    rate = response.json().get("compra", 1225)
-                    amount_in_usd = amount / rate
-                else:
-                    # Fallback rate
-                    amount_in_usd = amount / 1225
-            except:
-                # Fallback rate if API fails
-                amount_in_usd = amount / 1225
+            amount_in_usd = amount / get_dolar_rate('cripto')['compra']
         
         if allocation:
             # Update existing allocation
@@ -1029,14 +2279,449 @@ def add_expense():
     conn.close()
     return jsonify({"id": last_id, "status": "success"})
 
-@app.route('/api/todos', methods=['GET'])
+# Server-side formulas
+# A small spreadsheet-style language over whole tables, e.g.
+#   SUM(expenses[category="Savings", month="2026-09"].amount_usd) / 12
+# Every aggregate compiles to one indexed SQL query; results are cached per
+# aggregate and keyed on the change feed's latest seq, so a write invalidates them.
+FORMULA_SOURCES = {
+    'expenses': {
+        'date': 'date',
+        'fields': {
+            'amount': ('amount', []),
+            'amount_usd': ("CASE WHEN currency = 'ARS' THEN amount / ? ELSE amount END", ['blue']),
+            'amount_ars': ("CASE currency WHEN 'ARS' THEN amount WHEN 'USD-Tarjeta' THEN amount * ? ELSE amount * ? END", ['tarjeta', 'blue']),
+        },
+        'filters': {'category': 'category', 'currency': 'currency', 'description': 'description', 'date': 'date'},
+    },
+    'investments': {
+        'date': 'purchase_date',
+        'fields': {
+            'purchase_price': ('purchase_price', []),
+            'current_price': ('current_price', []),
+            'quantity': ('quantity', []),
+            'cost': ('purchase_price * quantity', []),
+            'value': ('current_price * quantity', []),
+        },
+        'filters': {'name': 'name', 'investment_type': 'investment_type', 'date': 'purchase_date'},
+    },
+}
+FORMULA_FUNCTIONS = {'SUM': 'TOTAL', 'AVG': 'AVG', 'AVERAGE': 'AVG', 'COUNT': 'COUNT', 'MIN': 'MIN', 'MAX': 'MAX'}
+FORMULA_OPERATORS = ('=', '!=', '>=', '<=', '>', '<')
+FORMULA_CACHE_SIZE = 512
+
+FORMULA_TOKEN = re.compile(r'''\s*(?:
+    (?P<number>\d+(?:\.\d+)?)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>!=|>=|<=|[-+*/()\[\].,=<>])
+)''', re.VERBOSE)
+
+_formula_cache = {}
+_formula_cache_lock = threading.Lock()
+
+class FormulaError(ValueError):
+    pass
+
+def tokenize_formula(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = FORMULA_TOKEN.match(text, pos)
+        if not match or match.end() == pos:
+            raise FormulaError(f"Unexpected character at position {pos}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+def parse_formula(text):
+    # Recursive descent into nested tuples:
+    #   ('num', x), ('neg', node), ('bin', op, left, right),
+    #   ('agg', func, source, field, ((filter, op, value), ...))
+    tokens = tokenize_formula(text[1:] if text.startswith('=') else text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def take(expected=None):
+        nonlocal pos
+        kind, value = peek()
+        if kind is None or (expected is not None and value != expected):
+            raise FormulaError(f"Expected '{expected}'" if expected else "Unexpected end of formula")
+        pos += 1
+        return kind, value
+
+    def expression():
+        node = term()
+        while peek()[1] in ('+', '-'):
+            node = ('bin', take()[1], node, term())
+        return node
+
+    def term():
+        node = factor()
+        while peek()[1] in ('*', '/'):
+            node = ('bin', take()[1], node, factor())
+        return node
+
+    def factor():
+        kind, value = take()
+        if kind == 'number':
+            return ('num', float(value))
+        if value == '-':
+            return ('neg', factor())
+        if value == '(':
+            node = expression()
+            take(')')
+            return node
+        if kind == 'name' and value.upper() in FORMULA_FUNCTIONS:
+            take('(')
+            node = aggregate(value.upper())
+            take(')')
+            return node
+        raise FormulaError(f"Unexpected '{value}'")
+
+    def aggregate(func):
+        source = take()[1]
+        if source not in FORMULA_SOURCES:
+            raise FormulaError(f"Unknown range '{source}'")
+        spec = FORMULA_SOURCES[source]
+        filters = []
+        if peek()[1] == '[':
+            take('[')
+            while peek()[1] != ']':
+                name = take()[1]
+                if name not in spec['filters'] and name not in ('month', 'year'):
+                    raise FormulaError(f"Unknown filter '{name}' for {source}")
+                op = take()[1]
+                if op not in FORMULA_OPERATORS:
+                    raise FormulaError(f"Invalid operator '{op}'")
+                kind, value = take()
+                if kind not in ('string', 'number'):
+                    raise FormulaError(f"Expected a value for '{name}'")
+                filters.append((name, op, value))
+                if peek()[1] == ',':
+                    take(',')
+            take(']')
+        take('.')
+        field = take()[1]
+        if field not in spec['fields']:
+            raise FormulaError(f"Unknown field '{field}' for {source}")
+        # Sort filters so equivalent formulas share cache entries
+        return ('agg', func, source, field, tuple(sorted(filters, key=lambda f: (f[0], f[1], str(f[2])))))
+
+    node = expression()
+    if pos < len(tokens):
+        raise FormulaError(f"Unexpected '{tokens[pos][1]}'")
+    return node
+
+def period_bounds(name, value):
+    # month="2026-09" / year="2026" as a half-open date range, so the
+    # query can use the date index instead of strftime() on every row
+    try:
+        if name == 'month':
+            start = datetime.strptime(str(value), "%Y-%m")
+            end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        else:
+            start = datetime(int(float(value)), 1, 1)
+            end = datetime(start.year + 1, 1, 1)
+    except ValueError:
+        raise FormulaError(f"Invalid {name} '{value}'")
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+def compile_formula_aggregate(node, rates):
+    _, func, source, field, filters = node
+    spec = FORMULA_SOURCES[source]
+    column, rate_params = spec['fields'][field]
+    params = [rates[kind] for kind in rate_params]
+    where = []
+    for name, op, value in filters:
+        if name in ('month', 'year'):
+            if op != '=':
+                raise FormulaError(f"Only '=' is supported for {name}")
+            where.append(f"{spec['date']} >= ? AND {spec['date']} < ?")
+            params.extend(period_bounds(name, value))
+        else:
+            where.append(f"{spec['filters'][name]} {op} ?")
+            params.append(value)
+    sql = f"SELECT {FORMULA_FUNCTIONS[func]}({column}) FROM {source}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql, params
+
+def evaluate_formula(node, c, seq, rates):
+    kind = node[0]
+    if kind == 'num':
+        return node[1]
+    if kind == 'neg':
+        return -evaluate_formula(node[1], c, seq, rates)
+    if kind == 'bin':
+        left = evaluate_formula(node[2], c, seq, rates)
+        right = evaluate_formula(node[3], c, seq, rates)
+        if node[1] == '+':
+            return left + right
+        if node[1] == '-':
+            return left - right
+        if node[1] == '*':
+            return left * right
+        if right == 0:
+            raise FormulaError("Division by zero")
+        return left / right
+
+    sql, params = compile_formula_aggregate(node, rates)
+    key = (sql, tuple(params), seq)
+    with _formula_cache_lock:
+        if key in _formula_cache:
+            return _formula_cache[key]
+    c.execute(sql, params)
+    value = c.fetchone()[0] or 0
+    with _formula_cache_lock:
+        if len(_formula_cache) >= FORMULA_CACHE_SIZE:
+            _formula_cache.pop(next(iter(_formula_cache)))
+        _formula_cache[key] = value
+    return value
+
+def formula_aggregates(node):
+    if node[0] == 'agg':
+        return [node]
+    if node[0] == 'neg':
+        return formula_aggregates(node[1])
+    if node[0] == 'bin':
+        return formula_aggregates(node[2]) + formula_aggregates(node[3])
+    return []
+
+@bp.route('/api/formula/eval', methods=['GET', 'POST'])
+def formula_eval():
+    if request.method == 'POST':
+        formula = (request.get_json(silent=True) or {}).get('formula')
+    else:
+        formula = request.args.get('formula')
+    if not formula:
+        return jsonify({"status": "error", "message": "Formula is required"}), 400
+
+    try:
+        node = parse_formula(formula)
+    except FormulaError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # Only look up exchange rates when a converted field is used
+    rate_kinds = set()
+    for _, _, source, field, _ in formula_aggregates(node):
+        rate_kinds.update(FORMULA_SOURCES[source]['fields'][field][1])
+    rates = {kind: quote['venta'] for kind, quote in get_dolar_rates(sorted(rate_kinds)).items()} if rate_kinds else {}
+
+    conn = connect_db()
+    c = conn.cursor()
+    seq = current_change_seq(c)
+    try:
+        value = evaluate_formula(node, c, seq, rates)
+    except FormulaError as e:
+        conn.close()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    conn.close()
+
+    return jsonify({"formula": formula, "value": value, "seq": seq})
+
+# Offline write queue replay
+# The service worker queues writes made while offline and sends them here in
+# order. PUT/DELETE mutations carry the row as the client last saw it
+# ("expected"); if the row has since been deleted or any of those fields
+# changed on the server, the mutation is skipped and reported as a conflict.
+# Mutations are applied by calling the same functions the routes use.
+SYNC_ROW_PATH = re.compile(r'^/api/(expenses|investments|todos)/(\d+)(?:/|$)')
+
+# (endpoint, method) -> handler(body, **view_args) for the writes that can be queued
+SYNC_WRITE_HANDLERS = {
+    ('main.salary', 'POST'): lambda data: save_salary(data),
+    ('main.add_expense', 'POST'): lambda data: create_expense(data),
+    ('main.update_expense', 'PUT'): lambda data, expense_id: save_expense_changes(expense_id, data),
+    ('main.delete_expense', 'DELETE'): lambda data, expense_id: delete_expense(expense_id),
+    ('main.delete_expense_compat', 'DELETE'): lambda data: delete_expense_by_body(data),
+    ('main.redistribute_budget', 'POST'): lambda data: apply_budget_redistribution(data),
+    ('main.add_todo', 'POST'): lambda data: create_todo(data),
+    ('main.toggle_todo', 'POST'): lambda data, todo_id: toggle_todo(todo_id),
+    ('main.delete_todo', 'DELETE'): lambda data, todo_id: delete_todo(todo_id),
+    ('main.copy_todo', 'POST'): lambda data, todo_id: copy_todo_to_date(todo_id, data),
+    ('main.update_time_spent', 'POST'): lambda data, todo_id: save_time_spent(todo_id, data),
+    ('main.update_planned_date', 'POST'): lambda data, todo_id: save_planned_date(todo_id, data),
+    ('main.add_investment', 'POST'): lambda data: create_investment(data),
+    ('main.update_investment', 'PUT'): lambda data, investment_id: save_investment_changes(investment_id, data),
+    ('main.delete_investment', 'DELETE'): lambda data, investment_id: delete_investment(investment_id),
+    ('main.accounts', 'POST'): lambda data: save_accounts(data),
+    ('main.transfer_list', 'POST'): lambda data: create_transfer(data),
+    ('main.delete_transfer', 'DELETE'): lambda data, transfer_id: delete_transfer(transfer_id),
+}
+
+def sync_values_match(current, expected):
+    if isinstance(current, (int, float)) and isinstance(expected, (int, float)):
+        return abs(current - expected) < 0.005
+    return current == expected
+
+def find_sync_conflict(c, method, path, expected):
+    # Returns (conflict, current_row)
+    match = SYNC_ROW_PATH.match(path)
+    if not match or method not in ('PUT', 'DELETE', 'POST'):
+        return False, None
+    table, row_id = match.group(1), int(match.group(2))
+    c.execute(f"SELECT * FROM {table} WHERE id = ?", (row_id,))
+    row = c.fetchone()
+    if row is None:
+        return True, None
+    current = dict(zip([d[0] for d in c.description], row))
+    for key, value in (expected or {}).items():
+        if key in current and not sync_values_match(current[key], value):
+            return True, current
+    return False, current
+
+# Delta sync
+# Triggers on the tables below log every insert/update as an 'upsert' and
+# every delete as a 'delete' (tombstone) in `changes`, under a monotonic
+# sequence number. Each row keeps only its latest entry, so the log grows
+# with the number of rows, not the number of writes. Clients remember the
+# last seq they saw and ask /api/sync for everything after it.
+SYNC_TABLES = {
+    'expenses': ['id', 'date', 'description', 'amount', 'currency', 'category'],
+    'todos': ['id', 'description', 'created_date', 'completed_date', 'is_completed',
+              'parent_id', 'level', 'planned_date', 'time_spent'],
+    'investments': ['id', 'name', 'purchase_date', 'purchase_price', 'quantity',
+                    'current_price', 'last_updated', 'notes', 'investment_type'],
+    'accounts': ['id', 'name', 'currency', 'balance', 'fee_percent'],
+    'transfers': ['id', 'date', 'amount', 'from_account', 'to_account',
+                  'gross_amount', 'total_fees', 'description'],
+}
+
+def install_change_triggers(c, table):
+    for event, op, row in (('INSERT', 'upsert', 'NEW'), ('UPDATE', 'upsert', 'NEW'), ('DELETE', 'delete', 'OLD')):
+        c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_change
+        AFTER {event} ON {table}
+        BEGIN
+            DELETE FROM changes WHERE tbl = '{table}' AND row_id = {row}.id;
+            INSERT INTO changes (tbl, row_id, op) VALUES ('{table}', {row}.id, '{op}');
+        END
+        ''')
+
+def current_change_seq(c):
+    c.execute("SELECT COALESCE(MAX(seq), 0) FROM changes")
+    return c.fetchone()[0]
+
+def sync_row(table, row):
+    # Same shape as the table's regular GET endpoint
+    item = dict(zip(SYNC_TABLES[table], row))
+    if table == 'todos':
+        item['is_completed'] = bool(item['is_completed'])
+        item['subtasks'] = []
+    elif table == 'investments':
+        price = item['current_price'] if item['current_price'] > 0 else item['purchase_price']
+        item['total_value'] = item['quantity'] * price
+        item['profit_loss'] = item['quantity'] * (item['current_price'] - item['purchase_price']) if item['current_price'] > 0 else 0
+    return item
+
+@bp.route('/api/sync', methods=['GET'])
+def sync_changes():
+    since = request.args.get('since', 0, type=int)
+    tables = [t for t in request.args.get('tables', ','.join(SYNC_TABLES)).split(',') if t]
+    unknown = [t for t in tables if t not in SYNC_TABLES]
+    if unknown:
+        return jsonify({"status": "error", "message": f"Unknown table: {', '.join(unknown)}"}), 400
+
+    conn = connect_db()
+    c = conn.cursor()
+
+    # Everything up to this seq is included; later writes come next time
+    seq = current_change_seq(c)
+
+    # A cursor from the future means the database was replaced: start over
+    if since > seq:
+        conn.close()
+        return jsonify({"seq": seq, "reset": True, "changes": {}})
+
+    changes = {}
+    for table in tables:
+        c.execute(f"""
+            SELECT {', '.join(SYNC_TABLES[table])} FROM {table}
+            WHERE id IN (SELECT row_id FROM changes WHERE tbl = ? AND op = 'upsert' AND seq > ? AND seq <= ?)
+        """, (table, since, seq))
+        upserted = [sync_row(table, row) for row in c.fetchall()]
+
+        c.execute("SELECT row_id FROM changes WHERE tbl = ? AND op = 'delete' AND seq > ? AND seq <= ?",
+                  (table, since, seq))
+        deleted = [row[0] for row in c.fetchall()]
+
+        changes[table] = {"upserted": upserted, "deleted": deleted}
+
+    conn.close()
+    return jsonify({"seq": seq, "reset": False, "changes": changes})
+
+@bp.route('/api/sync/batch', methods=['POST'])
+def sync_batch():
+    mutations = (request.get_json(silent=True) or {}).get('mutations') or []
+    results = []
+    urls = current_app.create_url_adapter(request)
+
+    # Rows already written by this batch. The client took every snapshot
+    # before its first queued write, so later writes to the same row are
+    # not checked against them (they would always conflict).
+    written = set()
+
+    for mutation in mutations:
+        method = str(mutation.get('method', '')).upper()
+        url = urlparse(mutation.get('url') or '')
+        result = {"id": mutation.get('id')}
+
+        try:
+            endpoint, view_args = urls.match(url.path, method=method)
+        except HTTPException:
+            endpoint, view_args = None, {}
+        handler = SYNC_WRITE_HANDLERS.get((endpoint, method))
+        if handler is None:
+            result.update(status=400, response={"status": "error", "message": "Mutation not allowed"})
+            results.append(result)
+            continue
+
+        row = SYNC_ROW_PATH.match(url.path)
+        row = row.groups() if row else None
+        if row not in written:
+            conn = connect_db()
+            conflict, current = find_sync_conflict(conn.cursor(), method, url.path, mutation.get('expected'))
+            conn.close()
+            if conflict:
+                result.update(status=409, conflict=True, current=current)
+                results.append(result)
+                continue
+
+        response = current_app.make_response(handler(mutation.get('body') or {}, **view_args))
+        if row and response.status_code < 400:
+            written.add(row)
+        result.update(status=response.status_code, response=response.get_json(silent=True))
+        results.append(result)
+
+    return jsonify({"results": results})
+
+@bp.route('/api/todos', methods=['GET'])
 def get_todos():
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Get date filter from query parameters
     date_filter = request.args.get('date', None)
+
+    # Change-feed position of this snapshot, for later /api/sync calls
+    seq = current_change_seq(c)
+    todos = fetch_todos(c, date_filter)
+    conn.close()
     
+    # Flat structure is easier to work with for the client
+    response = jsonify_rows(todos)
+    response.headers['X-Sync-Seq'] = str(seq)
+    return response
+
+def fetch_todos(c, date_filter=None):
     query = """
         SELECT id, description, created_date, completed_date, is_completed, parent_id, level, planned_date, time_spent 
         FROM todos 
@@ -1072,14 +2757,13 @@ def get_todos():
         }
         todos.append(todo)
     
-    conn.close()
-    
-    # Flat structure is easier to work with for the client
-    return jsonify(todos)
+    return todos
 
-@app.route('/api/todos', methods=['POST'])
+@bp.route('/api/todos', methods=['POST'])
 def add_todo():
-    data = request.json
+    return create_todo(request.json)
+
+def create_todo(data):
     description = data.get('description', '')
     parent_id = data.get('parent_id', None)
     planned_date = data.get('planned_date', None)
@@ -1087,7 +2771,7 @@ def add_todo():
     if not description:
         return jsonify({"status": "error", "message": "Description is required"}), 400
     
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     now = datetime.now().strftime("%Y-%m-%d")
@@ -1133,9 +2817,9 @@ def add_todo():
     conn.close()
     return jsonify({"status": "success", "todo": new_todo})
 
-@app.route('/api/todos/<int:todo_id>/toggle', methods=['POST'])
+@bp.route('/api/todos/<int:todo_id>/toggle', methods=['POST'])
 def toggle_todo(todo_id):
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Get current todo state
@@ -1195,9 +2879,9 @@ def toggle_todo(todo_id):
         "updated_todos": updated_todos
     })
 
-@app.route('/api/todos/<int:todo_id>', methods=['DELETE'])
+@bp.route('/api/todos/<int:todo_id>', methods=['DELETE'])
 def delete_todo(todo_id):
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Find and delete all subtasks
@@ -1230,11 +2914,15 @@ def delete_todo(todo_id):
         conn.close()
         return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route('/api/todos/stats/weekly', methods=['GET'])
+@bp.route('/api/todos/stats/weekly', methods=['GET'])
 def get_weekly_stats():
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
-    
+    result = weekly_completion_stats(c)
+    conn.close()
+    return jsonify(result)
+
+def weekly_completion_stats(c):
     # Get the date for 7 days ago
     today = datetime.now()
     seven_days_ago = (today - timedelta(days=6)).strftime("%Y-%m-%d")
@@ -1264,18 +2952,19 @@ def get_weekly_stats():
             "completed": completed_by_date.get(date, 0)
         })
     
-    conn.close()
-    return jsonify(result)
+    return result
 
-@app.route('/api/todos/<int:todo_id>/copy', methods=['POST'])
+@bp.route('/api/todos/<int:todo_id>/copy', methods=['POST'])
 def copy_todo(todo_id):
-    data = request.json
+    return copy_todo_to_date(todo_id, request.json)
+
+def copy_todo_to_date(todo_id, data):
     target_date = data.get('target_date')
     
     if not target_date:
         return jsonify({"status": "error", "message": "Target date is required"}), 400
     
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Get the todo to copy
@@ -1343,15 +3032,17 @@ def copy_todo(todo_id):
     conn.close()
     return jsonify({"status": "success", "todo": new_todo})
 
-@app.route('/api/todos/<int:todo_id>/time', methods=['POST'])
+@bp.route('/api/todos/<int:todo_id>/time', methods=['POST'])
 def update_time_spent(todo_id):
-    data = request.json
+    return save_time_spent(todo_id, request.json)
+
+def save_time_spent(todo_id, data):
     time_spent = data.get('time_spent', 0)
     
     if time_spent < 0:
         return jsonify({"status": "error", "message": "Time spent cannot be negative"}), 400
     
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Update the time spent
@@ -1369,12 +3060,14 @@ def update_time_spent(todo_id):
     
     return jsonify({"status": "success"})
 
-@app.route('/api/todos/<int:todo_id>/plan', methods=['POST'])
+@bp.route('/api/todos/<int:todo_id>/plan', methods=['POST'])
 def update_planned_date(todo_id):
-    data = request.json
+    return save_planned_date(todo_id, request.json)
+
+def save_planned_date(todo_id, data):
     planned_date = data.get('planned_date')
     
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Update the planned date
@@ -1392,9 +3085,117 @@ def update_planned_date(todo_id):
     
     return jsonify({"status": "success"})
 
-@app.route('/api/investments', methods=['GET'])
+# Price history
+PRICE_DOWNSAMPLE_INTERVAL = 300  # seconds between automatic tick -> bar folds
+PRICE_TICK_RETENTION_DAYS = 30  # raw ticks older than this are dropped once folded
+
+_last_price_downsample = 0
+_price_downsample_lock = threading.Lock()
+
+def record_price_tick(c, symbol, price, ts=None):
+    # Append a price observation; never updates existing rows. Prices arrive
+    # as the client sent them, so anything that isn't a positive number is
+    # left out of the history rather than failing the request
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return
+    if not symbol or not 0 < price < float('inf'):
+        return
+    c.execute(
+        "INSERT INTO price_ticks (symbol, ts, price) VALUES (?, ?, ?)",
+        (symbol, ts or datetime.now().isoformat(), price)
+    )
+
+def downsample_price_ticks(conn, force=False):
+    # Fold ticks newer than the bars' watermark into daily OHLC bars, then
+    # prune raw ticks that are both folded and past the retention window
+    global _last_price_downsample
+
+    now = datetime.now()
+    with _price_downsample_lock:
+        if not force and now.timestamp() - _last_price_downsample < PRICE_DOWNSAMPLE_INTERVAL:
+            return 0
+        _last_price_downsample = now.timestamp()
+
+    # The watermark is read under the write lock, so that two workers (or
+    # threads) folding at once cannot both fold the same ticks into a bar
+    if conn.in_transaction:
+        conn.commit()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        folded = fold_price_ticks(c, now)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return folded
+
+def fold_price_ticks(c, now):
+    c.execute("SELECT COALESCE(MAX(last_tick_id), 0) FROM price_bars")
+    watermark = c.fetchone()[0]
+
+    c.execute(
+        "SELECT id, symbol, ts, price FROM price_ticks WHERE id > ? ORDER BY id",
+        (watermark,)
+    )
+    ticks = c.fetchall()
+
+    # Group the new ticks per (symbol, day)
+    groups = {}
+    for tick_id, symbol, ts, price in ticks:
+        groups.setdefault((symbol, ts[:10]), []).append((ts, price, tick_id))
+
+    for (symbol, bucket), rows in groups.items():
+        rows.sort()
+        first_ts, first_price, _ = rows[0]
+        last_ts, last_price, _ = rows[-1]
+        high = max(price for _, price, _ in rows)
+        low = min(price for _, price, _ in rows)
+        last_tick_id = max(tick_id for _, _, tick_id in rows)
+
+        c.execute(
+            "SELECT open, high, low, close, open_ts, close_ts, tick_count, last_tick_id FROM price_bars WHERE symbol = ? AND bucket = ?",
+            (symbol, bucket)
+        )
+        bar = c.fetchone()
+
+        if bar:
+            bar_open, bar_high, bar_low, bar_close, open_ts, close_ts, tick_count, bar_last_id = bar
+            # Ticks can arrive out of order (e.g. backdated purchases), so
+            # open/close follow the timestamps rather than arrival order
+            if first_ts < open_ts:
+                bar_open, open_ts = first_price, first_ts
+            if last_ts >= close_ts:
+                bar_close, close_ts = last_price, last_ts
+            c.execute(
+                """UPDATE price_bars
+                   SET open = ?, high = ?, low = ?, close = ?, open_ts = ?, close_ts = ?, tick_count = ?, last_tick_id = ?
+                   WHERE symbol = ? AND bucket = ?""",
+                (bar_open, max(bar_high, high), min(bar_low, low), bar_close, open_ts, close_ts,
+                 tick_count + len(rows), max(bar_last_id, last_tick_id), symbol, bucket)
+            )
+        else:
+            c.execute(
+                """INSERT INTO price_bars
+                   (symbol, bucket, open, high, low, close, open_ts, close_ts, tick_count, last_tick_id)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (symbol, bucket, first_price, high, low, last_price, first_ts, last_ts, len(rows), last_tick_id)
+            )
+
+    if ticks:
+        cutoff = (now - timedelta(days=PRICE_TICK_RETENTION_DAYS)).isoformat()
+        c.execute(
+            "DELETE FROM price_ticks WHERE id <= ? AND ts < ?",
+            (ticks[-1][0], cutoff)
+        )
+
+    return len(ticks)
+
+@bp.route('/api/investments', methods=['GET'])
 def get_investments():
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     c.execute("""
@@ -1447,12 +3248,129 @@ def get_investments():
         "total_profit_loss": total_profit_loss
     })
 
-@app.route('/api/investments', methods=['POST'])
+@bp.route('/api/investments/performance', methods=['GET'])
+def investments_performance():
+    conn = connect_db()
+    c = conn.cursor()
+
+    symbol = request.args.get('symbol')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to', datetime.now().strftime("%Y-%m-%d"))
+
+    # One read snapshot for the holdings, the bars and the ticks not yet
+    # folded into them, so a concurrent fold can't hide or repeat ticks
+    c.execute("BEGIN")
+
+    query = "SELECT name, purchase_date, purchase_price, quantity FROM investments"
+    params = []
+    if symbol:
+        query += " WHERE name = ?"
+        params.append(symbol)
+    c.execute(query, params)
+    holdings = c.fetchall()
+
+    if not holdings:
+        conn.close()
+        return jsonify({"series": [], "twr": 0, "profit_loss": 0})
+
+    symbols = sorted(set(h[0] for h in holdings))
+    placeholders = ", ".join("?" for _ in symbols)
+    c.execute(
+        f"SELECT symbol, bucket, close, close_ts FROM price_bars WHERE symbol IN ({placeholders}) AND bucket <= ? ORDER BY bucket",
+        symbols + [date_to]
+    )
+    bars = c.fetchall()
+    # Ticks past the watermark haven't been folded yet; read them as they
+    # are rather than folding here, so this GET never writes
+    c.execute(
+        f"""SELECT symbol, ts, price FROM price_ticks
+            WHERE id > (SELECT COALESCE(MAX(last_tick_id), 0) FROM price_bars)
+              AND symbol IN ({placeholders}) AND substr(ts, 1, 10) <= ?""",
+        symbols + [date_to]
+    )
+    ticks = c.fetchall()
+    conn.rollback()
+    conn.close()
+
+    closes = {}
+    for bar_symbol, bucket, close, close_ts in bars:
+        closes[(bar_symbol, bucket)] = (close_ts, close)
+    for tick_symbol, ts, price in ticks:
+        key = (tick_symbol, ts[:10])
+        if key not in closes or ts >= closes[key][0]:
+            closes[key] = (ts, price)
+
+    closes_by_day = {}
+    for (close_symbol, bucket), (_, close) in closes.items():
+        closes_by_day.setdefault(bucket, {})[close_symbol] = close
+
+    # Cash flows are purchases; they happen on the purchase date
+    flows_by_day = {}
+    for name, purchase_date, purchase_price, quantity in holdings:
+        day = purchase_date[:10]
+        if day <= date_to:
+            flows_by_day[day] = flows_by_day.get(day, 0) + purchase_price * quantity
+
+    days = sorted(set(closes_by_day) | set(flows_by_day))
+    first_purchase = min(h[1][:10] for h in holdings)
+
+    last_close = {}
+    series = []
+    growth = 1.0
+    prev_value = 0
+
+    for day in days:
+        last_close.update(closes_by_day.get(day, {}))
+        if day < first_purchase:
+            continue
+
+        value = 0
+        invested = 0
+        for name, purchase_date, purchase_price, quantity in holdings:
+            if purchase_date[:10] <= day:
+                value += quantity * last_close.get(name, purchase_price)
+                invested += quantity * purchase_price
+
+        # Time-weighted return: chain sub-period returns with that day's
+        # purchases stripped out so deposits don't count as performance
+        flow = flows_by_day.get(day, 0)
+        if prev_value > 0:
+            growth *= (value - flow) / prev_value
+        prev_value = value
+
+        series.append({
+            "date": day,
+            "value": round(value, 2),
+            "invested": round(invested, 2),
+            "profit_loss": round(value - invested, 2),
+            "growth": growth
+        })
+
+    # Rebase the return curve to the start of the requested range
+    if date_from:
+        before = [point for point in series if point["date"] < date_from]
+        base = before[-1]["growth"] if before else 1.0
+        series = [point for point in series if point["date"] >= date_from]
+    else:
+        base = 1.0
+
+    for point in series:
+        point["twr"] = round((point.pop("growth") / base - 1) * 100, 4)
+
+    return jsonify({
+        "series": series,
+        "twr": series[-1]["twr"] if series else 0,
+        "profit_loss": series[-1]["profit_loss"] if series else 0
+    })
+
+@bp.route('/api/investments', methods=['POST'])
 def add_investment():
-    conn = sqlite3.connect('expenses.db')
+    return create_investment(request.json)
+
+def create_investment(data):
+    conn = connect_db()
     c = conn.cursor()
     
-    data = request.json
     name = data.get('name', '')
     purchase_date = data.get('purchase_date', datetime.now().strftime("%Y-%m-%d"))
     purchase_price = data.get('purchase_price', 0)
@@ -1474,9 +3392,14 @@ def add_investment():
            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
         (name, purchase_date, purchase_price, quantity, current_price, last_updated, notes, investment_type)
     )
-    
-    conn.commit()
     investment_id = c.lastrowid
+
+    # Seed the price history with the purchase price and the current quote
+    record_price_tick(c, name, purchase_price, purchase_date)
+    if current_price and current_price != purchase_price:
+        record_price_tick(c, name, current_price)
+
+    conn.commit()
     
     # Add a corresponding expense in the "Investments" category
     total_investment_amount = purchase_price * quantity
@@ -1489,6 +3412,7 @@ def add_investment():
            VALUES (?, ?, ?, ?, ?)""",
         (purchase_date, description, total_investment_amount, "USD-Blue", "Investments")
     )
+    c.execute("UPDATE investments SET expense_id = ? WHERE id = ?", (c.lastrowid, investment_id))
     
     # Get the current month for budget allocations
     current_month = "-".join(purchase_date.split("-")[:2])
@@ -1530,25 +3454,29 @@ def add_investment():
             )
     
     conn.commit()
+    # Throttled, so most writes skip it; keeps the history compact for users
+    # who never connect the broker
+    downsample_price_ticks(conn)
     conn.close()
     return jsonify({"status": "success", "id": investment_id})
 
-@app.route('/api/investments/<int:investment_id>', methods=['PUT'])
+@bp.route('/api/investments/<int:investment_id>', methods=['PUT'])
 def update_investment(investment_id):
-    conn = sqlite3.connect('expenses.db')
+    return save_investment_changes(investment_id, request.json)
+
+def save_investment_changes(investment_id, data):
+    conn = connect_db()
     c = conn.cursor()
     
-    data = request.json
-    
     # Check if investment exists
-    c.execute("SELECT id, name, purchase_date, purchase_price, quantity FROM investments WHERE id = ?", (investment_id,))
+    c.execute("SELECT id, name, purchase_date, purchase_price, quantity, expense_id FROM investments WHERE id = ?", (investment_id,))
     old_investment = c.fetchone()
     
     if not old_investment:
         conn.close()
         return jsonify({"status": "error", "message": "Investment not found"}), 404
     
-    old_id, old_name, old_date, old_price, old_quantity = old_investment
+    old_id, old_name, old_date, old_price, old_quantity, linked_expense_id = old_investment
     
     # Extract data from request
     updates = []
@@ -1600,22 +3528,26 @@ def update_investment(investment_id):
     params.append(investment_id)
     
     c.execute(query, params)
-    
+
+    # Price history stays under the old name on renames: ticks are
+    # append-only and the symbol may be shared with other investments or
+    # broker positions, so their history must not move with this one
+
+    if 'current_price' in data:
+        record_price_tick(c, name, data['current_price'])
+
     # Check if we need to update the corresponding expense
     # We only need to update the expense if name, purchase date, price or quantity changed
     has_expense_changes = ('name' in data or 'purchase_date' in data or 'purchase_price' in data or 'quantity' in data)
     
     if has_expense_changes:
-        # Look for the expense associated with this investment
-        old_desc = f"Investment: {old_name}"
         new_desc = f"Investment: {name}"
         
-        # First check if we can find the old expense
-        c.execute(
-            "SELECT id, amount FROM expenses WHERE description = ? AND date = ? AND category = 'Investments'",
-            (old_desc, old_date)
-        )
-        expense = c.fetchone()
+        # Look up the expense linked to this investment
+        expense = None
+        if linked_expense_id:
+            c.execute("SELECT id, amount FROM expenses WHERE id = ?", (linked_expense_id,))
+            expense = c.fetchone()
         
         if expense:
             # Update the existing expense
@@ -1706,6 +3638,7 @@ def update_investment(investment_id):
                    VALUES (?, ?, ?, ?, ?)""",
                 (purchase_date, new_desc, new_amount, "USD-Blue", "Investments")
             )
+            c.execute("UPDATE investments SET expense_id = ? WHERE id = ?", (c.lastrowid, investment_id))
             
             # Update budget allocation
             new_month = "-".join(purchase_date.split("-")[:2])
@@ -1748,32 +3681,33 @@ def update_investment(investment_id):
                     )
     
     conn.commit()
+    downsample_price_ticks(conn)
     conn.close()
     return jsonify({"status": "success"})
 
-@app.route('/api/investments/<int:investment_id>', methods=['DELETE'])
+@bp.route('/api/investments/<int:investment_id>', methods=['DELETE'])
 def delete_investment(investment_id):
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     # Check if investment exists and get its details
-    c.execute("SELECT name, purchase_date, purchase_price, quantity FROM investments WHERE id = ?", (investment_id,))
+    c.execute("SELECT name, purchase_date, purchase_price, quantity, expense_id FROM investments WHERE id = ?", (investment_id,))
     investment = c.fetchone()
     
     if not investment:
         conn.close()
         return jsonify({"status": "error", "message": "Investment not found"}), 404
     
-    name, purchase_date, purchase_price, quantity = investment
-    description = f"Investment: {name}"
+    name, purchase_date, purchase_price, quantity, linked_expense_id = investment
     
     # Delete the investment
     c.execute("DELETE FROM investments WHERE id = ?", (investment_id,))
     
-    # Find and delete the corresponding expense
-    c.execute("SELECT id, amount FROM expenses WHERE description = ? AND date = ? AND category = 'Investments'", 
-              (description, purchase_date))
-    expense = c.fetchone()
+    # Find and delete the linked expense
+    expense = None
+    if linked_expense_id:
+        c.execute("SELECT id, amount FROM expenses WHERE id = ?", (linked_expense_id,))
+        expense = c.fetchone()
     
     if expense:
         expense_id, amount = expense
@@ -1811,270 +3745,228 @@ def delete_investment(investment_id):
     return jsonify({"status": "success"})
 
 # Cuentas y transferencias
-@app.route('/api/accounts', methods=['GET', 'POST'])
+@bp.route('/api/accounts', methods=['GET', 'POST'])
 def accounts():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
+    if request.method == 'POST':
+        return save_accounts(request.json)
 
-    if request.method == 'GET':
-        try:
-            # Verificar si la tabla existe
-            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='accounts'")
-            table_exists = c.fetchone()
-
-            if not table_exists:
-                # Crear tabla si no existe
-                c.execute('''CREATE TABLE accounts
-                    (id INTEGER PRIMARY KEY,
-                    name TEXT,
-                    currency TEXT,
-                    balance REAL,
-                    fee_percent REAL)''')
-                
-                # Insertar cuentas predeterminadas
-                accounts_data = [
-                    ('Payoneer', 'USD', 1500.0, 0.01),
-                    ('Belo', 'USD', 0.0, 0.001),
-                    ('Cuenta ARS', 'ARS', 0.0, 0.0)
-                ]
-                c.executemany("INSERT INTO accounts (name, currency, balance, fee_percent) VALUES (?, ?, ?, ?)", accounts_data)
-                conn.commit()
+    conn = connect_db()
+    c = conn.cursor()
 
-            # Obtener todas las cuentas
-            c.execute("SELECT id, name, currency, balance, fee_percent FROM accounts")
-            accounts_data = c.fetchall()
-            
-            accounts = {
-                account[1].lower().replace(' ', '_'): {
-                    'id': account[0],
-                    'name': account[1],
-                    'currency': account[2],
-                    'balance': account[3],
-                    'fee_percent': account[4]
-                }
-                for account in accounts_data
+    try:
+        # Obtener todas las cuentas
+        c.execute("SELECT id, name, currency, balance, fee_percent FROM accounts")
+        accounts_data = c.fetchall()
+        
+        accounts = {
+            account[1].lower().replace(' ', '_'): {
+                'id': account[0],
+                'name': account[1],
+                'currency': account[2],
+                'balance': account[3],
+                'fee_percent': account[4]
             }
-            
-            # Actualizar el balance de la cuenta ARS basándose en Belo y tasa de Dólar Cripto
-            ars_account = next((acc for acc in accounts.values() if acc['currency'] == 'ARS'), None)
-            belo_account = next((acc for acc in accounts.values() if acc['name'] == 'Belo'), None)
-            
-            if ars_account and belo_account:
-                try:
-                    # Obtener la tasa actual de dolarapi.com (cripto en lugar de blue)
-                    response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                    if response.status_code == 200:
-                        # Usar la tasa de venta (cuando el usuario compra USD)
-                        rate = response.json().get("venta", 1230)
-                    else:
-                        rate = 1230
-                        
-                    # Actualizar el balance en la base de datos y en la respuesta
-                    new_ars_balance = belo_account['balance'] * rate
+            for account in accounts_data
+        }
+        
+        # Actualizar el balance de la cuenta ARS basándose en Belo y tasa de Dólar Cripto
+        ars_account = next((acc for acc in accounts.values() if acc['currency'] == 'ARS'), None)
+        belo_account = next((acc for acc in accounts.values() if acc['name'] == 'Belo'), None)
+        
+        if ars_account and belo_account:
+            try:
+                # Tasa cripto de venta (cuando el usuario compra USD)
+                rate = get_dolar_rate('cripto')['venta']
                     
-                    # Solo actualizar si hay diferencia significativa (>1%)
-                    if abs(new_ars_balance - ars_account['balance']) > (ars_account['balance'] * 0.01) or ars_account['balance'] == 0:
-                        c.execute("UPDATE accounts SET balance = ? WHERE id = ?", 
-                                (new_ars_balance, ars_account['id']))
-                        conn.commit()
-                        
-                        # Actualizar el balance en la respuesta
-                        ars_account['balance'] = new_ars_balance
-                        
-                except Exception as e:
-                    print(f"Error al actualizar cuenta ARS: {str(e)}")
-                    # Si falla, mantener el balance actual
-            
-            conn.close()
-            return jsonify(accounts)
-            
-        except Exception as e:
-            conn.close()
-            return jsonify({
-                'status': 'error',
-                'message': str(e)
-            }), 500
+                # Actualizar el balance en la base de datos y en la respuesta
+                new_ars_balance = belo_account['balance'] * rate
+                
+                # Solo actualizar si hay diferencia significativa (>1%)
+                if abs(new_ars_balance - ars_account['balance']) > (ars_account['balance'] * 0.01) or ars_account['balance'] == 0:
+                    c.execute("UPDATE accounts SET balance = ? WHERE id = ?", 
+                            (new_ars_balance, ars_account['id']))
+                    conn.commit()
+                    
+                    # Actualizar el balance en la respuesta
+                    ars_account['balance'] = new_ars_balance
+                    
+            except Exception as e:
+                log.error("Error al actualizar cuenta ARS: %s", e)
+                # Si falla, mantener el balance actual
+        
+        conn.close()
+        return jsonify(accounts)
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
 
-    elif request.method == 'POST':
-        try:
-            data = request.json
+def save_accounts(data):
+    conn = connect_db()
+    c = conn.cursor()
+
+    try:
+        # Actualizar cada cuenta
+        for account_key, account_data in data.items():
+            account_name = account_data.get('name')
+            account_balance = account_data.get('balance')
+            account_currency = account_data.get('currency')
+            account_fee = account_data.get('fee_percent')
+            account_id = account_data.get('id')
             
-            # Actualizar cada cuenta
-            for account_key, account_data in data.items():
-                account_name = account_data.get('name')
-                account_balance = account_data.get('balance')
-                account_currency = account_data.get('currency')
-                account_fee = account_data.get('fee_percent')
-                account_id = account_data.get('id')
+            if account_id:
+                # Actualizar cuenta existente
+                c.execute(
+                    "UPDATE accounts SET balance = ?, currency = ?, fee_percent = ? WHERE id = ?",
+                    (account_balance, account_currency, account_fee, account_id)
+                )
+            else:
+                # Verificar si la cuenta ya existe por nombre
+                c.execute("SELECT id FROM accounts WHERE name = ?", (account_name,))
+                existing = c.fetchone()
                 
-                if account_id:
-                    # Actualizar cuenta existente
+                if existing:
+                    # Actualizar
                     c.execute(
                         "UPDATE accounts SET balance = ?, currency = ?, fee_percent = ? WHERE id = ?",
-                        (account_balance, account_currency, account_fee, account_id)
+                        (account_balance, account_currency, account_fee, existing[0])
                     )
                 else:
-                    # Verificar si la cuenta ya existe por nombre
-                    c.execute("SELECT id FROM accounts WHERE name = ?", (account_name,))
-                    existing = c.fetchone()
-                    
-                    if existing:
-                        # Actualizar
-                        c.execute(
-                            "UPDATE accounts SET balance = ?, currency = ?, fee_percent = ? WHERE id = ?",
-                            (account_balance, account_currency, account_fee, existing[0])
-                        )
-                    else:
-                        # Insertar nueva cuenta
-                        c.execute(
-                            "INSERT INTO accounts (name, currency, balance, fee_percent) VALUES (?, ?, ?, ?)",
-                            (account_name, account_currency, account_balance, account_fee)
-                        )
-            
-            conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'status': 'success'
-            })
-            
-        except Exception as e:
-            conn.close()
-            return jsonify({
-                'status': 'error',
-                'message': str(e)
-            }), 500
+                    # Insertar nueva cuenta
+                    c.execute(
+                        "INSERT INTO accounts (name, currency, balance, fee_percent) VALUES (?, ?, ?, ?)",
+                        (account_name, account_currency, account_balance, account_fee)
+                    )
+        
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'status': 'success'
+        })
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
 
-@app.route('/api/transfers', methods=['GET', 'POST'])
+@bp.route('/api/transfers', methods=['GET', 'POST'])
 def transfer_list():
-    conn = sqlite3.connect('expenses.db')
+    if request.method == 'POST':
+        return create_transfer(request.json)
+
+    conn = connect_db()
     c = conn.cursor()
 
-    if request.method == 'GET':
-        try:
-            # Verificar si la tabla existe
-            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transfers'")
-            table_exists = c.fetchone()
-
-            if not table_exists:
-                # Crear tabla si no existe
-                c.execute('''CREATE TABLE transfers
-                    (id INTEGER PRIMARY KEY,
-                    date TEXT,
-                    amount REAL,
-                    from_account TEXT,
-                    to_account TEXT,
-                    gross_amount REAL,
-                    total_fees REAL,
-                    description TEXT)''')
-                conn.commit()
+    try:
+        # Posición en el registro de cambios, para /api/sync
+        seq = current_change_seq(c)
 
-            # Obtener todos los transfers
-            c.execute("SELECT id, date, amount, from_account, to_account, gross_amount, total_fees, description FROM transfers ORDER BY date DESC")
-            transfers_data = c.fetchall()
-            
-            transfers = [
-                {
-                    'id': transfer[0],
-                    'date': transfer[1],
-                    'amount': transfer[2],
-                    'from_account': transfer[3],
-                    'to_account': transfer[4],
-                    'gross_amount': transfer[5],
-                    'total_fees': transfer[6],
-                    'description': transfer[7]
-                }
-                for transfer in transfers_data
-            ]
-            
-            conn.close()
-            return jsonify(transfers)
-            
-        except Exception as e:
-            conn.close()
-            return jsonify({
-                'status': 'error',
-                'message': str(e)
-            }), 500
+        # Obtener todos los transfers
+        c.execute("SELECT id, date, amount, from_account, to_account, gross_amount, total_fees, description FROM transfers ORDER BY date DESC")
+        transfers_data = c.fetchall()
+        
+        transfers = [
+            {
+                'id': transfer[0],
+                'date': transfer[1],
+                'amount': transfer[2],
+                'from_account': transfer[3],
+                'to_account': transfer[4],
+                'gross_amount': transfer[5],
+                'total_fees': transfer[6],
+                'description': transfer[7]
+            }
+            for transfer in transfers_data
+        ]
+        
+        conn.close()
+        response = jsonify_rows(transfers)
+        response.headers['X-Sync-Seq'] = str(seq)
+        return response
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
 
-    elif request.method == 'POST':
-        try:
-            data = request.json
-            date = data.get('date')
-            amount = data.get('amount')
-            from_account = data.get('from_account')
-            to_account = data.get('to_account')
-            gross_amount = data.get('gross_amount')
-            total_fees = data.get('total_fees')
-            description = data.get('description')
-            
-            # Insertar nueva transferencia
-            c.execute(
-                "INSERT INTO transfers (date, amount, from_account, to_account, gross_amount, total_fees, description) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (date, amount, from_account, to_account, gross_amount, total_fees, description)
-            )
-            
-            # Actualizar saldos de cuentas
-            # Obtener la cuenta origen
-            c.execute("SELECT balance FROM accounts WHERE name = ?", (from_account,))
-            from_balance = c.fetchone()
-            
-            if from_balance:
-                new_from_balance = from_balance[0] - gross_amount
-                c.execute("UPDATE accounts SET balance = ? WHERE name = ?", (new_from_balance, from_account))
-            
-            # Obtener la cuenta destino
-            c.execute("SELECT balance, currency FROM accounts WHERE name = ?", (to_account,))
-            to_account_data = c.fetchone()
+def create_transfer(data):
+    conn = connect_db()
+    c = conn.cursor()
+
+    try:
+        date = data.get('date')
+        amount = data.get('amount')
+        from_account = data.get('from_account')
+        to_account = data.get('to_account')
+        gross_amount = data.get('gross_amount')
+        total_fees = data.get('total_fees')
+        description = data.get('description')
+        
+        # Insertar nueva transferencia
+        c.execute(
+            "INSERT INTO transfers (date, amount, from_account, to_account, gross_amount, total_fees, description) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (date, amount, from_account, to_account, gross_amount, total_fees, description)
+        )
+        
+        # Actualizar saldos de cuentas
+        # Obtener la cuenta origen
+        c.execute("SELECT balance FROM accounts WHERE name = ?", (from_account,))
+        from_balance = c.fetchone()
+        
+        if from_balance:
+            new_from_balance = from_balance[0] - gross_amount
+            c.execute("UPDATE accounts SET balance = ? WHERE name = ?", (new_from_balance, from_account))
+        
+        # Obtener la cuenta destino
+        c.execute("SELECT balance, currency FROM accounts WHERE name = ?", (to_account,))
+        to_account_data = c.fetchone()
+        
+        if to_account_data:
+            to_balance = to_account_data[0]
+            to_currency = to_account_data[1]
             
-            if to_account_data:
-                to_balance = to_account_data[0]
-                to_currency = to_account_data[1]
+            # Verificar si necesitamos convertir moneda
+            if to_currency == 'ARS':
+                # Tasa cripto de venta (cuando el usuario compra USD con ARS)
+                rate = get_dolar_rate('cripto')['venta']
                 
-                # Verificar si necesitamos convertir moneda
-                if to_currency == 'ARS':
-                    # Obtener tasa de cambio actual
-                    try:
-                        response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                        if response.status_code == 200:
-                            # Usar tasa de venta (cuando el usuario compra USD con ARS)
-                            rate = response.json().get("venta", 1230)
-                        else:
-                            # Tasa alternativa si falla la API
-                            rate = 1230
-                    except:
-                        # Tasa alternativa si falla completamente
-                        rate = 1230
-                    
-                    # Convertir el monto a ARS
-                    ars_amount = amount * rate
-                    new_to_balance = to_balance + ars_amount
-                else:
-                    # Misma moneda, solo sumar el monto neto
-                    new_to_balance = to_balance + amount
-                    
-                c.execute("UPDATE accounts SET balance = ? WHERE name = ?", (new_to_balance, to_account))
-            
-            # Nota: La creación del gasto por comisión se maneja desde el frontend
-            # para evitar duplicación en los gastos de comisiones
-            
-            conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'status': 'success'
-            })
-            
-        except Exception as e:
-            conn.close()
-            return jsonify({
-                'status': 'error',
-                'message': str(e)
-            }), 500
+                # Convertir el monto a ARS
+                ars_amount = amount * rate
+                new_to_balance = to_balance + ars_amount
+            else:
+                # Misma moneda, solo sumar el monto neto
+                new_to_balance = to_balance + amount
+                
+            c.execute("UPDATE accounts SET balance = ? WHERE name = ?", (new_to_balance, to_account))
+        
+        # Nota: La creación del gasto por comisión se maneja desde el frontend
+        # para evitar duplicación en los gastos de comisiones
+        
+        conn.commit()
+        conn.close()
+        
+        return jsonify({
+            'status': 'success'
+        })
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
 
-@app.route('/api/transfers/<int:transfer_id>', methods=['DELETE'])
+@bp.route('/api/transfers/<int:transfer_id>', methods=['DELETE'])
 def delete_transfer(transfer_id):
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     try:
@@ -2110,16 +4002,8 @@ def delete_transfer(transfer_id):
             
             # Verificar si fue una transferencia con conversión de moneda
             if to_currency == 'ARS' and from_account in ['Payoneer', 'Belo']:
-                # Si fue convertido a ARS, intentar obtener tasa
-                try:
-                    response = requests.get('https://dolarapi.com/v1/dolares/cripto')
-                    if response.status_code == 200:
-                        # Usar tasa de venta (cuando el usuario compra USD con ARS)
-                        rate = response.json().get("venta", 1230)
-                    else:
-                        rate = 1230
-                except:
-                    rate = 1230
+                # Si fue convertido a ARS, usar la tasa cripto de venta
+                rate = get_dolar_rate('cripto')['venta']
                 
                 # Restar usando la tasa
                 new_to_balance = to_balance - (amount * rate)
@@ -2146,14 +4030,12 @@ def delete_transfer(transfer_id):
             'message': str(e)
         }), 500
 
-# Initialize the database
-init_db()
-
 # InvertirOnline API integration
-@app.route('/api/broker/auth', methods=['POST'])
+@bp.route('/api/broker/auth', methods=['POST'])
+@upstream_view('broker')
 def broker_auth():
     data = request.json
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     username = data.get('username', '')
@@ -2167,7 +4049,7 @@ def broker_auth():
     
     try:
         # Call InvertirOnline API for authentication
-        auth_url = 'https://api.invertironline.com/token'
+        auth_url = f"{current_app.config['IOL_URL']}/token"
         auth_data = {
             'username': username,
             'password': password,
@@ -2180,7 +4062,7 @@ def broker_auth():
         
         form_data = urlencode(auth_data)
         
-        response = requests.post(auth_url, data=form_data, headers=headers)
+        response = upstream_post(auth_url, data=form_data, headers=headers)
         
         if response.status_code != 200:
             return jsonify({
@@ -2191,17 +4073,6 @@ def broker_auth():
         # Store tokens in database for later use
         auth_response = response.json()
         
-        # Check if broker_tokens table exists
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='broker_tokens'")
-        if c.fetchone() is None:
-            c.execute('''CREATE TABLE broker_tokens (
-            id INTEGER PRIMARY KEY,
-            access_token TEXT,
-            refresh_token TEXT,
-            expires_in INTEGER,
-            last_updated TEXT
-            )''')
-        
         # Store or update tokens
         c.execute("SELECT id FROM broker_tokens WHERE id = 1")
         if c.fetchone():
@@ -2231,7 +4102,7 @@ def broker_auth():
         
     except Exception as e:
         error_msg = f'Exception during authentication: {str(e)}'
-        print(f"Authentication error: {error_msg}")
+        log.warning("Authentication error: %s", error_msg)
         return jsonify({
             'success': False,
             'message': 'Authentication failed due to an error'
@@ -2239,9 +4110,10 @@ def broker_auth():
     finally:
         conn.close()
 
-@app.route('/api/broker/refresh', methods=['POST'])
+@bp.route('/api/broker/refresh', methods=['POST'])
+@upstream_view('broker')
 def broker_refresh_token():
-    conn = sqlite3.connect('expenses.db')
+    conn = connect_db()
     c = conn.cursor()
     
     try:
@@ -2258,7 +4130,7 @@ def broker_refresh_token():
         refresh_token = result[0]
         
         # Call InvertirOnline API for token refresh
-        auth_url = 'https://api.invertironline.com/token'
+        auth_url = f"{current_app.config['IOL_URL']}/token"
         auth_data = {
             'refresh_token': refresh_token,
             'grant_type': 'refresh_token'
@@ -2270,7 +4142,7 @@ def broker_refresh_token():
         
         form_data = urlencode(auth_data)
         
-        response = requests.post(auth_url, data=form_data, headers=headers)
+        response = upstream_post(auth_url, data=form_data, headers=headers)
         
         if response.status_code != 200:
             return jsonify({
@@ -2304,17 +4176,22 @@ def broker_refresh_token():
     finally:
         conn.close()
 
-@app.route('/api/broker/portfolio', methods=['GET'])
+# Portfolio responses are shared between workers (and /api/broker/prices
+# polls) for this many seconds
+PORTFOLIO_CACHE_TTL = 15
+
+@bp.route('/api/broker/portfolio', methods=['GET'])
+@upstream_view('broker')
 def broker_portfolio():
     try:
-        conn = sqlite3.connect('expenses.db')
+        conn = connect_db()
         c = conn.cursor()
         
         # Get the token from Authorization header
         auth_header = request.headers.get('Authorization')
         if auth_header and auth_header.startswith('Bearer '):
             frontend_token = auth_header.split(' ')[1]
-            print(f"Token received from frontend: {frontend_token[:10]}...")
+            log.debug("Token received from frontend")
             
             # Check if this matches our stored token
             c.execute("SELECT access_token FROM broker_tokens WHERE id = 1")
@@ -2322,7 +4199,7 @@ def broker_portfolio():
             
             # If we have a token in DB and it doesn't match the frontend token
             if result and result[0] != frontend_token:
-                print("Warning: Frontend token doesn't match stored token")
+                log.warning("Frontend token doesn't match stored token")
         else:
             frontend_token = None
         
@@ -2332,14 +4209,14 @@ def broker_portfolio():
         
         if not result:
             conn.close()
-            print("No access token found in database")
+            log.warning("No access token found in database")
             return jsonify({
                 'status': 'error',
                 'message': 'No access token found. Please authenticate first.'
             }), 400
         
         access_token, last_updated_str, expires_in = result
-        print(f"Access token found: {access_token[:10]}...")
+        log.debug("Access token found")
         
         # Check if token is expired and refresh if needed
         last_updated = datetime.fromisoformat(last_updated_str)
@@ -2347,66 +4224,83 @@ def broker_portfolio():
         
         if datetime.now() > token_expiry:
             # Token expired, refresh it
-            print("Token has expired, refreshing...")
+            log.info("Broker token has expired, refreshing")
             conn.close()
             refresh_response = broker_refresh_token()
-            refresh_data = refresh_response[0].json if hasattr(refresh_response[0], 'json') else {}
-            
-            if refresh_response[1] != 200:
-                print(f"Refresh failed: {refresh_data.get('message', 'Unknown error')}")
+
+            # Failures come back as (response, status); success as a response
+            if isinstance(refresh_response, tuple):
+                refresh_data = refresh_response[0].json or {}
+                log.warning("Broker token refresh failed: %s", refresh_data.get('message', 'Unknown error'))
                 return refresh_response
             
             # Reconnect after refresh
-            print("Token refreshed successfully, reconnecting...")
-            conn = sqlite3.connect('expenses.db')
+            log.info("Broker token refreshed")
+            conn = connect_db()
             c = conn.cursor()
             c.execute("SELECT access_token FROM broker_tokens WHERE id = 1")
             access_token = c.fetchone()[0]
-            print(f"New access token: {access_token[:10]}...")
         
-        # Call InvertirOnline API for portfolio data
-        portfolio_url = 'https://api.invertironline.com/api/v2/portafolio/argentina'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
+        # Call InvertirOnline API for portfolio data, unless another request
+        # (maybe in another worker) fetched it for this token moments ago
+        cache_key = 'portfolio:' + hashlib.sha256(access_token.encode()).hexdigest()
+        portfolio_data, fetched_at = shared_cache_get(cache_key)
+        if portfolio_data is not None and time.time() - fetched_at < PORTFOLIO_CACHE_TTL:
+            inc_counter('cache_lookups_total', {'cache': 'portfolio', 'result': 'hit'})
+            log.debug("Portfolio data served from shared cache")
+        else:
+            inc_counter('cache_lookups_total', {'cache': 'portfolio', 'result': 'miss'})
+            portfolio_url = f"{current_app.config['IOL_URL']}/api/v2/portafolio/argentina"
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json',
+                'Accept': 'application/json'
+            }
         
-        print(f"Requesting portfolio data from {portfolio_url}")
-        response = requests.get(portfolio_url, headers=headers)
+            log.debug("Requesting portfolio data from %s", portfolio_url)
+            response = upstream_get(portfolio_url, headers=headers)
         
-        print(f"Portfolio response status: {response.status_code}")
-        if response.status_code != 200:
-            print(f"Portfolio response error: {response.text}")
+            log.debug("Portfolio response status: %d", response.status_code)
+            if response.status_code != 200:
+                log.warning("Portfolio request failed with %d: %s", response.status_code, response.text)
             
-            # Return a meaningful error to the frontend
-            if response.status_code == 401:
-                return jsonify({
-                    'status': 'error',
-                    'message': 'Authentication failed or token expired. Please log in again.'
-                }), 401
-            else:
-                # Return the API response data to help with debugging
-                try:
-                    error_data = response.json()
-                    return jsonify({
-                        'status': 'error',
-                        'message': f'API error: {response.status_code}',
-                        'api_response': error_data
-                    }), response.status_code
-                except:
+                # Return a meaningful error to the frontend
+                if response.status_code == 401:
                     return jsonify({
                         'status': 'error',
-                        'message': f'API error: {response.status_code} - {response.text}'
-                    }), response.status_code
+                        'message': 'Authentication failed or token expired. Please log in again.'
+                    }), 401
+                else:
+                    # Return the API response data to help with debugging
+                    try:
+                        error_data = response.json()
+                        return jsonify({
+                            'status': 'error',
+                            'message': f'API error: {response.status_code}',
+                            'api_response': error_data
+                        }), response.status_code
+                    except:
+                        return jsonify({
+                            'status': 'error',
+                            'message': f'API error: {response.status_code} - {response.text}'
+                        }), response.status_code
         
-        # Successfully got portfolio data
-        portfolio_data = response.json()
-        print("Portfolio data received successfully")
+            # Successfully got portfolio data
+            portfolio_data = response.json()
+            shared_cache_set(cache_key, portfolio_data, replaces='portfolio:%')
+            log.debug("Portfolio data received")
+
+            # Guardar las cotizaciones reales de IOL en el historial (solo
+            # cuando vienen del broker, no del cache) y compactarlo periódicamente
+            fetched_ts = datetime.now().isoformat()
+            for activo in portfolio_data.get('activos', []):
+                record_price_tick(c, activo.get('titulo', {}).get('simbolo'), activo.get('ultimoPrecio'), fetched_ts)
+            conn.commit()
+            downsample_price_ticks(conn)
         
         # If the response is already in the expected format, just return it
         if 'activos' in portfolio_data and isinstance(portfolio_data['activos'], list):
-            print("Response already has 'activos' field, returning as is")
+            log.debug("Response already has 'activos' field, returning as is")
             
             # Add any user investments to the portfolio
             try:
@@ -2455,13 +4349,15 @@ def broker_portfolio():
                     
                     portfolio_data['activos'].append(user_activo)
             except Exception as e:
-                print(f"Error adding user investments: {str(e)}")
+                log.error("Error adding user investments: %s", e)
                 
             conn.close()
+            if wants_columnar():
+                portfolio_data['activos'] = columnar(portfolio_data['activos'])
             return jsonify(portfolio_data)
         
         # Convert portfolio data to expected format
-        print("Converting portfolio data to expected format")
+        log.debug("Converting portfolio data to expected format")
         argentina_format = {
             'pais': 'argentina',
             'activos': []
@@ -2518,7 +4414,7 @@ def broker_portfolio():
                     
                     argentina_format['activos'].append(activo)
         else:
-            print(f"Unexpected portfolio data format: {portfolio_data}")
+            log.warning("Unexpected portfolio data format: %s", portfolio_data)
         
         # Add user investments to the portfolio
         try:
@@ -2567,21 +4463,24 @@ def broker_portfolio():
                 
                 argentina_format['activos'].append(user_activo)
         except Exception as e:
-            print(f"Error adding user investments: {str(e)}")
+            log.error("Error adding user investments: %s", e)
         
         conn.close()
-        print(f"Returning portfolio data with {len(argentina_format['activos'])} assets")
+        log.debug("Returning portfolio data with %d assets", len(argentina_format['activos']))
+        if wants_columnar():
+            argentina_format['activos'] = columnar(argentina_format['activos'])
         return jsonify(argentina_format)
             
     except Exception as e:
         error_msg = f'Exception during portfolio fetch: {str(e)}'
-        print(error_msg)
+        log.exception("Portfolio fetch failed")
         return jsonify({
             'status': 'error',
             'message': error_msg
         }), 500
 
-@app.route('/api/broker/prices', methods=['GET'])
+@bp.route('/api/broker/prices', methods=['GET'])
+@upstream_view('broker')
 def broker_prices():
     """
     Endpoint para obtener precios actualizados en tiempo real.
@@ -2644,12 +4543,48 @@ def broker_prices():
         })
     
     except Exception as e:
-        app.logger.error(f"Error en broker_prices: {str(e)}")
+        log.exception("Error en broker_prices")
         return jsonify({
             'status': 'error', 
             'message': f'Error al obtener precios: {str(e)}'
         }), 500
 
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(
+        DATABASE=os.environ.get('DATABASE_PATH', 'expenses.db'),
+        MIGRATE_ON_START=True,
+        DEBUG_ENDPOINTS=os.environ.get('DEBUG_ENDPOINTS') == '1',
+        DOLARAPI_URL=DOLARAPI_URL,
+        IOL_URL=IOL_URL,
+        PROFILE_CLIENTS=os.environ.get('PROFILE_CLIENTS', '127.0.0.1,::1').split(','),
+        PROFILE_SAMPLE_RATE=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+        PROFILE_DIR=os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'retro-money-profiles')),
+    )
+    app.config.update(config or {})
+
+    configure_logging()
+    CORS(app)  # Enable CORS for all routes
+    if orjson:
+        app.json = OrjsonProvider(app)
+    app.extensions['asset_manifest'] = load_asset_manifest()
+    app.register_blueprint(bp)
+
+    # A shared in-memory database only lives while a connection is open
+    if 'mode=memory' in app.config['DATABASE']:
+        app.extensions['db_keepalive'] = open_db(app.config['DATABASE'])
+
+    # Only the first start after a deploy has steps to apply; with
+    # MIGRATE_ON_START off, run `flask --app app migrate` instead
+    if app.config['MIGRATE_ON_START']:
+        migrate_db(app.config['DATABASE'])
+
+    return app
+
+@bp.cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations."""
+    migrate_db(current_app.config['DATABASE'])
+
 if __name__ == '__main__':
-    migrate_data()
-    app.run(port=8092, host='0.0.0.0') 
\ No newline at end of file
+    create_app().run(port=8092, host='0.0.0.0') 
\ No newline at end of file
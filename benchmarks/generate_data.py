@@ -0,0 +1,152 @@
+"""Generate a synthetic RetroMoney database for the benchmarks.
+
+    python benchmarks/generate_data.py --size small
+    python benchmarks/generate_data.py --size large --out /tmp/large.db
+
+The schema comes from the app's own migrations; rows go in through the
+normal triggers (change feed, data versions), so the result looks like a
+database that grew through the API. Output is deterministic for a given
+size and --seed.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as retro_money  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# todo trees: roots x (branching^(depth+1) - 1) / (branching - 1) todos
+SIZES = {
+    'small': {'expenses': 10_000, 'todo_roots': 40, 'todo_depth': 5, 'todo_branching': 2,
+              'investments': 200, 'transfers': 200},
+    'medium': {'expenses': 100_000, 'todo_roots': 100, 'todo_depth': 7, 'todo_branching': 2,
+               'investments': 500, 'transfers': 500},
+    'large': {'expenses': 1_000_000, 'todo_roots': 200, 'todo_depth': 9, 'todo_branching': 2,
+              'investments': 800, 'transfers': 800},
+}
+
+CURRENCIES = [('ARS', 0.55), ('USD', 0.2), ('USD-Blue', 0.15), ('USD-Tarjeta', 0.1)]
+CATEGORIES = [('Fixed Expenses', 0.45), ('Guilt-Free Spending', 0.3), ('Savings', 0.1), ('Investments', 0.15)]
+DESCRIPTIONS = ['Supermercado', 'Alquiler', 'Expensas', 'Luz', 'Gas', 'Internet', 'Celular', 'Nafta',
+                'Farmacia', 'Restaurant', 'Delivery', 'Netflix', 'Spotify', 'Gimnasio', 'Ropa',
+                'Regalo', 'Viaje', 'Seguro auto', 'Prepaga', 'Cafe']
+ACCOUNTS = ['Payoneer', 'Belo', 'Cuenta ARS']
+INVESTMENT_TYPES = ['Stock', 'Bond', 'CEDEAR', 'Crypto', 'FCI']
+CHUNK = 10_000
+
+# Stored as the broker token; the IOL stub accepts it without expiry
+BROKER_ACCESS_TOKEN = 'bench-access-token'
+
+def weighted(rng, choices):
+    return rng.choices([value for value, _ in choices], weights=[weight for _, weight in choices])[0]
+
+def random_day(rng, start, end):
+    return start + timedelta(days=rng.randrange((end - start).days + 1))
+
+def insert_expenses(c, rng, count, start, end):
+    rows = []
+    for _ in range(count):
+        currency = weighted(rng, CURRENCIES)
+        amount = round(rng.lognormvariate(10, 1), 2) if currency == 'ARS' else round(rng.lognormvariate(3.5, 1), 2)
+        rows.append((random_day(rng, start, end).isoformat(), rng.choice(DESCRIPTIONS), amount,
+                     currency, weighted(rng, CATEGORIES)))
+        if len(rows) == CHUNK:
+            c.executemany("INSERT INTO expenses (date, description, amount, currency, category) VALUES (?, ?, ?, ?, ?)", rows)
+            rows = []
+    if rows:
+        c.executemany("INSERT INTO expenses (date, description, amount, currency, category) VALUES (?, ?, ?, ?, ?)", rows)
+
+def insert_todo_tree(c, rng, parent_id, level, depth, branching, start, end):
+    created = random_day(rng, start, end)
+    completed = rng.random() < 0.4
+    c.execute(
+        "INSERT INTO todos (description, created_date, completed_date, is_completed, parent_id, level, planned_date, time_spent) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (f"Tarea nivel {level}", created.isoformat(),
+         (created + timedelta(days=rng.randrange(30))).isoformat() if completed else None,
+         1 if completed else 0, parent_id, level,
+         (created + timedelta(days=rng.randrange(14))).isoformat() if rng.random() < 0.3 else None,
+         rng.randrange(0, 7200))
+    )
+    todo_id = c.lastrowid
+    if level < depth:
+        for _ in range(branching):
+            insert_todo_tree(c, rng, todo_id, level + 1, depth, branching, start, end)
+
+def insert_investments(c, rng, count, start, end):
+    for i in range(count):
+        price = round(rng.uniform(1, 5000), 2)
+        c.execute(
+            "INSERT INTO investments (name, purchase_date, purchase_price, quantity, current_price, last_updated, notes, investment_type) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (f"Activo {i}", random_day(rng, start, end).isoformat(), price, round(rng.uniform(0.1, 100), 4),
+             round(price * rng.uniform(0.5, 2), 2) if rng.random() < 0.8 else 0,
+             datetime.now().isoformat(), '', rng.choice(INVESTMENT_TYPES))
+        )
+
+def insert_transfers(c, rng, count, start, end):
+    for _ in range(count):
+        from_account, to_account = rng.sample(ACCOUNTS, 2)
+        gross = round(rng.uniform(10, 2000), 2)
+        fees = round(gross * 0.01, 2)
+        c.execute(
+            "INSERT INTO transfers (date, amount, from_account, to_account, gross_amount, total_fees, description) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (random_day(rng, start, end).isoformat(), gross - fees, from_account, to_account, gross, fees, 'Transferencia')
+        )
+
+def generate(path, size, seed=42, years=8):
+    spec = SIZES[size]
+    rng = random.Random(seed)
+    end = date.today()
+    start = end - timedelta(days=365 * years)
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    retro_money.migrate_db(path)
+
+    conn = retro_money.open_db(path)
+    c = conn.cursor()
+    c.execute("UPDATE user_info SET monthly_salary = 3500 WHERE id = 1")
+    # Enough in every account for the benchmarks' ARS expenses (paid from Belo)
+    c.execute("UPDATE accounts SET balance = 1000000000")
+    # A long-lived broker token, so the portfolio benchmark skips the refresh
+    c.execute(
+        "INSERT OR REPLACE INTO broker_tokens (id, access_token, refresh_token, expires_in, last_updated) VALUES (1, ?, ?, ?, ?)",
+        (BROKER_ACCESS_TOKEN, 'bench-refresh-token', 10 * 365 * 24 * 3600, datetime.now().isoformat())
+    )
+    insert_expenses(c, rng, spec['expenses'], start, end)
+    for _ in range(spec['todo_roots']):
+        insert_todo_tree(c, rng, None, 0, spec['todo_depth'], spec['todo_branching'], start, end)
+    insert_investments(c, rng, spec['investments'], start, end)
+    insert_transfers(c, rng, spec['transfers'], start, end)
+    conn.commit()
+    c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+def default_path(size):
+    return os.path.join(DATA_DIR, f'{size}.db')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--out', help='database file (default benchmarks/data/<size>.db)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    path = args.out or default_path(args.size)
+    started = time.perf_counter()
+    generate(path, args.size, args.seed)
+    counts = ', '.join(f'{key}={value}' for key, value in SIZES[args.size].items())
+    print(f"Wrote {path} ({counts}) in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+"""Load test: how many concurrent users one deployment handles.
+
+    python benchmarks/loadtest.py --serve --size medium --users 5,10,20,40
+    python benchmarks/loadtest.py --url http://127.0.0.1:8092 --users 10,50 --stage-seconds 120
+
+Virtual users follow the real pages' request patterns (see SCENARIOS):
+opening the expense grid (grid.js initApp), bursts of expense adds, edits
+and deletes, working through the todo list, and leaving the transfers page
+open, which polls rates and accounts every --poll-seconds (300 in the
+browser). Each user picks a scenario, runs it with exponential think times
+(--think-seconds on average) and picks another, until the stage ends.
+
+Concurrency rises through the --users stages. Per stage the report shows
+throughput, latency percentiles, errors, 503s from the upstream bulkhead
+and SQLite lock contention: responses carrying "database is locked" and,
+when the server's /metrics is reachable, its sqlite_lock_errors_total.
+The highest stage whose p95 and error rate stay within --slo-p95-ms and
+--slo-error-rate is reported as the capacity. The full report is written
+to benchmarks/results/load-<time>.json.
+
+--serve runs everything locally: a copy of the generated --size database,
+the dolarapi/IOL stub servers (with the --upstream-* knobs) and the app,
+either Flask's threaded server or, with --server gunicorn, gunicorn with
+gunicorn.conf.py. Without it, start the app and benchmarks/stub_server.py
+yourself and pass --url.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import generate_data  # noqa: E402
+from stub_server import start_stub_servers  # noqa: E402
+from stubs import LATENCY_DISTRIBUTIONS, DolarApiStub, IolStub  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+CURRENCIES = ['ARS', 'USD', 'USD-Blue', 'USD-Tarjeta']
+CATEGORIES = ['Fixed Expenses', 'Guilt-Free Spending', 'Savings', 'Investments']
+
+class Recorder:
+    """Every request of the current stage: (name, status, ms, locked)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def add(self, sample):
+        with self.lock:
+            self.samples.append(sample)
+
+    def take(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+        return samples
+
+class StageOver(Exception):
+    pass
+
+class VirtualUser:
+    def __init__(self, base_url, recorder, deadline, args, seed):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.deadline = deadline
+        self.args = args
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.expenses_seq = 0
+
+    def think(self, scale=1.0):
+        # Exponential pauses, cut short by the end of the stage
+        pause = self.rng.expovariate(1 / (self.args.think_seconds * scale)) if self.args.think_seconds else 0
+        self.wait(pause)
+
+    def wait(self, seconds):
+        remaining = self.deadline - time.monotonic()
+        if seconds >= remaining:
+            time.sleep(max(remaining, 0))
+            raise StageOver
+        time.sleep(seconds)
+
+    def call(self, name, method, path, **kwargs):
+        if time.monotonic() >= self.deadline:
+            raise StageOver
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.args.timeout, **kwargs)
+            status, locked = response.status_code, False
+            if status >= 500:
+                locked = 'database is locked' in response.text
+        except requests.exceptions.RequestException:
+            response, status, locked = None, 0, False
+        self.recorder.add((name, status, (time.perf_counter() - started) * 1000, locked))
+        return response if status and status < 400 else None
+
+    def json(self, name, method, path, **kwargs):
+        response = self.call(name, method, path, **kwargs)
+        try:
+            return response.json() if response is not None else None
+        except ValueError:
+            return None
+
+    def run(self, delay=0):
+        names = list(SCENARIOS)
+        weights = [SCENARIOS[name][0] for name in names]
+        try:
+            self.wait(delay)
+            while True:
+                scenario = SCENARIOS[self.rng.choices(names, weights)[0]][1]
+                scenario(self)
+                self.think()
+        except StageOver:
+            pass
+        finally:
+            self.session.close()
+
+# Scenarios, modelled on the requests the pages make
+
+def open_expense_grid(user):
+    # index.html + grid.js initApp: rates, salary, first page and the
+    # totals summary, budget dashboard, account balances
+    user.call('GET /', 'GET', '/')
+    user.call('GET /api/exchange-rates', 'GET', '/api/exchange-rates?types=blue,tarjeta')
+    user.call('GET /api/salary', 'GET', '/api/salary')
+    response = user.call('GET /api/expenses (page)', 'GET', '/api/expenses?offset=0&limit=100&format=columnar')
+    user.call('GET /api/expenses/summary', 'GET', '/api/expenses/summary')
+    if response is not None:
+        user.expenses_seq = int(response.headers.get('X-Sync-Seq', 0))
+    user.call('GET /api/budget-allocations', 'GET', '/api/budget-allocations')
+    user.call('GET /api/accounts', 'GET', '/api/accounts')
+
+def sync_expenses(user):
+    # What the grid does after a write instead of reloading everything
+    data = user.json('GET /api/sync', 'GET', f'/api/sync?since={user.expenses_seq}&tables=expenses')
+    if data:
+        user.expenses_seq = data['seq']
+
+def expense_burst(user):
+    # Entering a few expenses in a row, fixing one and removing them
+    if not user.expenses_seq:
+        open_expense_grid(user)
+    created = []
+    for _ in range(user.rng.randint(2, 6)):
+        expense = {
+            'date': datetime.now().strftime('%Y-%m-%d'),
+            'description': 'Load test',
+            'amount': round(user.rng.uniform(1, 500), 2),
+            'currency': user.rng.choice(CURRENCIES),
+            'category': user.rng.choice(CATEGORIES),
+        }
+        data = user.json('POST /api/expenses', 'POST', '/api/expenses', json=expense)
+        if data and data.get('id'):
+            created.append((data['id'], expense))
+        sync_expenses(user)
+        user.call('GET /api/budget-allocations', 'GET', '/api/budget-allocations')
+        user.think(0.3)
+    if created:
+        expense_id, expense = user.rng.choice(created)
+        user.call('PUT /api/expenses/<id>', 'PUT', f'/api/expenses/{expense_id}',
+                  json=dict(expense, amount=round(expense['amount'] * 1.1, 2)))
+        sync_expenses(user)
+        user.think(0.3)
+    for expense_id, _ in created:
+        user.call('DELETE /api/expenses/<id>', 'DELETE', f'/api/expenses/{expense_id}')
+        user.think(0.2)
+    sync_expenses(user)
+
+def work_todos(user):
+    # todos.html: the list and weekly stats, then ticking tasks off (a
+    # parent completes its whole subtree) and the odd new task
+    user.call('GET /todos', 'GET', '/todos')
+    data = user.json('GET /api/todos', 'GET', '/api/todos?format=columnar')
+    user.call('GET /api/todos/stats/weekly', 'GET', '/api/todos/stats/weekly')
+    ids = []
+    if data and data.get('rows'):
+        column = data['columns'].index('id')
+        ids = [row[column] for row in data['rows']]
+    for _ in range(user.rng.randint(1, 5) if ids else 0):
+        user.think(0.5)
+        user.call('POST /api/todos/<id>/toggle', 'POST', f'/api/todos/{user.rng.choice(ids)}/toggle')
+    if user.rng.random() < 0.3:
+        todo = user.json('POST /api/todos', 'POST', '/api/todos', json={'description': 'Load test'})
+        if todo and todo.get('todo'):
+            todo_id = todo['todo']['id']
+            user.json('POST /api/todos', 'POST', '/api/todos',
+                      json={'description': 'Load test subtask', 'parent_id': todo_id})
+            user.think(0.5)
+            user.call('DELETE /api/todos/<id>', 'DELETE', f'/api/todos/{todo_id}')
+    user.call('GET /api/todos/stats/weekly', 'GET', '/api/todos/stats/weekly')
+
+def watch_transfers(user):
+    # transfers.html left open: initial load, then transfers.js polls the
+    # crypto rate and the accounts until the user goes elsewhere
+    user.call('GET /transfers', 'GET', '/transfers')
+    user.call('GET /api/exchange-rates', 'GET', '/api/exchange-rates?types=cripto')
+    user.call('GET /api/accounts', 'GET', '/api/accounts')
+    user.call('GET /api/transfers', 'GET', '/api/transfers?format=columnar')
+    while True:
+        user.wait(user.args.poll_seconds)
+        user.call('GET /api/exchange-rates', 'GET', '/api/exchange-rates?types=cripto')
+        user.call('GET /api/accounts', 'GET', '/api/accounts')
+
+# name -> (share of scenario picks, function)
+SCENARIOS = {
+    'open_expense_grid': (3, open_expense_grid),
+    'expense_burst': (2, expense_burst),
+    'work_todos': (3, work_todos),
+    'watch_transfers': (1, watch_transfers),
+}
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+def summarize(samples, seconds):
+    latencies = [ms for _, _, ms, _ in samples]
+    errors = sum(1 for _, status, _, _ in samples if status == 0 or status >= 500)
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / seconds, 2),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(max(latencies), 2) if latencies else 0.0,
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'rejected_503': sum(1 for _, status, _, _ in samples if status == 503),
+        'locked_responses': sum(1 for _, _, _, locked in samples if locked),
+    }
+
+def server_lock_errors(base_url):
+    # Sum of sqlite_lock_errors_total over all routes, or None without /metrics
+    try:
+        response = requests.get(base_url + '/metrics', timeout=5)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return sum(float(value) for value in re.findall(r'^sqlite_lock_errors_total\{[^}]*\} (\S+)$', response.text, re.M))
+
+def run_stage(base_url, users, args, stage):
+    recorder = Recorder()
+    locks_before = server_lock_errors(base_url)
+    deadline = time.monotonic() + args.stage_seconds
+    threads = []
+    for i in range(users):
+        user = VirtualUser(base_url, recorder, deadline, args, seed=f'{args.seed}-{stage}-{i}')
+        # Arrivals spread over the first tenth of the stage
+        delay = user.rng.uniform(0, args.stage_seconds / 10)
+        thread = threading.Thread(target=user.run, args=(delay,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(args.stage_seconds + args.timeout + 5)
+
+    samples = recorder.take()
+    result = {'users': users, **summarize(samples, args.stage_seconds)}
+    locks_after = server_lock_errors(base_url)
+    result['server_lock_errors'] = (
+        int(locks_after - locks_before) if locks_before is not None and locks_after is not None else None
+    )
+    by_name = {}
+    for sample in samples:
+        by_name.setdefault(sample[0], []).append(sample)
+    result['endpoints'] = {name: summarize(group, args.stage_seconds) for name, group in sorted(by_name.items())}
+    return result
+
+def print_stage(result):
+    locks = result['server_lock_errors']
+    print(f"{result['users']:>6} {result['requests']:>8} {result['throughput_rps']:>8.1f} "
+          f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>9.1f} "
+          f"{result['error_rate']:>7.2%} {result['rejected_503']:>5} {result['locked_responses']:>7} "
+          f"{'-' if locks is None else locks:>7}", flush=True)
+
+def print_endpoints(result):
+    print(f"\nBy endpoint at {result['users']} users:")
+    print(f"  {'endpoint':<32} {'req':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>9} {'errors':>7}")
+    for name, stats in result['endpoints'].items():
+        print(f"  {name:<32} {stats['requests']:>6} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+              f"{stats['p99_ms']:>9.1f} {stats['errors']:>7}")
+
+def wait_until_up(base_url, process, seconds=30):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}")
+        try:
+            if requests.get(base_url + '/api/salary', timeout=2).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Server did not answer at {base_url} within {seconds}s")
+
+def serve(args, tmp):
+    """Start stubs and the app locally; returns (base_url, cleanup)."""
+    db_source = generate_data.default_path(args.size)
+    if not os.path.exists(db_source):
+        print(f"Generating {db_source}")
+        generate_data.generate(db_source, args.size)
+    db_path = os.path.join(tmp, 'load.db')
+    shutil.copyfile(db_source, db_path)
+
+    knobs = {'latency_ms': args.upstream_latency_ms, 'latency_dist': args.upstream_latency_dist,
+             'error_rate': args.upstream_error_rate, 'seed': args.seed}
+    dolar_server, iol_server = start_stub_servers(
+        dolar=DolarApiStub(**knobs),
+        iol=IolStub(tokens=[generate_data.BROKER_ACCESS_TOKEN], **knobs),
+    )
+    env = dict(
+        os.environ,
+        DATABASE_PATH=db_path,
+        DOLARAPI_URL=dolar_server.url + '/v1',
+        IOL_URL=iol_server.url,
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'),
+        METRICS_DIR=os.path.join(tmp, 'metrics'),
+    )
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{args.port}', '--access-logfile', '/dev/null']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run',
+                   '--port', str(args.port), '--with-threads', '--no-reload']
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    def cleanup():
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        dolar_server.shutdown()
+        iol_server.shutdown()
+
+    try:
+        wait_until_up(base_url, process)
+    except BaseException:
+        cleanup()
+        raise
+    return base_url, cleanup
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8092', help='app to test (ignored with --serve)')
+    parser.add_argument('--users', default='5,10,20,40', help='comma-separated concurrency stages')
+    parser.add_argument('--stage-seconds', type=float, default=60)
+    parser.add_argument('--think-seconds', type=float, default=2.0, help='mean pause between user actions')
+    parser.add_argument('--poll-seconds', type=float, default=300, help='transfers page polling interval')
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout')
+    parser.add_argument('--slo-p95-ms', type=float, default=500)
+    parser.add_argument('--slo-error-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--serve', action='store_true', help='start stubs and the app locally')
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--port', type=int, default=8095, help='port for --serve')
+    parser.add_argument('--size', choices=generate_data.SIZES, default='small', help='dataset for --serve')
+    parser.add_argument('--upstream-latency-ms', type=float, default=50)
+    parser.add_argument('--upstream-latency-dist', choices=LATENCY_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--upstream-error-rate', type=float, default=0.0)
+    parser.add_argument('-v', '--verbose', action='store_true', help="show the served app's log")
+    args = parser.parse_args()
+    stages = [int(users) for users in args.users.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cleanup = None
+        base_url = args.url.rstrip('/')
+        if args.serve:
+            base_url, cleanup = serve(args, tmp)
+        try:
+            print(f"Load testing {base_url}: stages {stages}, {args.stage_seconds:g}s each")
+            print(f"{'users':>6} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>9} "
+                  f"{'errors':>7} {'503s':>5} {'locked':>7} {'lockerr':>7}")
+            results = []
+            for stage, users in enumerate(stages):
+                results.append(run_stage(base_url, users, args, stage))
+                print_stage(results[-1])
+        finally:
+            if cleanup:
+                cleanup()
+
+    print_endpoints(results[-1])
+    within = [r['users'] for r in results
+              if r['p95_ms'] <= args.slo_p95_ms and r['error_rate'] <= args.slo_error_rate]
+    capacity = max(within) if within else None
+    print(f"\nCapacity: {capacity if capacity is not None else 'below ' + str(stages[0])} users "
+          f"within p95 <= {args.slo_p95_ms:g} ms and errors <= {args.slo_error_rate:.1%}")
+
+    report = {
+        'url': base_url,
+        'server': args.server if args.serve else None,
+        'size': args.size if args.serve else None,
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('url', 'verbose')},
+        'capacity_users': capacity,
+        'stages': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Benchmark the API against a generated database.
+
+    python benchmarks/generate_data.py --size small
+    python benchmarks/run.py --size small            # compare with the baseline
+    python benchmarks/run.py --size small --save     # record a new baseline
+    python benchmarks/run.py --size small -k todo    # only matching cases
+
+Each case drives the Flask test client against a fresh copy of the
+database, with dolarapi and InvertirOnline answered in-process by
+benchmarks/stubs.py. Per case it reports min/median/p95/mean milliseconds
+over --iterations timed runs (after --warmup untimed ones). Baselines live
+in benchmarks/baselines/<size>.json; a case whose --stat (min by default,
+the least disturbed by other processes) is more than --threshold slower
+than its baseline, and by at least --min-delta ms, is a regression, and
+the run exits with status 1. Baselines are machine-specific, so record one before and
+after a change on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Keep per-request logging out of the timings
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+import app as retro_money  # noqa: E402
+import generate_data  # noqa: E402
+from stubs import DolarApiStub, IolStub, StubSession  # noqa: E402
+
+BASELINE_DIR = os.path.join(BENCH_DIR, 'baselines')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+class Bench:
+    """What a case gets: the test client and a raw connection for setup."""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.state = {}
+
+    def sql(self, query, params=()):
+        conn = retro_money.open_db(self.path)
+        try:
+            rows = conn.execute(query, params).fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+def check(response, status=200):
+    if response.status_code != status:
+        raise AssertionError(f"{response.request.method} {response.request.path} returned "
+                             f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+# Each case is (setup, run). setup runs untimed before every iteration.
+
+def setup_deep_todo(bench):
+    # A full-depth tree's root, reopened so that each toggle completes the
+    # whole subtree (the expensive direction)
+    if 'root' not in bench.state:
+        bench.state['root'] = bench.sql("SELECT id FROM todos WHERE parent_id IS NULL ORDER BY id LIMIT 1")[0][0]
+    bench.sql("""
+        WITH RECURSIVE subtasks(id) AS (
+            SELECT ? UNION ALL SELECT t.id FROM todos t, subtasks s WHERE t.parent_id = s.id
+        )
+        UPDATE todos SET is_completed = 0, completed_date = NULL WHERE id IN subtasks
+    """, (bench.state['root'],))
+
+def setup_todo_subtree(bench):
+    # A fresh 4-level subtree (15 todos) to delete
+    today = datetime.now().strftime('%Y-%m-%d')
+    conn = retro_money.open_db(bench.path)
+    parents = [conn.execute(
+        "INSERT INTO todos (description, created_date, level) VALUES ('Benchmark', ?, 0)", (today,)
+    ).lastrowid]
+    bench.state['subtree'] = parents[0]
+    for level in range(1, 4):
+        parents = [
+            conn.execute(
+                "INSERT INTO todos (description, created_date, parent_id, level) VALUES ('Benchmark', ?, ?, ?)",
+                (today, parent, level)
+            ).lastrowid
+            for parent in parents for _ in range(2)
+        ]
+    conn.commit()
+    conn.close()
+
+def clear_portfolio_cache(bench):
+    bench.sql("DELETE FROM shared_cache WHERE key LIKE 'portfolio:%'")
+
+def no_setup(bench):
+    pass
+
+CASES = {
+    'get_expenses_page': (no_setup, lambda b: check(b.client.get('/api/expenses?limit=100&offset=0'))),
+    'get_expenses_all': (no_setup, lambda b: check(b.client.get('/api/expenses'))),
+    'expense_summary': (no_setup, lambda b: check(b.client.get('/api/expenses/summary'))),
+    'budget_allocations': (no_setup, lambda b: check(b.client.get('/api/budget-allocations'))),
+    'add_expense': (no_setup, lambda b: check(b.client.post('/api/expenses', json={
+        'date': datetime.now().strftime('%Y-%m-%d'), 'description': 'Benchmark',
+        'amount': 1234.5, 'currency': 'ARS', 'category': 'Guilt-Free Spending',
+    }))),
+    'toggle_todo': (setup_deep_todo, lambda b: check(b.client.post(f"/api/todos/{b.state['root']}/toggle"))),
+    'delete_todo': (setup_todo_subtree, lambda b: check(b.client.delete(f"/api/todos/{b.state['subtree']}"))),
+    'accounts': (no_setup, lambda b: check(b.client.get('/api/accounts'))),
+    'broker_portfolio_cold': (clear_portfolio_cache, lambda b: check(b.client.get('/api/broker/portfolio'))),
+    'broker_portfolio_cached': (no_setup, lambda b: check(b.client.get('/api/broker/portfolio'))),
+}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def time_case(bench, setup, run, warmup, iterations):
+    for _ in range(warmup):
+        setup(bench)
+        run(bench)
+    samples = []
+    for _ in range(iterations):
+        setup(bench)
+        started = time.perf_counter()
+        run(bench)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'n': len(samples),
+    }
+
+def run_cases(db_path, names, warmup, iterations, assets):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        shutil.copyfile(db_path, path)
+        retro_money._http_session = StubSession(
+            DolarApiStub(), IolStub(assets=assets, tokens=[generate_data.BROKER_ACCESS_TOKEN])
+        )
+        app = retro_money.create_app({'DATABASE': path})
+        bench = Bench(app.test_client(), path)
+        for name in names:
+            setup, run = CASES[name]
+            results[name] = time_case(bench, setup, run, warmup, iterations)
+            print(f"  {name:<26} median {results[name]['median_ms']:>9.3f} ms   "
+                  f"p95 {results[name]['p95_ms']:>9.3f} ms", flush=True)
+        retro_money._http_session = None
+    return results
+
+def compare(results, baseline, stat, threshold, min_delta):
+    regressions = []
+    key = f'{stat}_ms'
+    for name, result in results.items():
+        before = baseline.get('cases', {}).get(name)
+        if not before:
+            print(f"  {name:<26} (no baseline)")
+            continue
+        delta = result[key] - before[key]
+        change = delta / before[key] if before[key] else 0
+        regressed = change > threshold and delta > min_delta
+        flag = 'REGRESSION' if regressed else ('faster' if change < -threshold and -delta > min_delta else 'ok')
+        print(f"  {name:<26} {before[key]:>9.3f} -> {result[key]:>9.3f} ms  {change:>+7.1%}  {flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=generate_data.SIZES, default='small')
+    parser.add_argument('--db', help='database to benchmark (default benchmarks/data/<size>.db, generated if missing)')
+    parser.add_argument('-k', dest='only', help='only run cases whose name contains this')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--assets', type=int, default=50, help='positions in the stubbed IOL portfolio')
+    parser.add_argument('--stat', choices=['min', 'median', 'p95', 'mean'], default='min', help='statistic to compare')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown (default 0.25 = 25%%)')
+    parser.add_argument('--min-delta', type=float, default=0.5, help='ignore slowdowns under this many ms')
+    parser.add_argument('--save', action='store_true', help='write the results as the baseline for --size')
+    args = parser.parse_args()
+
+    db_path = args.db or generate_data.default_path(args.size)
+    if not os.path.exists(db_path):
+        print(f"Generating {db_path}")
+        generate_data.generate(db_path, args.size)
+
+    names = [name for name in CASES if not args.only or args.only in name]
+    print(f"Running {len(names)} cases on {args.size} ({args.iterations} iterations)")
+    results = run_cases(db_path, names, args.warmup, args.iterations, args.assets)
+
+    report = {
+        'size': args.size,
+        'dataset': generate_data.SIZES[args.size],
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': retro_money.sqlite3.sqlite_version,
+        'machine': platform.machine(),
+        'iterations': args.iterations,
+        'cases': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    with open(os.path.join(RESULTS_DIR, f'{args.size}-{stamp}.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline_path = os.path.join(BASELINE_DIR, f'{args.size}.json')
+    if args.save:
+        if os.path.exists(baseline_path) and args.only:
+            # Only replace the cases that ran
+            with open(baseline_path) as f:
+                merged = json.load(f)
+            merged['cases'].update(results)
+            report = {**report, 'cases': merged['cases']}
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Saved baseline {baseline_path}")
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}; run with --save to record one")
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"Compared {args.stat} with baseline from {baseline.get('recorded_at')} "
+          f"(threshold {args.threshold:.0%}, min delta {args.min_delta} ms)")
+    regressions = compare(results, baseline, args.stat, args.threshold, args.min_delta)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
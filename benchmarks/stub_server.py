@@ -0,0 +1,120 @@
+"""Serve the dolarapi and InvertirOnline stubs over HTTP.
+
+    python benchmarks/stub_server.py --latency-ms 150 --latency-dist lognormal --error-rate 0.02
+    DOLARAPI_URL=http://127.0.0.1:8093/v1 IOL_URL=http://127.0.0.1:8094 python app.py
+
+Each upstream gets its own port (so the app's per-host connection limits
+and circuit breakers behave as they do against the real hosts). Latency
+and error knobs apply to both unless overridden with --dolar-*/--iol-*.
+Log in on the investments page with any username and password; tokens
+expire after --token-expiry seconds, so a small value exercises the app's
+refresh path. Stop with Ctrl-C, which prints the request counts.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import LATENCY_DISTRIBUTIONS, DolarApiStub, IolStub  # noqa: E402
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, payload = self.server.stub.handle(self.command, self.path, dict(self.headers), body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, stub, verbose=False):
+        super().__init__(address, StubHandler)
+        self.stub = stub
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+def start_stub_servers(host='127.0.0.1', dolar_port=0, iol_port=0, dolar=None, iol=None, verbose=False):
+    """Serve the two stubs on background threads.
+
+    Port 0 picks a free port. Returns (dolar_server, iol_server); point
+    DOLARAPI_URL at dolar_server.url + '/v1' and IOL_URL at iol_server.url,
+    and call shutdown() on both when done.
+    """
+    servers = (
+        StubServer((host, dolar_port), dolar or DolarApiStub(), verbose),
+        StubServer((host, iol_port), iol or IolStub(), verbose),
+    )
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
+
+def knobs(args, prefix):
+    def pick(name):
+        override = getattr(args, f'{prefix}_{name}')
+        return getattr(args, name) if override is None else override
+    return {
+        'latency_ms': pick('latency_ms'),
+        'latency_dist': args.latency_dist,
+        'latency_sigma': args.latency_sigma,
+        'error_rate': pick('error_rate'),
+        'seed': args.seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--dolar-port', type=int, default=8093)
+    parser.add_argument('--iol-port', type=int, default=8094)
+    parser.add_argument('--latency-ms', type=float, default=0, help='median response delay')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--latency-sigma', type=float, default=1.0, help='lognormal spread (tail weight)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered 500/502/503')
+    parser.add_argument('--dolar-latency-ms', type=float)
+    parser.add_argument('--dolar-error-rate', type=float)
+    parser.add_argument('--iol-latency-ms', type=float)
+    parser.add_argument('--iol-error-rate', type=float)
+    parser.add_argument('--token-expiry', type=int, default=900, help='IOL access token lifetime in seconds')
+    parser.add_argument('--assets', type=int, default=50, help='positions in the IOL portfolio')
+    parser.add_argument('--token', action='append', default=[],
+                        help='access token accepted without expiry (repeatable)')
+    parser.add_argument('--seed', type=int, help='seed for latency and error draws')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    dolar = DolarApiStub(**knobs(args, 'dolar'))
+    iol = IolStub(assets=args.assets, token_expiry=args.token_expiry, tokens=args.token, **knobs(args, 'iol'))
+    dolar_server, iol_server = start_stub_servers(args.host, args.dolar_port, args.iol_port, dolar, iol, args.verbose)
+    print(f"DOLARAPI_URL={dolar_server.url}/v1")
+    print(f"IOL_URL={iol_server.url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    for name, server in (('dolarapi', dolar_server), ('iol', iol_server)):
+        server.shutdown()
+        print(f"{name}: {server.stub.calls} requests, {server.stub.errors} injected errors")
+
+if __name__ == '__main__':
+    main()
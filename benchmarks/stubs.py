@@ -0,0 +1,228 @@
+"""Stand-ins for dolarapi and InvertirOnline.
+
+DolarApiStub and IolStub answer the endpoints the app calls, in the real
+APIs' shapes, with knobs for latency, injected errors, token expiry and
+portfolio size. They can be used in-process through StubSession (which
+replaces the app's pooled requests session, see benchmarks/run.py) or over
+HTTP through benchmarks/stub_server.py.
+"""
+import json
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+DOLAR_QUOTES = {
+    'oficial': (1040.0, 1080.0),
+    'blue': (1180.0, 1200.0),
+    'bolsa': (1170.0, 1175.5),
+    'contadoconliqui': (1185.0, 1190.0),
+    'tarjeta': (1872.0, 1872.0),
+    'cripto': (1210.0, 1225.0),
+}
+
+IOL_TICKERS = ['GGAL', 'YPFD', 'PAMP', 'BMA', 'TXAR', 'ALUA', 'CEPU', 'TGSU2', 'LOMA', 'CRES',
+               'AL30', 'GD30', 'AE38', 'SPY', 'AAPL', 'MELI', 'KO', 'MSFT', 'NVDA', 'VIST']
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+def dolar_quote(kind):
+    compra, venta = DOLAR_QUOTES[kind]
+    return {
+        'moneda': 'USD',
+        'casa': kind,
+        'nombre': kind.capitalize(),
+        'compra': compra,
+        'venta': venta,
+        'fechaActualizacion': datetime.now().strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+    }
+
+def iol_portfolio(assets, seed=7):
+    rng = random.Random(seed)
+    activos = []
+    for i in range(assets):
+        symbol = IOL_TICKERS[i % len(IOL_TICKERS)] + ('' if i < len(IOL_TICKERS) else str(i // len(IOL_TICKERS)))
+        quantity = rng.randint(1, 500)
+        ppc = round(rng.uniform(100, 50000), 2)
+        price = round(ppc * rng.uniform(0.7, 1.6), 2)
+        activos.append({
+            'cantidad': quantity,
+            'comprometido': 0,
+            'puntosVariacion': round(rng.uniform(-50, 50), 2),
+            'variacionDiaria': round(rng.uniform(-5, 5), 2),
+            'ultimoPrecio': price,
+            'ppc': ppc,
+            'gananciaPorcentaje': round((price / ppc - 1) * 100, 2),
+            'gananciaDinero': round((price - ppc) * quantity, 2),
+            'valorizado': round(price * quantity, 2),
+            'titulo': {
+                'simbolo': symbol,
+                'descripcion': f'{symbol} descripcion',
+                'pais': 'argentina',
+                'mercado': 'bcba',
+                'tipo': 'ACCIONES' if i % 3 else 'TitulosPublicos',
+                'plazo': 't1',
+                'moneda': 'peso_Argentino',
+            },
+            'parking': None,
+        })
+    return {'pais': 'argentina', 'activos': activos}
+
+class UpstreamStub:
+    """Latency and error injection shared by both stubs.
+
+    latency_ms is the median delay; latency_dist shapes it: 'fixed',
+    'uniform' (0 to 2x), 'exponential' or 'lognormal' (latency_sigma sets
+    the tail; 1.0 gives a p99 about 10x the median). error_rate is the
+    share of requests answered with one of error_statuses instead.
+    """
+
+    def __init__(self, latency_ms=0, latency_dist='fixed', latency_sigma=1.0,
+                 error_rate=0.0, error_statuses=(500, 502, 503), seed=None):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_dist must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def delay(self):
+        if not self.latency_ms:
+            return 0
+        with self.lock:
+            if self.latency_dist == 'uniform':
+                ms = self.rng.uniform(0, 2 * self.latency_ms)
+            elif self.latency_dist == 'exponential':
+                # Median latency_ms, i.e. mean latency_ms / ln 2
+                ms = self.rng.expovariate(0.6931471805599453 / self.latency_ms)
+            elif self.latency_dist == 'lognormal':
+                ms = self.latency_ms * self.rng.lognormvariate(0, self.latency_sigma)
+            else:
+                ms = self.latency_ms
+        return ms / 1000
+
+    def handles(self, path):
+        raise NotImplementedError
+
+    def route(self, method, path, headers, body):
+        raise NotImplementedError
+
+    def handle(self, method, path, headers=None, body=b''):
+        """(status, payload) for one request, after the injected delay."""
+        with self.lock:
+            self.calls += 1
+            failed = self.error_rate and self.rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+                status = self.rng.choice(self.error_statuses)
+        time.sleep(self.delay())
+        if failed:
+            return status, {'message': 'Injected upstream error'}
+        return self.route(method.upper(), urlparse(path).path, headers or {}, body or b'')
+
+class DolarApiStub(UpstreamStub):
+    """GET /v1/dolares/<kind> as served by dolarapi.com."""
+
+    def handles(self, path):
+        return '/dolares/' in path
+
+    def route(self, method, path, headers, body):
+        kind = path.rstrip('/').rsplit('/', 1)[-1]
+        if method != 'GET' or kind not in DOLAR_QUOTES:
+            return 404, {'message': 'Not Found'}
+        return 200, dolar_quote(kind)
+
+class IolStub(UpstreamStub):
+    """POST /token and GET /api/v2/portafolio/<pais> as served by IOL.
+
+    Access tokens are issued by /token (password or refresh_token grant,
+    any non-empty credentials) and expire after token_expiry seconds, after
+    which the portfolio answers 401 until the app refreshes. tokens lists
+    access tokens accepted without expiry, e.g. the one a generated
+    benchmark database already holds.
+    """
+
+    def __init__(self, assets=50, token_expiry=900, tokens=(), **knobs):
+        super().__init__(**knobs)
+        self.assets = assets
+        self.token_expiry = token_expiry
+        self.access_tokens = {token: float('inf') for token in tokens}
+        self.refresh_tokens = set()
+        self.portfolio = iol_portfolio(assets)
+
+    def handles(self, path):
+        return path == '/token' or path.startswith('/api/v2/')
+
+    def issue_token(self):
+        access_token, refresh_token = secrets.token_urlsafe(24), secrets.token_urlsafe(24)
+        with self.lock:
+            self.access_tokens[access_token] = time.time() + self.token_expiry
+            self.refresh_tokens.add(refresh_token)
+        return 200, {
+            'access_token': access_token,
+            'token_type': 'bearer',
+            'expires_in': self.token_expiry,
+            'refresh_token': refresh_token,
+            '.issued': datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        }
+
+    def route(self, method, path, headers, body):
+        if path == '/token' and method == 'POST':
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            grant = form.get('grant_type')
+            if grant == 'password' and form.get('username') and form.get('password'):
+                return self.issue_token()
+            if grant == 'refresh_token' and form.get('refresh_token') in self.refresh_tokens:
+                with self.lock:
+                    self.refresh_tokens.discard(form['refresh_token'])
+                return self.issue_token()
+            return 400, {'error': 'invalid_grant'}
+
+        if path.startswith('/api/v2/portafolio') and method == 'GET':
+            authorization = {key.lower(): value for key, value in headers.items()}.get('authorization', '')
+            token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+            if self.access_tokens.get(token, 0) < time.time():
+                return 401, {'message': 'Authorization has been denied for this request.'}
+            return 200, self.portfolio
+
+        return 404, {'message': 'No HTTP resource was found that matches the request URI'}
+
+class StubSession:
+    """Drop-in for requests.Session: answers from the stubs in-process."""
+
+    def __init__(self, *stubs):
+        self.stubs = stubs or (DolarApiStub(), IolStub())
+
+    @property
+    def calls(self):
+        return sum(stub.calls for stub in self.stubs)
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        path = urlparse(url).path
+        stub = next((stub for stub in self.stubs if stub.handles(path)), None)
+        if stub is None:
+            status, payload = 404, {'message': f'No stub for {method} {url}'}
+        else:
+            body = data.encode() if isinstance(data, str) else (data or b'')
+            status, payload = stub.handle(method, path, headers, body)
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(payload).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.url = url
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
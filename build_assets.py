@@ -0,0 +1,125 @@
+"""Build fingerprinted, minified and precompressed static bundles.
+
+    python build_assets.py
+
+For every stylesheet and script under static/ this writes
+static/dist/<path>.<hash>.<ext> plus .gz and .br siblings, and
+static/dist/manifest.json mapping the original path to the bundle. app.py
+reads the manifest at startup to rewrite url_for('static', ...) and serves
+the bundles with immutable caching. Run it again after changing an asset.
+
+Minification uses rjsmin/rcssmin and brotli output uses the brotli package
+when they are installed; without them scripts are copied as-is, stylesheets
+get a basic whitespace/comment pass and only gzip files are written.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+ASSET_DIRS = ('css', 'js')
+
+# Served under a fixed URL (/sw.js), so it must not be fingerprinted
+EXCLUDED = {'js/sw.js'}
+
+def minify_css(source):
+    if rcssmin:
+        return rcssmin.cssmin(source)
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    return source.replace(';}', '}').strip()
+
+def minify_js(source):
+    if rjsmin:
+        return rjsmin.jsmin(source)
+    # Line-based fallback: drop indentation, blank lines and whole-line
+    # comments, leaving the inside of multi-line template literals alone
+    lines = []
+    in_template = in_comment = False
+    for line in source.splitlines():
+        stripped = line.strip()
+        if not in_template:
+            if in_comment:
+                in_comment = not stripped.endswith('*/')
+                continue
+            if stripped.startswith('/*') and '*/' not in stripped[2:-2]:
+                in_comment = not stripped.endswith('*/')
+                continue
+            if not stripped or stripped.startswith('//'):
+                continue
+            line = stripped
+        lines.append(line)
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+def minify(path, source):
+    if path.endswith('.min.js') or path.endswith('.min.css'):
+        return source
+    if path.endswith('.css'):
+        return minify_css(source)
+    return minify_js(source)
+
+def fingerprint(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+def write_bundle(path, content):
+    target = os.path.join(DIST_DIR, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+    with open(target + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli:
+        with open(target + '.br', 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+def build():
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest = {}
+
+    for asset_dir in ASSET_DIRS:
+        for name in sorted(os.listdir(os.path.join(STATIC_DIR, asset_dir))):
+            path = f"{asset_dir}/{name}"
+            if path in EXCLUDED or not name.endswith(('.css', '.js')):
+                continue
+
+            with open(os.path.join(STATIC_DIR, path), encoding='utf-8') as f:
+                source = f.read()
+            content = minify(path, source).encode('utf-8')
+
+            bundle = fingerprint(path, content)
+            write_bundle(bundle, content)
+            manifest[path] = bundle
+            print(f"{path} -> dist/{bundle} ({len(source.encode('utf-8'))} -> {len(content)} bytes)")
+
+    with open(os.path.join(DIST_DIR, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if not (rjsmin and rcssmin and brotli):
+        print("Note: install rjsmin, rcssmin and brotli for full minification and .br files")
+
+if __name__ == '__main__':
+    build()
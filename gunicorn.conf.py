@@ -0,0 +1,50 @@
+"""Production server settings.
+
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py
+
+Runs create_app() once in the master (applying any pending migrations) and
+forks WEB_CONCURRENCY worker processes with GUNICORN_THREADS threads each.
+Workers share the SQLite database in WAL mode, and exchange rates and broker
+portfolios through its shared_cache table, so adding workers does not
+multiply the calls to dolarapi or InvertirOnline. /metrics covers all
+workers through METRICS_DIR.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', '0.0.0.0:8092')
+
+# Requests mostly wait on SQLite or upstream APIs, so threads help on top of
+# one process per core. Keep threads above 2 x UPSTREAM_VIEW_CONCURRENCY so
+# that slow broker and rate calls always leave some for everything else.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+
+# Build the app (and migrate) before forking instead of once per worker
+preload_app = True
+
+# Upstream calls time out on their own (UPSTREAM_TIMEOUT); this only catches
+# stuck workers
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+
+# Workers write metric snapshots here for /metrics to add up. Set before the
+# app is imported (it reads METRICS_DIR at import) and emptied on start.
+metrics_dir = os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'retro-money-metrics'))
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
@@ -1,6 +1,8 @@
 /**
- * RetroMoney App Storage - LocalStorage management
- * Handles caching and persistent storage between page loads
+ * RetroMoney App Storage - IndexedDB and LocalStorage management
+ * Handles caching and persistent storage between page loads.
+ * Record collections (expenses, todos, investments, transfers) are kept
+ * one record per row in IndexedDB; small values stay in localStorage.
  */
 
 const AppStorage = {
@@ -11,7 +13,8 @@ const AppStorage = {
         rates: 60 * 60 * 1000,    // 1 hour
         salary: 24 * 60 * 60 * 1000, // 24 hours
         stats: 30 * 60 * 1000,     // 30 minutes
-        investments: 30 * 60 * 1000 // 30 minutes
+        investments: 30 * 60 * 1000, // 30 minutes
+        transfers: 30 * 60 * 1000  // 30 minutes
     },
     
     // Storage Keys
@@ -20,6 +23,7 @@ const AppStorage = {
         todos: 'retro_money_todos',
         rateBlue: 'retro_money_rate_blue',
         rateTarjeta: 'retro_money_rate_tarjeta',
+        rateCripto: 'retro_money_rate_cripto',
         activeRateType: 'retro_money_active_rate',
         salary: 'retro_money_salary',
         budgetAllocations: 'retro_money_budget_allocations',
@@ -29,6 +33,36 @@ const AppStorage = {
         transfers: 'retro_money_transfers'
     },
     
+    // IndexedDB database holding the record collections
+    dbName: 'retro-money',
+    dbVersion: 1,
+    dbPromise: null,
+    
+    // One object store per collection, keyed by id. `indexes` maps index
+    // names to key paths; `compare` reproduces the API's sort order.
+    collections: {
+        expenses: {
+            indexes: { date: ['date', 'id'], category: 'category' },
+            compare: (a, b) => AppStorage.compareDesc(a.date, b.date) || b.id - a.id
+        },
+        todos: {
+            indexes: { planned_date: 'planned_date', parent_id: 'parent_id' },
+            compare: (a, b) => a.level - b.level ||
+                (a.parent_id || 0) - (b.parent_id || 0) ||
+                a.is_completed - b.is_completed ||
+                AppStorage.compareDesc(a.created_date, b.created_date) ||
+                b.id - a.id
+        },
+        investments: {
+            indexes: { purchase_date: ['purchase_date', 'id'], investment_type: 'investment_type' },
+            compare: (a, b) => AppStorage.compareDesc(a.purchase_date, b.purchase_date) || b.id - a.id
+        },
+        transfers: {
+            indexes: { date: ['date', 'id'] },
+            compare: (a, b) => AppStorage.compareDesc(a.date, b.date) || b.id - a.id
+        }
+    },
+    
     /**
      * Get data from localStorage with expiry check
      * @param {string} key - Storage key
@@ -86,13 +120,458 @@ const AppStorage = {
         localStorage.removeItem(key);
     },
     
+    // API responses the server rendered into the page (#bootstrap-data),
+    // keyed by URL; each one answers the first request for it
+    bootstrap: null,
+    
+    /**
+     * Read the page's bootstrap data once
+     * @returns {Object} - Responses keyed by URL
+     */
+    readBootstrap: function() {
+        if (this.bootstrap === null) {
+            const element = typeof document !== 'undefined' ? document.getElementById('bootstrap-data') : null;
+            try {
+                this.bootstrap = element ? JSON.parse(element.textContent) || {} : {};
+            } catch (error) {
+                console.error('Error parsing bootstrap data:', error);
+                this.bootstrap = {};
+            }
+        }
+        return this.bootstrap;
+    },
+    
+    /**
+     * Whether the page came with a (still unused) response for a URL. That
+     * data is as fresh as it gets, so callers skip their caches for it.
+     * @param {string} url - API URL
+     * @returns {boolean}
+     */
+    hasBootstrap: function(url) {
+        return url in this.readBootstrap();
+    },
+    
+    /**
+     * fetch() for API reads: answered from the bootstrap data when the page
+     * has a response for this URL, from the network otherwise
+     * @param {string} url - API URL
+     * @param {Object} options - fetch() options
+     * @returns {Promise<Response>}
+     */
+    request: function(url, options = {}) {
+        const bootstrap = this.readBootstrap();
+        const entry = bootstrap[url];
+        
+        if (!entry || (options.method && options.method !== 'GET')) {
+            return fetch(url, options);
+        }
+        
+        delete bootstrap[url];
+        return Promise.resolve({
+            ok: true,
+            status: 200,
+            headers: new Headers(entry.headers || {}),
+            json: () => Promise.resolve(entry.body)
+        });
+    },
+    
+    /**
+     * Options for API reads: forced refreshes skip the service worker's
+     * stale-while-revalidate cache and go to the network first
+     * @param {boolean} forceRefresh - Force API refresh
+     * @returns {Object} - fetch() options
+     */
+    fetchOptions: function(forceRefresh) {
+        return forceRefresh ? { cache: 'no-cache' } : {};
+    },
+    
     /**
-     * Clear all app data from localStorage
+     * Clear all app data from localStorage and IndexedDB
      */
     clearAll: function() {
         Object.values(this.keys).forEach(key => {
             localStorage.removeItem(key);
         });
+        this.clearCollections();
+    },
+    
+    /**
+     * Expire every cached value except user preferences, e.g. after
+     * offline writes were replayed on the server
+     */
+    invalidateAll: function() {
+        Object.entries(this.keys).forEach(([name, key]) => {
+            if (name !== 'activeRateType') {
+                localStorage.removeItem(key);
+            }
+        });
+        Object.keys(this.collections).forEach(name => this.expireCollection(name));
+    },
+    
+    /**
+     * Compare two strings (dates) in descending order
+     */
+    compareDesc: function(a, b) {
+        return a === b ? 0 : ((a || '') < (b || '') ? 1 : -1);
+    },
+    
+    /**
+     * Open the IndexedDB database, creating the stores on first use
+     * @returns {Promise<IDBDatabase|null>} - null when IndexedDB is unavailable
+     *   (e.g. private browsing); collections then fall back to localStorage
+     */
+    openDb: function() {
+        if (this.dbPromise) return this.dbPromise;
+        
+        this.dbPromise = new Promise(resolve => {
+            if (!window.indexedDB) {
+                resolve(null);
+                return;
+            }
+            
+            const request = indexedDB.open(this.dbName, this.dbVersion);
+            
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                if (!db.objectStoreNames.contains('meta')) {
+                    db.createObjectStore('meta', { keyPath: 'name' });
+                }
+                Object.entries(this.collections).forEach(([name, collection]) => {
+                    if (db.objectStoreNames.contains(name)) return;
+                    const store = db.createObjectStore(name, { keyPath: 'id' });
+                    Object.entries(collection.indexes).forEach(([indexName, keyPath]) => {
+                        store.createIndex(indexName, keyPath);
+                    });
+                });
+            };
+            
+            request.onsuccess = () => {
+                // Whole-collection blobs cached by earlier versions only use up quota
+                Object.keys(this.collections).forEach(name => localStorage.removeItem(this.keys[name]));
+                resolve(request.result);
+            };
+            
+            request.onerror = () => {
+                console.error('Error opening IndexedDB:', request.error);
+                resolve(null);
+            };
+        });
+        
+        return this.dbPromise;
+    },
+    
+    /**
+     * Run requests inside one IndexedDB transaction
+     * @param {IDBDatabase} db - Open database
+     * @param {Array} storeNames - Stores used by the transaction
+     * @param {string} mode - 'readonly' or 'readwrite'
+     * @param {Function} operation - Called with (transaction, result); set
+     *   result.value from the request callbacks
+     * @returns {Promise} - Resolves with result.value once the transaction commits
+     */
+    runTransaction: function(db, storeNames, mode, operation) {
+        return new Promise((resolve, reject) => {
+            const transaction = db.transaction(storeNames, mode);
+            const result = { value: undefined };
+            
+            transaction.oncomplete = () => resolve(result.value);
+            transaction.onerror = () => reject(transaction.error);
+            transaction.onabort = () => reject(transaction.error);
+            
+            operation(transaction, result);
+        });
+    },
+    
+    /**
+     * Read a cached collection
+     * @param {string} name - Collection name
+     * @returns {Promise<Object|null>} - { records, extra } or null if expired/not found
+     */
+    readCollection: function(name) {
+        const expiryTime = this.cacheExpiry[name];
+        
+        return this.openDb().then(db => {
+            if (!db) {
+                return this.get(this.keys[name], expiryTime);
+            }
+            
+            return this.runTransaction(db, [name, 'meta'], 'readonly', (transaction, result) => {
+                const metaRequest = transaction.objectStore('meta').get(name);
+                metaRequest.onsuccess = () => {
+                    const meta = metaRequest.result;
+                    if (!meta || new Date().getTime() - meta.timestamp > expiryTime) {
+                        result.value = null;
+                        return;
+                    }
+                    
+                    const recordsRequest = transaction.objectStore(name).getAll();
+                    recordsRequest.onsuccess = () => {
+                        result.value = {
+                            records: recordsRequest.result.sort(this.collections[name].compare),
+                            extra: meta.extra
+                        };
+                    };
+                };
+            });
+        }).catch(error => {
+            console.error(`Error reading cached ${name}:`, error);
+            return null;
+        });
+    },
+    
+    /**
+     * Read a slice of a cached collection in descending index order,
+     * without loading the rest of it. Expired data is returned too, since
+     * this is meant for a first paint before fresh data arrives.
+     * @param {string} name - Collection name
+     * @param {string} indexName - Index giving the order
+     * @param {number} offset - Number of records to skip
+     * @param {number} limit - Maximum number of records
+     * @returns {Promise<Object|null>} - { records, total } or null if not cached
+     */
+    readPage: function(name, indexName, offset, limit) {
+        return this.openDb().then(db => {
+            if (!db) return null;
+            
+            return this.runTransaction(db, [name, 'meta'], 'readonly', (transaction, result) => {
+                const metaRequest = transaction.objectStore('meta').get(name);
+                metaRequest.onsuccess = () => {
+                    if (!metaRequest.result) {
+                        result.value = null;
+                        return;
+                    }
+                    
+                    const store = transaction.objectStore(name);
+                    const records = [];
+                    result.value = { records, total: 0 };
+                    
+                    store.count().onsuccess = event => {
+                        result.value.total = event.target.result;
+                    };
+                    
+                    let skipped = offset === 0;
+                    store.index(indexName).openCursor(null, 'prev').onsuccess = event => {
+                        const cursor = event.target.result;
+                        if (!cursor) return;
+                        if (!skipped) {
+                            skipped = true;
+                            cursor.advance(offset);
+                            return;
+                        }
+                        records.push(cursor.value);
+                        if (records.length < limit) {
+                            cursor.continue();
+                        }
+                    };
+                };
+            });
+        }).catch(error => {
+            console.error(`Error reading cached ${name} page:`, error);
+            return null;
+        });
+    },
+    
+    /**
+     * Compare two records field by field, whatever their key order
+     * (columnar payloads and /api/sync rows order keys differently)
+     */
+    sameRecord: function(a, b) {
+        const keys = Object.keys(a);
+        if (keys.length !== Object.keys(b).length) return false;
+        return keys.every(key => a[key] === b[key] ||
+            (typeof a[key] === 'object' && JSON.stringify(a[key]) === JSON.stringify(b[key])));
+    },
+    
+    /**
+     * Store a full server snapshot of a collection. Only records that were
+     * added, changed or removed since the last snapshot are written.
+     * @param {string} name - Collection name
+     * @param {Array} records - Records from the API
+     * @param {*} extra - Non-record data returned along with them (optional)
+     * @param {number|null} seq - Change-feed position of the snapshot (X-Sync-Seq)
+     * @returns {Promise}
+     */
+    writeCollection: function(name, records, extra = null, seq = null) {
+        return this.openDb().then(db => {
+            if (!db) {
+                this.set(this.keys[name], { records, extra });
+                return;
+            }
+            
+            return this.runTransaction(db, [name, 'meta'], 'readwrite', transaction => {
+                const store = transaction.objectStore(name);
+                const incoming = new Map(records.map(record => [record.id, record]));
+                
+                store.openCursor().onsuccess = event => {
+                    const cursor = event.target.result;
+                    if (cursor) {
+                        const record = incoming.get(cursor.key);
+                        if (!record) {
+                            cursor.delete();
+                        } else if (!AppStorage.sameRecord(record, cursor.value)) {
+                            cursor.update(record);
+                        }
+                        incoming.delete(cursor.key);
+                        cursor.continue();
+                    } else {
+                        // What is left is new
+                        incoming.forEach(record => store.put(record));
+                    }
+                };
+                
+                transaction.objectStore('meta').put({ name, timestamp: new Date().getTime(), extra, seq });
+            });
+        }).catch(error => {
+            console.error(`Error caching ${name}:`, error);
+        });
+    },
+    
+    /**
+     * Apply server deltas to a cached collection
+     * @param {string} name - Collection name
+     * @param {Array} records - Records to insert or replace
+     * @param {Array} deletedIds - Ids of records to remove
+     * @param {number|null} seq - Change-feed position reached; when given the
+     *   collection counts as freshly loaded
+     * @returns {Promise}
+     */
+    upsertRecords: function(name, records, deletedIds = [], seq = null) {
+        return this.openDb().then(db => {
+            if (!db) {
+                const cached = this.get(this.keys[name], Infinity);
+                if (!cached) return;
+                const changed = new Set(records.map(record => record.id).concat(deletedIds));
+                cached.records = cached.records
+                    .filter(record => !changed.has(record.id))
+                    .concat(records)
+                    .sort(this.collections[name].compare);
+                this.set(this.keys[name], cached);
+                return;
+            }
+            
+            return this.runTransaction(db, [name, 'meta'], 'readwrite', transaction => {
+                const store = transaction.objectStore(name);
+                records.forEach(record => store.put(record));
+                deletedIds.forEach(id => store.delete(id));
+                
+                if (seq === null) return;
+                const metaStore = transaction.objectStore('meta');
+                metaStore.get(name).onsuccess = event => {
+                    const meta = event.target.result;
+                    if (meta) {
+                        metaStore.put(Object.assign(meta, { timestamp: new Date().getTime(), seq }));
+                    }
+                };
+            });
+        }).catch(error => {
+            console.error(`Error updating cached ${name}:`, error);
+        });
+    },
+    
+    /**
+     * Mark a cached collection as expired; its records and change-feed
+     * position are kept so the next refresh only fetches what changed
+     * @param {string} name - Collection name
+     */
+    expireCollection: function(name) {
+        localStorage.removeItem(this.keys[name]);
+        
+        this.openDb().then(db => {
+            if (!db) return;
+            return this.runTransaction(db, ['meta'], 'readwrite', transaction => {
+                const metaStore = transaction.objectStore('meta');
+                metaStore.get(name).onsuccess = event => {
+                    const meta = event.target.result;
+                    if (meta) {
+                        metaStore.put(Object.assign(meta, { timestamp: 0 }));
+                    }
+                };
+            });
+        }).catch(error => {
+            console.error(`Error expiring cached ${name}:`, error);
+        });
+    },
+    
+    /**
+     * Expand a columnar API payload ({columns, rows}, requested with
+     * ?format=columnar) back into one object per row. Anything else is
+     * returned unchanged.
+     * @param {*} data - Parsed API response
+     * @returns {*}
+     */
+    fromColumnar: function(data) {
+        if (!data || !Array.isArray(data.columns) || !Array.isArray(data.rows)) {
+            return data;
+        }
+        
+        const columns = data.columns;
+        return data.rows.map(row => {
+            const record = {};
+            for (let i = 0; i < columns.length; i++) {
+                record[columns[i]] = row[i];
+            }
+            return record;
+        });
+    },
+    
+    /**
+     * Change-feed position of an API snapshot
+     * @param {Response} response - Response of a collection GET
+     * @returns {number|null}
+     */
+    syncSeq: function(response) {
+        const seq = parseInt(response.headers.get('X-Sync-Seq'));
+        return isNaN(seq) ? null : seq;
+    },
+    
+    /**
+     * Bring a cached collection up to date with only the rows changed on
+     * the server since it was last loaded (GET /api/sync)
+     * @param {string} name - Collection name
+     * @returns {Promise<Array|null>} - Up-to-date records, or null when a
+     *   full load is needed (nothing cached yet, no cursor, or offline)
+     */
+    syncCollection: function(name) {
+        return this.openDb().then(db => {
+            if (!db) return null;
+            
+            return this.runTransaction(db, ['meta'], 'readonly', (transaction, result) => {
+                transaction.objectStore('meta').get(name).onsuccess = event => {
+                    result.value = event.target.result;
+                };
+            }).then(meta => {
+                if (!meta || meta.seq === null || meta.seq === undefined) return null;
+                
+                return fetch(`/api/sync?since=${meta.seq}&tables=${name}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        if (data.reset || !data.changes || !data.changes[name]) return null;
+                        
+                        const changes = data.changes[name];
+                        return this.upsertRecords(name, changes.upserted, changes.deleted, data.seq)
+                            .then(() => this.readCollection(name))
+                            .then(collection => collection && collection.records);
+                    });
+            });
+        }).catch(error => {
+            console.error(`Error syncing ${name}:`, error);
+            return null;
+        });
+    },
+    
+    /**
+     * Remove every cached collection
+     */
+    clearCollections: function() {
+        this.openDb().then(db => {
+            if (!db) return;
+            const names = Object.keys(this.collections);
+            return this.runTransaction(db, names.concat('meta'), 'readwrite', transaction => {
+                names.concat('meta').forEach(name => transaction.objectStore(name).clear());
+            });
+        }).catch(error => {
+            console.error('Error clearing cached collections:', error);
+        });
     },
     
     // Expenses specific methods
@@ -103,26 +582,92 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         get: function(callback, forceRefresh = false) {
-            const expenses = !forceRefresh ? AppStorage.get(AppStorage.keys.expenses, AppStorage.cacheExpiry.expenses) : null;
+            const url = '/api/expenses?format=columnar';
+            let cached = Promise.resolve(null);
             
-            if (expenses && !forceRefresh) {
-                callback(expenses);
-                return;
+            // Fresh cache first, then only the changes since the last load
+            // (unless the page came with the data)
+            if (!AppStorage.hasBootstrap(url)) {
+                cached = (!forceRefresh ? AppStorage.readCollection('expenses') : Promise.resolve(null))
+                    .then(expenses => expenses ? expenses.records : AppStorage.syncCollection('expenses'));
             }
             
-            // Fetch from API if not in cache or forced refresh
-            fetch('/api/expenses')
+            cached
+                .then(expenses => {
+                    if (expenses) {
+                        callback(expenses);
+                        return;
+                    }
+                
+                    // Full load when nothing is cached yet (or offline)
+                    AppStorage.request(url, AppStorage.fetchOptions(forceRefresh))
+                        .then(response => response.json().then(AppStorage.fromColumnar).then(data => {
+                            AppStorage.writeCollection('expenses', data, null, AppStorage.syncSeq(response));
+                            callback(data);
+                        }))
+                        .catch(error => {
+                            console.error('Error fetching expenses:', error);
+                            callback([]);
+                        });
+                });
+        },
+
+        /**
+         * Get one page of expenses (newest first) from the API, or from the
+         * local store when useCache is set and expenses were cached before
+         * @param {number} offset - Index of the first expense
+         * @param {number} limit - Maximum number of expenses
+         * @param {Function} callback - Called with (expenses, total)
+         * @param {boolean} useCache - Read the page from the local store if possible
+         */
+        getPage: function(offset, limit, callback, useCache = false) {
+            const url = `/api/expenses?offset=${offset}&limit=${limit}&format=columnar`;
+            const cached = useCache && !AppStorage.hasBootstrap(url) ?
+                AppStorage.readPage('expenses', 'date', offset, limit) : Promise.resolve(null);
+            
+            cached.then(page => {
+                if (page) {
+                    callback(page.records, page.total);
+                    return;
+                }
+                
+                AppStorage.expenses.fetchPage(offset, limit, callback);
+            });
+        },
+        
+        /**
+         * Fetch one page of expenses (newest first) from the API
+         * @param {number} offset - Index of the first expense
+         * @param {number} limit - Maximum number of expenses
+         * @param {Function} callback - Called with (expenses, total)
+         */
+        fetchPage: function(offset, limit, callback) {
+            AppStorage.request(`/api/expenses?offset=${offset}&limit=${limit}&format=columnar`, AppStorage.fetchOptions(true))
+                .then(response => response.json().then(AppStorage.fromColumnar).then(data => {
+                    const total = parseInt(response.headers.get('X-Total-Count'));
+                    callback(data, isNaN(total) ? offset + data.length : total);
+                }))
+                .catch(error => {
+                    console.error('Error fetching expenses page:', error);
+                    callback([], 0);
+                });
+        },
+
+        /**
+         * Get expense totals per currency and category, over every expense
+         * @param {Function} callback - Called with [{ currency, category, amount, count }]
+         * @param {boolean} forceRefresh - Force API refresh
+         */
+        getSummary: function(callback, forceRefresh = false) {
+            AppStorage.request('/api/expenses/summary', AppStorage.fetchOptions(forceRefresh))
                 .then(response => response.json())
-                .then(data => {
-                    AppStorage.set(AppStorage.keys.expenses, data);
-                    callback(data);
-                })
+                .then(callback)
                 .catch(error => {
-                    console.error('Error fetching expenses:', error);
-                    callback([]);
+                    console.error('Error fetching expense summary:', error);
+                    callback(null);
                 });
         },
-        
+
         /**
          * Add a new expense and update cache
          * @param {Object} expense - Expense data
@@ -165,9 +710,14 @@ const AppStorage = {
             })
             .then(response => response.json())
             .then(data => {
-                if (data.status === 'success') {
-                    // Force refresh expenses data
+                if (data.queued) {
+                    // Saved offline, the cache is refreshed once it syncs
                     this.get(callback, true);
+                } else if (data.status === 'success') {
+                    // Deleting an expense does not change the others, so
+                    // drop it from the store instead of refetching them all
+                    AppStorage.upsertRecords('expenses', [], [id])
+                        .then(() => this.get(callback));
                     
                     // Also invalidate budget allocations
                     AppStorage.remove(AppStorage.keys.budgetAllocations);
@@ -185,7 +735,7 @@ const AppStorage = {
          * Invalidate expenses cache
          */
         invalidateCache: function() {
-            AppStorage.remove(AppStorage.keys.expenses);
+            AppStorage.expireCollection('expenses');
         }
     },
     
@@ -209,11 +759,14 @@ const AppStorage = {
             // Fetch from API if not in cache or forced refresh
             const url = type === 'blue' ? '/api/exchange-rate/blue' : '/api/exchange-rate/tarjeta';
             
-            fetch(url)
+            AppStorage.request(url, AppStorage.fetchOptions(forceRefresh))
                 .then(response => response.json())
                 .then(data => {
                     if (!data.error) {
-                        AppStorage.set(key, data);
+                        // Stale quotes (upstream down) are shown but not cached
+                        if (!data.stale) {
+                            AppStorage.set(key, data);
+                        }
                         callback(data);
                     } else {
                         callback(null);
@@ -225,6 +778,58 @@ const AppStorage = {
                 });
         },
         
+        /**
+         * Get several exchange rates with a single request
+         * @param {Array} types - Rate types ('blue', 'tarjeta', 'cripto')
+         * @param {Function} callback - Callback with an object keyed by type
+         * @param {boolean} forceRefresh - Force API refresh
+         */
+        getAll: function(types, callback, forceRefresh = false) {
+            const keys = {
+                blue: AppStorage.keys.rateBlue,
+                tarjeta: AppStorage.keys.rateTarjeta,
+                cripto: AppStorage.keys.rateCripto
+            };
+            const rates = {};
+            const missing = [];
+            const fresh = forceRefresh || AppStorage.hasBootstrap('/api/exchange-rates?types=' + types.join(','));
+            
+            types.forEach(type => {
+                const rate = !fresh ? AppStorage.get(keys[type], AppStorage.cacheExpiry.rates) : null;
+                if (rate) {
+                    rates[type] = rate;
+                } else {
+                    missing.push(type);
+                }
+            });
+            
+            if (missing.length === 0) {
+                callback(rates);
+                return;
+            }
+            
+            // The server fetches all missing types concurrently
+            AppStorage.request('/api/exchange-rates?types=' + missing.join(','), AppStorage.fetchOptions(forceRefresh))
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.error) {
+                        missing.forEach(type => {
+                            if (!data[type]) return;
+                            // Stale quotes (upstream down) are shown but not cached
+                            if (!data[type].stale) {
+                                AppStorage.set(keys[type], data[type]);
+                            }
+                            rates[type] = data[type];
+                        });
+                    }
+                    callback(rates);
+                })
+                .catch(error => {
+                    console.error('Error fetching exchange rates:', error);
+                    callback(rates);
+                });
+        },
+        
         /**
          * Set active rate type
          * @param {string} type - Rate type ('blue' or 'tarjeta')
@@ -250,7 +855,8 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         get: function(callback, forceRefresh = false) {
-            const salary = !forceRefresh ? AppStorage.get(AppStorage.keys.salary, AppStorage.cacheExpiry.salary) : null;
+            const salary = !forceRefresh && !AppStorage.hasBootstrap('/api/salary') ?
+                AppStorage.get(AppStorage.keys.salary, AppStorage.cacheExpiry.salary) : null;
             
             if (salary !== null && !forceRefresh) {
                 callback(salary);
@@ -258,7 +864,7 @@ const AppStorage = {
             }
             
             // Fetch from API
-            fetch('/api/salary')
+            AppStorage.request('/api/salary', AppStorage.fetchOptions(forceRefresh))
                 .then(response => response.json())
                 .then(data => {
                     AppStorage.set(AppStorage.keys.salary, data.salary);
@@ -311,7 +917,7 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         getAllocations: function(callback, forceRefresh = false) {
-            const allocations = !forceRefresh ? 
+            const allocations = !forceRefresh && !AppStorage.hasBootstrap('/api/budget-allocations') ? 
                 AppStorage.get(AppStorage.keys.budgetAllocations, AppStorage.cacheExpiry.expenses) : null;
             
             if (allocations && !forceRefresh) {
@@ -320,7 +926,7 @@ const AppStorage = {
             }
             
             // Fetch from API
-            fetch('/api/budget-allocations')
+            AppStorage.request('/api/budget-allocations', AppStorage.fetchOptions(forceRefresh))
                 .then(response => response.json())
                 .then(data => {
                     AppStorage.set(AppStorage.keys.budgetAllocations, data);
@@ -348,23 +954,33 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         get: function(callback, forceRefresh = false) {
-            const todos = !forceRefresh ? AppStorage.get(AppStorage.keys.todos, AppStorage.cacheExpiry.todos) : null;
+            const url = '/api/todos?format=columnar';
+            let cached = Promise.resolve(null);
             
-            if (todos && !forceRefresh) {
-                callback(todos);
-                return;
+            // Fresh cache first, then only the changes since the last load
+            // (unless the page came with the data)
+            if (!AppStorage.hasBootstrap(url)) {
+                cached = (!forceRefresh ? AppStorage.readCollection('todos') : Promise.resolve(null))
+                    .then(todos => todos ? todos.records : AppStorage.syncCollection('todos'));
             }
             
-            // Fetch from API
-            fetch('/api/todos')
-                .then(response => response.json())
-                .then(data => {
-                    AppStorage.set(AppStorage.keys.todos, data);
-                    callback(data);
-                })
-                .catch(error => {
-                    console.error('Error fetching todos:', error);
-                    callback([]);
+            cached
+                .then(todos => {
+                    if (todos) {
+                        callback(todos);
+                        return;
+                    }
+                
+                    // Fetch from API
+                    AppStorage.request(url, AppStorage.fetchOptions(forceRefresh))
+                        .then(response => response.json().then(AppStorage.fromColumnar).then(data => {
+                            AppStorage.writeCollection('todos', data, null, AppStorage.syncSeq(response));
+                            callback(data);
+                        }))
+                        .catch(error => {
+                            console.error('Error fetching todos:', error);
+                            callback([]);
+                        });
                 });
         },
         
@@ -491,7 +1107,8 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         getWeeklyStats: function(callback, forceRefresh = false) {
-            const stats = !forceRefresh ? AppStorage.get(AppStorage.keys.weeklyStats, AppStorage.cacheExpiry.stats) : null;
+            const stats = !forceRefresh && !AppStorage.hasBootstrap('/api/todos/stats/weekly') ?
+                AppStorage.get(AppStorage.keys.weeklyStats, AppStorage.cacheExpiry.stats) : null;
             
             if (stats && !forceRefresh) {
                 callback(stats);
@@ -499,7 +1116,7 @@ const AppStorage = {
             }
             
             // Fetch from API
-            fetch('/api/todos/stats/weekly')
+            AppStorage.request('/api/todos/stats/weekly', AppStorage.fetchOptions(forceRefresh))
                 .then(response => response.json())
                 .then(data => {
                     AppStorage.set(AppStorage.keys.weeklyStats, data);
@@ -520,25 +1137,28 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         get: function(callback, forceRefresh = false) {
-            const investments = !forceRefresh ? 
-                AppStorage.get(AppStorage.keys.investments, AppStorage.cacheExpiry.investments) : null;
-            
-            if (investments && !forceRefresh) {
-                callback(investments);
-                return;
-            }
+            const cached = !forceRefresh ? AppStorage.readCollection('investments') : Promise.resolve(null);
             
-            // Fetch from API
-            fetch('/api/investments')
-                .then(response => response.json())
-                .then(data => {
-                    AppStorage.set(AppStorage.keys.investments, data);
-                    callback(data);
-                })
-                .catch(error => {
-                    console.error('Error fetching investments:', error);
-                    callback(null);
-                });
+            cached.then(investments => {
+                if (investments) {
+                    // Totals are kept next to the records
+                    callback(Object.assign({ investments: investments.records }, investments.extra));
+                    return;
+                }
+                
+                // Fetch from API
+                AppStorage.request('/api/investments', AppStorage.fetchOptions(forceRefresh))
+                    .then(response => response.json())
+                    .then(data => {
+                        const { investments, ...totals } = data;
+                        AppStorage.writeCollection('investments', investments, totals);
+                        callback(data);
+                    })
+                    .catch(error => {
+                        console.error('Error fetching investments:', error);
+                        callback(null);
+                    });
+            });
         },
         
         /**
@@ -626,7 +1246,7 @@ const AppStorage = {
          * Invalidate investments cache
          */
         invalidateCache: function() {
-            AppStorage.remove(AppStorage.keys.investments);
+            AppStorage.expireCollection('investments');
         }
     },
     
@@ -651,7 +1271,7 @@ const AppStorage = {
             }
             
             // Fetch from API or use defaults if API fails
-            fetch('/api/accounts')
+            AppStorage.request('/api/accounts', AppStorage.fetchOptions(forceRefresh))
                 .then(response => response.json())
                 .then(data => {
                     AppStorage.set(AppStorage.keys.accounts, data);
@@ -709,24 +1329,35 @@ const AppStorage = {
          * @param {boolean} forceRefresh - Force API refresh
          */
         get: function(callback, forceRefresh = false) {
-            const transfers = !forceRefresh ? 
-                AppStorage.get(AppStorage.keys.transfers, AppStorage.cacheExpiry.expenses) : null;
+            const url = '/api/transfers?format=columnar';
+            let cached = Promise.resolve(null);
             
-            if (transfers && !forceRefresh) {
-                callback(transfers);
-                return;
+            // Fresh cache first, then only the changes since the last load
+            // (unless the page came with the data)
+            if (!AppStorage.hasBootstrap(url)) {
+                cached = (!forceRefresh ? AppStorage.readCollection('transfers') : Promise.resolve(null))
+                    .then(transfers => transfers ? transfers.records : AppStorage.syncCollection('transfers'));
             }
             
-            // Fetch from API
-            fetch('/api/transfers')
-                .then(response => response.json())
-                .then(data => {
-                    AppStorage.set(AppStorage.keys.transfers, data);
-                    callback(data);
-                })
-                .catch(error => {
-                    console.error('Error fetching transfers:', error);
-                    callback([]);
+            cached
+                .then(transfers => {
+                    if (transfers) {
+                        callback(transfers);
+                        return;
+                    }
+                
+                    // Fetch from API
+                    AppStorage.request(url, AppStorage.fetchOptions(forceRefresh))
+                        .then(response => response.json().then(AppStorage.fromColumnar).then(data => {
+                            if (Array.isArray(data)) {
+                                AppStorage.writeCollection('transfers', data, null, AppStorage.syncSeq(response));
+                            }
+                            callback(data);
+                        }))
+                        .catch(error => {
+                            console.error('Error fetching transfers:', error);
+                            callback([]);
+                        });
                 });
         },
         
@@ -786,7 +1417,7 @@ const AppStorage = {
          * Invalidate transfers cache
          */
         invalidateCache: function() {
-            AppStorage.remove(AppStorage.keys.transfers);
+            AppStorage.expireCollection('transfers');
         }
     }
 }; 
\ No newline at end of file
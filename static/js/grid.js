@@ -3,6 +3,13 @@ const GRID_ROWS = 30;
 const GRID_COLS = 7;
 const COL_LETTERS = ['A', 'B', 'C', 'D', 'E', 'F', 'G'];
 
+// Grid virtualization
+const GRID_ROW_HEIGHT = 22; // Default row height in px (border included)
+const GRID_HEADER_ROW_HEIGHT = 26; // Height of row 1 (column titles)
+const GRID_ROW_BUFFER = 8; // Rows kept in the DOM above and below the viewport
+const GRID_SPARE_ROWS = 5; // Empty rows below the last expense, for formulas
+const GRID_PAGE_SIZE = 100; // Expenses per /api/expenses page
+
 // Default column widths - percentages of total width
 const DEFAULT_COLUMN_WIDTHS = {
     'A': '12%',   // Date
@@ -15,13 +22,23 @@ const DEFAULT_COLUMN_WIDTHS = {
 };
 
 // Global variables
-let selectedCell = null;
+let selectedCellId = null;
+let editingInput = null; // Input of the cell being edited, if any
 let exchangeRate = 0;
 let exchangeRateTarjeta = 0;
 let monthlySalary = 0;
 let gridData = {}; // Will store cell data
 let expenses = []; // Will store expense objects
 let cellFormulas = {}; // Will store formulas for cells
+let cellStyles = {}; // Formatting classes (bold/italic) per cell
+let expenseTotal = 0; // Number of expenses on the server
+let expensesComplete = true; // False while only some pages are loaded
+let expenseSummary = []; // Totals per currency and category, over all expenses
+let expensePageLoading = false;
+let gridRowPool = []; // Recycled row elements: { row, header, cells, rowNum }
+let gridFirstRow = 1; // Row number bound to the first pooled row
+let gridRowCount = GRID_ROWS;
+let lastTap = { cellId: null, time: 0 };
 let columnWidths = {}; // Store custom column widths
 let rowHeights = {}; // Store custom row heights
 let selectedDolarType = 'blue'; // Default dollar type (blue or tarjeta)
@@ -40,57 +57,91 @@ let accountBalances = {
     ars: 0
 };
 
+// Render scheduler
+// Components are marked dirty and redrawn together in the next animation
+// frame, so a burst of updates (an edit, then totals, then the budget table
+// and chart) costs one layout pass instead of one per step.
+const renderState = {
+    dirty: new Set(),
+    gridRebind: false, // re-bind all visible rows, not just gridCells
+    gridCells: new Set(), // individual cells whose value changed
+    budgetData: null // latest budget allocations to display
+};
+let renderFrame = null;
+
+function scheduleRender(component) {
+    renderState.dirty.add(component);
+    if (renderFrame === null) {
+        renderFrame = requestAnimationFrame(flushRender);
+    }
+}
+
+// Draw every dirty component, in dependency order: the budget chart
+// cross-checks the totals, so totals are written first
+function flushRender() {
+    renderFrame = null;
+    const dirty = renderState.dirty;
+    renderState.dirty = new Set();
+    
+    if (dirty.has('grid')) {
+        const rebind = renderState.gridRebind;
+        const cells = renderState.gridCells;
+        renderState.gridRebind = false;
+        renderState.gridCells = new Set();
+        
+        renderGrid(rebind);
+        if (!rebind) {
+            cells.forEach(bindVisibleCell);
+        }
+    }
+    
+    if (dirty.has('totals')) {
+        renderTotals();
+    }
+    
+    if (dirty.has('budget') && renderState.budgetData) {
+        renderBudgetAllocations(renderState.budgetData);
+        updateBudgetChart(renderState.budgetData);
+        checkBudgetWarnings(renderState.budgetData);
+    }
+}
+
+// Set text only when it differs, so unchanged values cause no layout work
+function setText(element, text) {
+    if (element && element.textContent !== text) {
+        element.textContent = text;
+    }
+}
+
 // Initialize the grid
+// Only the rows in view (plus GRID_ROW_BUFFER above and below) exist in the
+// DOM. Their elements form a pool that is re-bound to other row numbers while
+// scrolling; gridData stays the source of truth for every cell's contents.
 function initGrid() {
     const grid = document.getElementById('expense-grid');
+    const rowHeaders = document.querySelector('.row-headers');
+    const scroller = document.querySelector('.grid-with-row-headers');
     
     // Clear existing content
     grid.innerHTML = '';
+    rowHeaders.innerHTML = '';
+    gridRowPool = [];
+    gridFirstRow = 1;
     
-    // Create cells
-    for (let r = 0; r < GRID_ROWS; r++) {
-        const row = document.createElement('div');
-        row.className = 'grid-row';
-        row.style.width = '100%';
-        row.style.display = 'flex';
-        
-        // Apply custom row height if exists
-        if (rowHeights[r + 1]) {
-            row.style.height = rowHeights[r + 1] + 'px';
-        }
-        
-        for (let c = 0; c < GRID_COLS; c++) {
-            const colLetter = COL_LETTERS[c];
-            const cellId = `${colLetter}${r + 1}`;
-            const cell = document.createElement('div');
-            cell.className = 'grid-cell';
-            cell.id = cellId;
-            cell.dataset.row = r + 1;
-            cell.dataset.col = colLetter;
-            cell.textContent = gridData[cellId] || '';
-            
-            // Apply width as percentage to make cells stretch
-            cell.style.width = DEFAULT_COLUMN_WIDTHS[colLetter];
-            cell.style.minWidth = "0"; // Allow shrinking if needed
-            cell.style.flex = "1 1 " + DEFAULT_COLUMN_WIDTHS[colLetter];
-            
-            // Add event listeners for mouse
-            cell.addEventListener('click', () => selectCell(cell));
-            cell.addEventListener('dblclick', () => editCell(cell));
-            
-            // Add touch event listeners
-            cell.addEventListener('touchstart', (e) => handleTouchStart(e, cell));
-            cell.addEventListener('touchend', (e) => handleTouchEnd(e, cell));
-            
-            row.appendChild(cell);
-        }
-        
-        grid.appendChild(row);
-    }
+    // One delegated listener per event type for the whole grid
+    grid.addEventListener('click', handleGridEvent);
+    grid.addEventListener('dblclick', handleGridEvent);
+    grid.addEventListener('touchstart', handleGridEvent, { passive: true });
+    grid.addEventListener('touchend', handleGridEvent);
+    
+    scroller.addEventListener('scroll', scheduleGridRender, { passive: true });
+    window.addEventListener('resize', scheduleGridRender);
     
     // Initialize fixed header row for expenses table
     setupExpenseHeaders();
     
+    renderGrid();
+    
     // Setup resizing for columns and rows
     setupResizeHandlers();
     
@@ -106,6 +157,266 @@ function initGrid() {
     }
 }
 
+// Height of a grid row in px
+function rowHeight(rowNum) {
+    return rowHeights[rowNum] || (rowNum === 1 ? GRID_HEADER_ROW_HEIGHT : GRID_ROW_HEIGHT);
+}
+
+// Distance from the top of the grid to the top of a row
+function rowOffset(rowNum) {
+    let offset = (rowNum - 1) * GRID_ROW_HEIGHT;
+    
+    if (rowNum > 1) {
+        offset += rowHeight(1) - GRID_ROW_HEIGHT;
+    }
+    for (const r in rowHeights) {
+        if (r > 1 && r < rowNum) {
+            offset += rowHeights[r] - GRID_ROW_HEIGHT;
+        }
+    }
+    return offset;
+}
+
+// Row at a vertical offset (binary search over rowOffset)
+function rowAtOffset(offset) {
+    let low = 1;
+    let high = gridRowCount;
+    
+    while (low < high) {
+        const mid = Math.ceil((low + high) / 2);
+        if (rowOffset(mid) <= offset) {
+            low = mid;
+        } else {
+            high = mid - 1;
+        }
+    }
+    return low;
+}
+
+// Create one pooled row: the grid row, its row header and its cells
+function createGridRow() {
+    const row = document.createElement('div');
+    row.className = 'grid-row';
+    row.style.width = '100%';
+    row.style.display = 'flex';
+    
+    const header = document.createElement('div');
+    header.className = 'row-header';
+    
+    const cells = COL_LETTERS.map(colLetter => {
+        const cell = document.createElement('div');
+        cell.className = 'grid-cell';
+        cell.dataset.col = colLetter;
+        
+        // Apply width as percentage to make cells stretch
+        cell.style.width = columnWidths[colLetter] ? columnWidths[colLetter] + 'px' : DEFAULT_COLUMN_WIDTHS[colLetter];
+        cell.style.minWidth = "0"; // Allow shrinking if needed
+        cell.style.flex = "1 1 " + DEFAULT_COLUMN_WIDTHS[colLetter];
+        
+        row.appendChild(cell);
+        return cell;
+    });
+    
+    return { row, header, cells, rowNum: 0 };
+}
+
+// Point a pooled row at another row number
+function bindGridRow(entry, rowNum) {
+    const height = rowHeight(rowNum) + 'px';
+    
+    entry.rowNum = rowNum;
+    entry.row.style.height = height;
+    entry.header.style.height = height;
+    entry.header.style.minHeight = height;
+    entry.header.dataset.row = rowNum;
+    entry.header.textContent = rowNum;
+    
+    entry.cells.forEach(cell => bindGridCell(cell, `${cell.dataset.col}${rowNum}`, rowNum));
+}
+
+// Show a cell's value from gridData, touching the DOM only if it changed
+function bindGridCell(cell, cellId, rowNum) {
+    const value = gridData[cellId];
+    const text = value === undefined || value === null ? '' : String(value);
+    const expense = cell.dataset.col === 'G' && rowNum > 1 ? expenses[rowNum - 2] : null;
+    const renderKey = expense && text ? `${expense.id}|${text}` : text;
+    
+    cell.id = cellId;
+    cell.dataset.row = rowNum;
+    
+    if (cell.renderKey !== renderKey) {
+        cell.renderKey = renderKey;
+        
+        if (expense && text) {
+            // Delete link, handled by the delegated grid listener
+            const deleteLink = document.createElement('a');
+            deleteLink.href = '#';
+            deleteLink.dataset.expenseId = expense.id;
+            deleteLink.textContent = text;
+            cell.replaceChildren(deleteLink);
+        } else {
+            cell.textContent = text;
+        }
+    }
+    
+    const styles = cellStyles[cellId] || {};
+    cell.classList.toggle('selected', cellId === selectedCellId);
+    cell.classList.toggle('bold', !!styles.bold);
+    cell.classList.toggle('italic', !!styles.italic);
+}
+
+// Queue a single cell for re-rendering in the next frame
+function refreshGridCell(cellId) {
+    renderState.gridCells.add(cellId);
+    scheduleRender('grid');
+}
+
+// Re-render a single cell now, if it is currently in the DOM
+function bindVisibleCell(cellId) {
+    const cell = document.getElementById(cellId);
+    if (cell && cell.classList.contains('grid-cell')) {
+        bindGridCell(cell, cellId, parseInt(cell.dataset.row));
+    }
+}
+
+// Re-position the rows in the next frame (scroll and resize)
+function scheduleGridRender() {
+    scheduleRender('grid');
+}
+
+// Re-bind every visible row from gridData in the next frame
+function invalidateGrid() {
+    renderState.gridRebind = true;
+    scheduleRender('grid');
+}
+
+// Bind the row pool to the rows around the current scroll position.
+// With rebindAll every visible row is refreshed from gridData.
+function renderGrid(rebindAll = false) {
+    const grid = document.getElementById('expense-grid');
+    const rowHeaders = document.querySelector('.row-headers');
+    const scroller = document.querySelector('.grid-with-row-headers');
+    if (!grid || !rowHeaders || !scroller) return;
+    
+    gridRowCount = Math.max(GRID_ROWS, Math.max(expenses.length, expenseTotal) + 1 + GRID_SPARE_ROWS);
+    
+    const viewport = scroller.clientHeight || GRID_ROWS * GRID_ROW_HEIGHT;
+    const poolSize = Math.min(gridRowCount, Math.ceil(viewport / GRID_ROW_HEIGHT) + 2 * GRID_ROW_BUFFER);
+    
+    while (gridRowPool.length < poolSize) {
+        const entry = createGridRow();
+        gridRowPool.push(entry);
+        grid.appendChild(entry.row);
+        rowHeaders.appendChild(entry.header);
+    }
+    while (gridRowPool.length > poolSize) {
+        const entry = gridRowPool.pop();
+        entry.row.remove();
+        entry.header.remove();
+    }
+    
+    const first = Math.max(1, Math.min(
+        rowAtOffset(scroller.scrollTop) - GRID_ROW_BUFFER,
+        gridRowCount - poolSize + 1
+    ));
+    
+    // Commit an edit before its cell is recycled for another row
+    if (editingInput) {
+        const editingRow = splitCellId(editingInput.dataset.cellId).row;
+        if (editingRow < first || editingRow >= first + poolSize) {
+            editingInput.blur();
+        }
+    }
+    
+    // Move the rows that scrolled out on one side to the other side, so
+    // only those need re-binding
+    const shift = first - gridFirstRow;
+    if (shift > 0 && shift < poolSize) {
+        const moved = gridRowPool.splice(0, shift);
+        moved.forEach(entry => {
+            grid.appendChild(entry.row);
+            rowHeaders.appendChild(entry.header);
+        });
+        gridRowPool = gridRowPool.concat(moved);
+    } else if (shift < 0 && -shift < poolSize) {
+        const moved = gridRowPool.splice(gridRowPool.length + shift);
+        for (let i = moved.length - 1; i >= 0; i--) {
+            grid.insertBefore(moved[i].row, grid.firstChild);
+            rowHeaders.insertBefore(moved[i].header, rowHeaders.firstChild);
+        }
+        gridRowPool = moved.concat(gridRowPool);
+    }
+    gridFirstRow = first;
+    
+    gridRowPool.forEach((entry, i) => {
+        if (rebindAll || entry.rowNum !== first + i) {
+            bindGridRow(entry, first + i);
+        }
+    });
+    
+    // Padding stands in for the rows that are not rendered
+    const top = rowOffset(first) + 'px';
+    const bottom = (rowOffset(gridRowCount + 1) - rowOffset(first + gridRowPool.length)) + 'px';
+    [grid, rowHeaders].forEach(element => {
+        element.style.paddingTop = top;
+        element.style.paddingBottom = bottom;
+    });
+    
+    loadMoreExpenses(first + gridRowPool.length);
+}
+
+// While only the first pages are loaded, fetch the next one once the
+// viewport gets close to the last loaded row
+function loadMoreExpenses(lastVisibleRow) {
+    if (expensesComplete || expensePageLoading || expenses.length >= expenseTotal) return;
+    if (lastVisibleRow < expenses.length + 1) return;
+    
+    expensePageLoading = true;
+    AppStorage.expenses.getPage(expenses.length, GRID_PAGE_SIZE, function(page, total) {
+        expensePageLoading = false;
+        
+        // The full list may have arrived in the meantime
+        if (expensesComplete) return;
+        
+        const start = expenses.length;
+        expenses = expenses.concat(page);
+        expenseTotal = total;
+        page.forEach((expense, i) => fillExpenseRow(start + i + 2, expense));
+        invalidateGrid();
+        
+        // The new rows may fall inside formula ranges: drop their prefix
+        // sums and re-evaluate the formulas that read them
+        const changedCells = [];
+        page.forEach((expense, i) => {
+            COL_LETTERS.forEach(col => changedCells.push(`${col}${start + i + 2}`));
+        });
+        recalculateFormulas(changedCells);
+    });
+}
+
+// Single handler for clicks and taps anywhere in the grid
+function handleGridEvent(e) {
+    const deleteLink = e.target.closest('a[data-expense-id]');
+    if (deleteLink && e.type === 'click') {
+        e.preventDefault();
+        deleteExpense(parseInt(deleteLink.dataset.expenseId));
+        return;
+    }
+    
+    const cell = e.target.closest('.grid-cell');
+    if (!cell || e.target.tagName === 'INPUT') return;
+    
+    if (e.type === 'click') {
+        selectCell(cell);
+    } else if (e.type === 'dblclick') {
+        editCell(cell);
+    } else if (e.type === 'touchstart') {
+        handleTouchStart(e, cell);
+    } else if (e.type === 'touchend') {
+        handleTouchEnd(e, cell);
+    }
+}
+
 // Fix column headers display
 function fixColumnHeadersDisplay() {
     const columnHeaders = document.querySelectorAll('.column-header');
@@ -182,10 +493,9 @@ function handleTouchEnd(e, cell) {
     
     // If the user hasn't moved their finger much (not scrolling)
     if (deltaX < 10 && deltaY < 10) {
-        // Double tap detection
+        // Double tap detection (tracked by cell id, since elements are recycled)
         const now = new Date().getTime();
-        const lastTap = cell.lastTap || 0;
-        const timeDiff = now - lastTap;
+        const timeDiff = lastTap.cellId === cell.id ? now - lastTap.time : 0;
         
         if (timeDiff < 300 && timeDiff > 0) {
             // Double tap detected
@@ -193,7 +503,7 @@ function handleTouchEnd(e, cell) {
             e.preventDefault(); // Prevent zoom
         }
         
-        cell.lastTap = now;
+        lastTap = { cellId: cell.id, time: now };
     }
     
     isTouching = false;
@@ -211,38 +521,11 @@ function setupExpenseHeaders() {
         { cell: 'G1', value: 'Account', style: 'bold' }
     ];
     
-    // First, style all row 1 cells with proper background
-    for (let c = 0; c < GRID_COLS; c++) {
-        const colLetter = COL_LETTERS[c];
-        const cellId = `${colLetter}1`;
-        const cell = document.getElementById(cellId);
-        
-        if (cell) {
-            cell.style.backgroundColor = '#c0c0c0';
-            cell.style.color = '#000000';
-            cell.style.fontWeight = 'bold';
-            cell.style.borderBottom = '1px solid #000000';
-            cell.style.borderRight = '1px solid #000000';
-            cell.style.height = '25px';
-            cell.style.display = 'flex';
-            cell.style.alignItems = 'center';
-            cell.style.justifyContent = 'center';
-            
-            // Apply the specific width from DEFAULT_COLUMN_WIDTHS
-            cell.style.width = DEFAULT_COLUMN_WIDTHS[colLetter];
-            cell.style.minWidth = "0";
-            cell.style.flex = "1 1 " + DEFAULT_COLUMN_WIDTHS[colLetter];
-        }
-    }
-    
-    // Apply header values
+    // Row 1 is styled by the .grid-cell[data-row="1"] rule
     headers.forEach(header => {
-        const cell = document.getElementById(header.cell);
-        if (cell) {
-            cell.textContent = header.value;
-            cell.classList.add(header.style);
-            gridData[header.cell] = header.value;
-        }
+        gridData[header.cell] = header.value;
+        cellStyles[header.cell] = { [header.style]: true };
+        refreshGridCell(header.cell);
     });
 }
 
@@ -287,37 +570,32 @@ function setupResizeHandlers() {
         });
     });
     
-    // Row resize
-    const rowHeaders = document.querySelectorAll('.row-header');
+    // Row resize (delegated: row headers are recycled with the grid rows)
+    const rowHeadersContainer = document.querySelector('.row-headers');
     
-    rowHeaders.forEach((header, index) => {
-        const rowNum = index + 1;
+    rowHeadersContainer.addEventListener('mousedown', (e) => {
+        const header = e.target.closest('.row-header');
+        if (!header) return;
         
-        // Apply any existing custom height
-        if (rowHeights[rowNum]) {
-            header.style.height = rowHeights[rowNum] + 'px';
+        // Check if we clicked on the resize handle (bottom 4px of row header)
+        const rect = header.getBoundingClientRect();
+        if (e.clientY > rect.bottom - 4) {
+            startRowResize(parseInt(header.dataset.row), e.clientY);
         }
+    });
+    
+    rowHeadersContainer.addEventListener('touchstart', (e) => {
+        const header = e.target.closest('.row-header');
+        if (!header) return;
         
-        // Mouse events
-        header.addEventListener('mousedown', (e) => {
-            // Check if we clicked on the resize handle (bottom 4px of row header)
-            const rect = header.getBoundingClientRect();
-            if (e.clientY > rect.bottom - 4) {
-                startRowResize(rowNum, e.clientY);
-            }
-        });
+        const rect = header.getBoundingClientRect();
+        const touchY = e.touches[0].clientY;
         
-        // Touch events for row resize
-        header.addEventListener('touchstart', (e) => {
-            const rect = header.getBoundingClientRect();
-            const touchY = e.touches[0].clientY;
-            
-            // If touch is in the resize handle area
-            if (touchY > rect.bottom - 15) {
-                e.preventDefault();
-                startRowResize(rowNum, touchY);
-            }
-        });
+        // If touch is in the resize handle area
+        if (touchY > rect.bottom - 15) {
+            e.preventDefault();
+            startRowResize(parseInt(header.dataset.row), touchY);
+        }
     });
     
     // Update corner cell to match row headers
@@ -417,9 +695,7 @@ function startColumnResize(colLetter, startX) {
 
 // Start row resize operation
 function startRowResize(rowNum, startY) {
-    const rowCells = document.querySelectorAll(`.grid-cell[data-row="${rowNum}"]`);
-    const rowHeader = document.querySelector(`.row-header:nth-child(${rowNum})`);
-    const gridRow = document.querySelector(`.grid-row:nth-child(${rowNum})`);
+    const rowHeader = document.querySelector(`.row-header[data-row="${rowNum}"]`);
     const initialHeight = rowHeader.offsetHeight;
     
     // Create a resize handle indicator
@@ -456,16 +732,9 @@ function startRowResize(rowNum, startY) {
         const deltaY = e.clientY - startY;
         const newHeight = Math.max(18, initialHeight + deltaY);
         
-        // Store the new height
+        // Store the new height and re-layout the rows
         rowHeights[rowNum] = newHeight;
-        
-        // Apply to row header
-        rowHeader.style.height = newHeight + 'px';
-        
-        // Apply to grid row
-        if (gridRow) {
-            gridRow.style.height = newHeight + 'px';
-        }
+        invalidateGrid();
         
         // Remove the resize handle
         document.body.removeChild(resizeHandle);
@@ -482,16 +751,9 @@ function startRowResize(rowNum, startY) {
         const deltaY = touchY - startY;
         const newHeight = Math.max(18, initialHeight + deltaY);
         
-        // Store the new height
+        // Store the new height and re-layout the rows
         rowHeights[rowNum] = newHeight;
-        
-        // Apply to row header
-        rowHeader.style.height = newHeight + 'px';
-        
-        // Apply to grid row
-        if (gridRow) {
-            gridRow.style.height = newHeight + 'px';
-        }
+        invalidateGrid();
         
         // Remove the resize handle
         document.body.removeChild(resizeHandle);
@@ -506,12 +768,13 @@ function startRowResize(rowNum, startY) {
 // Select a cell
 function selectCell(cell) {
     // Deselect previous cell
-    if (selectedCell) {
-        selectedCell.classList.remove('selected');
+    const previous = selectedCellId ? document.getElementById(selectedCellId) : null;
+    if (previous) {
+        previous.classList.remove('selected');
     }
     
     // Select new cell
-    selectedCell = cell;
+    selectedCellId = cell.id;
     cell.classList.add('selected');
 }
 
@@ -523,6 +786,7 @@ function editCell(cell) {
     const input = document.createElement('input');
     input.type = 'text';
     input.value = value;
+    input.dataset.cellId = cellId;
     input.style.width = '100%';
     input.style.height = '100%';
     input.style.border = 'none';
@@ -531,7 +795,9 @@ function editCell(cell) {
     
     // Clear cell content
     cell.textContent = '';
+    cell.renderKey = null;
     cell.appendChild(input);
+    editingInput = input;
     
     // Focus input
     input.focus();
@@ -547,21 +813,21 @@ function editCell(cell) {
 
 // Finish editing a cell
 function finishEdit(cell, input) {
-    const cellId = cell.id;
+    // Enter followed by blur would otherwise finish the same edit twice
+    if (editingInput !== input) return;
+    editingInput = null;
+    
+    // The cell element may have been recycled, so go by the id it was edited under
+    const cellId = input.dataset.cellId;
     const value = input.value;
-    const row = parseInt(cell.dataset.row);
-    const col = cell.dataset.col;
+    const { row, col } = splitCellId(cellId);
     
     // Check if it's a formula
     if (value.startsWith('=')) {
-        cellFormulas[cellId] = value;
-        const calculatedValue = calculateFormula(value);
-        cell.textContent = calculatedValue !== null ? calculatedValue : '#ERROR';
-        gridData[cellId] = value;
+        setCellFormula(cellId, value);
     } else {
-        cell.textContent = value;
-        gridData[cellId] = value;
-        delete cellFormulas[cellId];
+        setCellValue(cellId, value);
+        clearCellFormula(cellId);
         
         // Check if this is an editable expense cell and save changes
         if (row > 1 && row <= expenses.length + 1) {
@@ -628,8 +894,8 @@ function finishEdit(cell, input) {
         }
     }
     
-    // Recalculate formulas in case they depend on this cell
-    recalculateFormulas();
+    // Recalculate the formulas that depend on this cell
+    recalculateFormulas([cellId]);
 }
 
 // Save changes to an expense
@@ -659,99 +925,471 @@ async function saveExpenseChanges(expense) {
     }
 }
 
-// Calculate formula result
-function calculateFormula(formula) {
-    try {
-        // Remove equals sign
-        const expression = formula.substring(1);
-        
-        // Replace cell references with values
-        let calculatedExpression = expression.replace(/[A-G][1-9][0-9]?/g, (match) => {
-            if (gridData[match] !== undefined) {
-                const value = parseFloat(gridData[match]);
-                return isNaN(value) ? 0 : value;
-            }
-            return 0;
-        });
+// Formula engine
+// Each formula is parsed once into an AST when it is entered. The dependency
+// graph below maps every cell to the formulas that read it, so an edit only
+// re-evaluates the formulas downstream of the changed cell, in topological
+// order. Range aggregates (SUM/COUNT/AVERAGE) read per-column prefix sums
+// that are rebuilt lazily from the first changed row.
+let formulaAsts = {};       // cellId -> parsed AST (null if it failed to parse)
+let formulaPrecedents = {}; // cellId -> Set of cells the formula reads
+let formulaDependents = {}; // cellId -> Set of formula cells that read it
+let columnPrefixCache = {}; // column letter -> { sums: [], counts: [] }
+
+// Formulas over whole tables, e.g. =SUM(expenses[month="2026-09"].amount_usd),
+// are evaluated by /api/formula/eval instead of against the rendered cells
+const SERVER_FORMULA_PATTERN = /\b(expenses|investments)\s*[\[.]/i;
+
+// Split "C12" into its column letter and row number
+function splitCellId(cellId) {
+    const match = /^([A-Z]+)(\d+)$/.exec(cellId);
+    return { col: match[1], row: parseInt(match[2]) };
+}
+
+// Numeric value of a cell, treating empty or text cells as 0
+function cellNumber(cellId) {
+    const value = parseFloat(gridData[cellId]);
+    return isNaN(value) ? 0 : value;
+}
+
+// Break a formula (without the leading '=') into tokens
+function tokenizeFormula(expression) {
+    const tokenPattern = /\s*(\d+(?:\.\d+)?|[A-Z]+\d+(?::[A-Z]+\d+)?|[A-Z]+|[-+*/(),])/y;
+    const tokens = [];
+    const text = expression.toUpperCase();
+    let pos = 0;
+    
+    while (pos < text.length && text.slice(pos).trim() !== '') {
+        tokenPattern.lastIndex = pos;
+        const match = tokenPattern.exec(text);
+        if (!match) {
+            throw new Error(`Unexpected character '${text.charAt(pos)}' in formula`);
+        }
+        tokens.push(match[1]);
+        pos = tokenPattern.lastIndex;
+    }
+    
+    return tokens;
+}
+
+// Recursive-descent parser producing an AST:
+// expr := term (('+' | '-') term)*, term := unary (('*' | '/') unary)*
+function parseFormula(expression) {
+    const tokens = tokenizeFormula(expression);
+    let pos = 0;
+    
+    const peek = () => tokens[pos];
+    const next = () => tokens[pos++];
+    const expect = (token) => {
+        if (next() !== token) {
+            throw new Error(`Expected '${token}' in formula`);
+        }
+    };
+    
+    function parseExpression() {
+        let node = parseTerm();
+        while (peek() === '+' || peek() === '-') {
+            node = { type: 'binary', op: next(), left: node, right: parseTerm() };
+        }
+        return node;
+    }
+    
+    function parseTerm() {
+        let node = parseUnary();
+        while (peek() === '*' || peek() === '/') {
+            node = { type: 'binary', op: next(), left: node, right: parseUnary() };
+        }
+        return node;
+    }
+    
+    function parseUnary() {
+        if (peek() === '-' || peek() === '+') {
+            return { type: 'unary', op: next(), arg: parseUnary() };
+        }
+        return parsePrimary();
+    }
+    
+    function parsePrimary() {
+        const token = next();
         
-        // Replace SUM function
-        calculatedExpression = calculatedExpression.replace(/SUM\(([A-G][1-9][0-9]?):([A-G][1-9][0-9]?)\)/g, (match, start, end) => {
-            const startCol = start.charAt(0);
-            const startRow = parseInt(start.substring(1));
-            const endCol = end.charAt(0);
-            const endRow = parseInt(end.substring(1));
-            
-            let sum = 0;
-            
-            const startColIndex = COL_LETTERS.indexOf(startCol);
-            const endColIndex = COL_LETTERS.indexOf(endCol);
-            
-            for (let r = startRow; r <= endRow; r++) {
-                for (let c = startColIndex; c <= endColIndex; c++) {
-                    const cellId = `${COL_LETTERS[c]}${r}`;
-                    if (gridData[cellId] !== undefined) {
-                        const value = parseFloat(gridData[cellId]);
-                        if (!isNaN(value)) {
-                            sum += value;
-                        }
-                    }
+        if (token === undefined) {
+            throw new Error('Unexpected end of formula');
+        }
+        if (token === '(') {
+            const node = parseExpression();
+            expect(')');
+            return node;
+        }
+        if (/^\d/.test(token)) {
+            return { type: 'num', value: parseFloat(token) };
+        }
+        if (/^[A-Z]+\d+:[A-Z]+\d+$/.test(token)) {
+            const [from, to] = token.split(':');
+            return { type: 'range', from, to };
+        }
+        if (/^[A-Z]+\d+$/.test(token)) {
+            return { type: 'ref', cell: token };
+        }
+        if (/^[A-Z]+$/.test(token) && peek() === '(') {
+            next();
+            const args = [];
+            if (peek() !== ')') {
+                args.push(parseExpression());
+                while (peek() === ',') {
+                    next();
+                    args.push(parseExpression());
                 }
             }
-            
-            return sum;
+            expect(')');
+            return { type: 'call', name: token === 'AVG' ? 'AVERAGE' : token, args };
+        }
+        throw new Error(`Unexpected '${token}' in formula`);
+    }
+    
+    const ast = parseExpression();
+    if (pos < tokens.length) {
+        throw new Error(`Unexpected '${tokens[pos]}' in formula`);
+    }
+    return ast;
+}
+
+// Expand a range node into its cell ids
+function rangeCells(range) {
+    const from = splitCellId(range.from);
+    const to = splitCellId(range.to);
+    const startCol = Math.min(COL_LETTERS.indexOf(from.col), COL_LETTERS.indexOf(to.col));
+    const endCol = Math.max(COL_LETTERS.indexOf(from.col), COL_LETTERS.indexOf(to.col));
+    const cells = [];
+    
+    if (startCol < 0) {
+        throw new Error(`Invalid range ${range.from}:${range.to}`);
+    }
+    
+    for (let c = startCol; c <= endCol; c++) {
+        for (let r = Math.min(from.row, to.row); r <= Math.max(from.row, to.row); r++) {
+            cells.push(`${COL_LETTERS[c]}${r}`);
+        }
+    }
+    return cells;
+}
+
+// Collect every cell an AST reads
+function collectPrecedents(node, cells = new Set()) {
+    if (node.type === 'ref') {
+        cells.add(node.cell);
+    } else if (node.type === 'range') {
+        rangeCells(node).forEach(cellId => cells.add(cellId));
+    } else if (node.type === 'unary') {
+        collectPrecedents(node.arg, cells);
+    } else if (node.type === 'binary') {
+        collectPrecedents(node.left, cells);
+        collectPrecedents(node.right, cells);
+    } else if (node.type === 'call') {
+        node.args.forEach(arg => collectPrecedents(arg, cells));
+    }
+    return cells;
+}
+
+// Prefix sum and numeric-cell count of a column through the given row
+function columnPrefix(col, row) {
+    if (!columnPrefixCache[col]) {
+        columnPrefixCache[col] = { sums: [0], counts: [0] };
+    }
+    const cache = columnPrefixCache[col];
+    
+    for (let r = cache.sums.length; r <= row; r++) {
+        const value = parseFloat(gridData[`${col}${r}`]);
+        const isNumber = !isNaN(value);
+        cache.sums.push(cache.sums[r - 1] + (isNumber ? value : 0));
+        cache.counts.push(cache.counts[r - 1] + (isNumber ? 1 : 0));
+    }
+    
+    return { sum: cache.sums[row], count: cache.counts[row] };
+}
+
+// Drop cached prefix sums from a changed cell's row downwards
+function invalidateCellCache(cellId) {
+    const { col, row } = splitCellId(cellId);
+    const cache = columnPrefixCache[col];
+    
+    if (cache && cache.sums.length > row) {
+        cache.sums.length = row;
+        cache.counts.length = row;
+    }
+}
+
+// Sum and count of numeric cells in a range, from the prefix sums
+function rangeAggregate(range) {
+    const from = splitCellId(range.from);
+    const to = splitCellId(range.to);
+    const startRow = Math.min(from.row, to.row);
+    const endRow = Math.max(from.row, to.row);
+    let sum = 0;
+    let count = 0;
+    
+    new Set(rangeCells({ from: `${from.col}${startRow}`, to: `${to.col}${startRow}` })
+        .map(cellId => splitCellId(cellId).col))
+        .forEach(col => {
+            const end = columnPrefix(col, endRow);
+            const start = columnPrefix(col, startRow - 1);
+            sum += end.sum - start.sum;
+            count += end.count - start.count;
+        });
+    
+    return { sum, count };
+}
+
+// Evaluate a parsed formula against the current grid values
+function evaluateFormula(node) {
+    switch (node.type) {
+        case 'num':
+            return node.value;
+        case 'ref':
+            return cellNumber(node.cell);
+        case 'unary':
+            return node.op === '-' ? -evaluateFormula(node.arg) : evaluateFormula(node.arg);
+        case 'binary': {
+            const left = evaluateFormula(node.left);
+            const right = evaluateFormula(node.right);
+            if (node.op === '+') return left + right;
+            if (node.op === '-') return left - right;
+            if (node.op === '*') return left * right;
+            return left / right;
+        }
+        case 'call':
+            return evaluateFunction(node);
+        case 'server':
+            if (node.value === null) throw new Error(node.error || 'Formula not evaluated yet');
+            return node.value;
+        default:
+            throw new Error('Ranges can only be used inside a function');
+    }
+}
+
+function evaluateFunction(node) {
+    const ranges = node.args.filter(arg => arg.type === 'range');
+    const scalars = node.args.filter(arg => arg.type !== 'range').map(evaluateFormula);
+    
+    if (node.name === 'SUM' || node.name === 'COUNT' || node.name === 'AVERAGE') {
+        let sum = scalars.reduce((total, value) => total + value, 0);
+        let count = scalars.length;
+        
+        ranges.forEach(range => {
+            const aggregate = rangeAggregate(range);
+            sum += aggregate.sum;
+            count += aggregate.count;
         });
         
-        // Evaluate expression
-        return eval(calculatedExpression);
+        if (node.name === 'SUM') return sum;
+        if (node.name === 'COUNT') return count;
+        return count > 0 ? sum / count : 0;
+    }
+    
+    if (node.name === 'MIN' || node.name === 'MAX') {
+        const values = scalars.slice();
+        ranges.forEach(range => {
+            rangeCells(range).forEach(cellId => {
+                const value = parseFloat(gridData[cellId]);
+                if (!isNaN(value)) values.push(value);
+            });
+        });
+        if (values.length === 0) return 0;
+        return node.name === 'MIN' ? Math.min(...values) : Math.max(...values);
+    }
+    
+    throw new Error(`Unknown function ${node.name}`);
+}
+
+// Register (or replace) the formula for a cell in the dependency graph
+function setCellFormula(cellId, formula) {
+    clearCellFormula(cellId);
+    cellFormulas[cellId] = formula;
+    
+    if (SERVER_FORMULA_PATTERN.test(formula)) {
+        formulaAsts[cellId] = { type: 'server', formula, value: null };
+        formulaPrecedents[cellId] = new Set();
+        fetchServerFormula(cellId);
+        return;
+    }
+    
+    let ast = null;
+    let precedents = new Set();
+    try {
+        ast = parseFormula(formula.substring(1));
+        precedents = collectPrecedents(ast);
     } catch (e) {
         console.error('Formula error:', e);
-        return null;
+        ast = null;
     }
+    
+    formulaAsts[cellId] = ast;
+    formulaPrecedents[cellId] = precedents;
+    precedents.forEach(precedent => {
+        if (!formulaDependents[precedent]) {
+            formulaDependents[precedent] = new Set();
+        }
+        formulaDependents[precedent].add(cellId);
+    });
 }
 
-// Recalculate all formulas
-function recalculateFormulas() {
-    for (const cellId in cellFormulas) {
-        const formula = cellFormulas[cellId];
-        const calculatedValue = calculateFormula(formula);
-        const cell = document.getElementById(cellId);
-        
-        if (cell) {
-            cell.textContent = calculatedValue !== null ? calculatedValue : '#ERROR';
-            gridData[cellId] = calculatedValue;
+// Evaluate a table formula on the server, then recalculate its dependents
+async function fetchServerFormula(cellId) {
+    const node = formulaAsts[cellId];
+    
+    try {
+        const response = await fetch('/api/formula/eval', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ formula: node.formula })
+        });
+        const data = await response.json();
+        node.value = response.ok ? data.value : null;
+        node.error = response.ok ? null : data.message;
+    } catch (error) {
+        console.error('Error evaluating formula:', error);
+        node.value = null;
+    }
+    
+    // The cell may have been edited while the request was in flight
+    if (formulaAsts[cellId] === node) {
+        recalculateFormulas([cellId]);
+    }
+}
+
+// Remove a cell's formula and its edges from the dependency graph
+function clearCellFormula(cellId) {
+    (formulaPrecedents[cellId] || new Set()).forEach(precedent => {
+        if (formulaDependents[precedent]) {
+            formulaDependents[precedent].delete(cellId);
         }
+    });
+    delete formulaPrecedents[cellId];
+    delete formulaAsts[cellId];
+    delete cellFormulas[cellId];
+}
+
+// All formula cells that (transitively) depend on the changed cells
+function collectDirtyFormulas(changedCells) {
+    const dirty = new Set(changedCells.filter(cellId => cellId in formulaAsts));
+    const queue = changedCells.slice();
+    
+    while (queue.length > 0) {
+        const cellId = queue.shift();
+        (formulaDependents[cellId] || new Set()).forEach(dependent => {
+            if (!dirty.has(dependent)) {
+                dirty.add(dependent);
+                queue.push(dependent);
+            }
+        });
+    }
+    
+    return dirty;
+}
+
+// Order dirty formulas so each runs after the formulas it reads (Kahn's
+// algorithm). Cells left over are part of, or downstream of, a cycle.
+function orderFormulas(dirty) {
+    const pending = {};
+    dirty.forEach(cellId => {
+        pending[cellId] = 0;
+        formulaPrecedents[cellId].forEach(precedent => {
+            if (dirty.has(precedent)) pending[cellId]++;
+        });
+    });
+    
+    const ready = Object.keys(pending).filter(cellId => pending[cellId] === 0);
+    const order = [];
+    
+    while (ready.length > 0) {
+        const cellId = ready.pop();
+        order.push(cellId);
+        (formulaDependents[cellId] || new Set()).forEach(dependent => {
+            if (dependent in pending && --pending[dependent] === 0) {
+                ready.push(dependent);
+            }
+        });
+    }
+    
+    const cyclic = Object.keys(pending).filter(cellId => pending[cellId] > 0);
+    return { order, cyclic };
+}
+
+// Store a formula result and show it in the grid
+function writeFormulaResult(cellId, value) {
+    gridData[cellId] = value;
+    invalidateCellCache(cellId);
+    refreshGridCell(cellId);
+}
+
+// Recalculate formulas. With a list of changed cells only their dependents
+// are re-evaluated; without one every formula is (after a full redisplay).
+function recalculateFormulas(changedCells) {
+    let dirty;
+    
+    if (changedCells) {
+        changedCells.forEach(invalidateCellCache);
+        dirty = collectDirtyFormulas(changedCells);
+    } else {
+        columnPrefixCache = {};
+        dirty = new Set(Object.keys(formulaAsts));
+        // Expenses were reloaded, so table formulas may be out of date too
+        dirty.forEach(cellId => {
+            if (formulaAsts[cellId] && formulaAsts[cellId].type === 'server') {
+                fetchServerFormula(cellId);
+            }
+        });
     }
     
+    const { order, cyclic } = orderFormulas(dirty);
+    
+    order.forEach(cellId => {
+        let value = null;
+        if (formulaAsts[cellId]) {
+            try {
+                value = evaluateFormula(formulaAsts[cellId]);
+                if (!isFinite(value)) value = null;
+            } catch (e) {
+                console.error('Formula error:', e);
+                value = null;
+            }
+        }
+        writeFormulaResult(cellId, value !== null ? value : '#ERROR');
+    });
+    
+    cyclic.forEach(cellId => writeFormulaResult(cellId, '#CYCLE'));
+    
     updateTotals();
 }
 
+// Toggle a formatting class on the selected cell
+function toggleCellStyle(style) {
+    if (selectedCellId) {
+        const styles = cellStyles[selectedCellId] || {};
+        styles[style] = !styles[style];
+        cellStyles[selectedCellId] = styles;
+        refreshGridCell(selectedCellId);
+    }
+}
+
 // Format buttons
 const boldButton = document.querySelector('.toolbar-button.bold');
 if (boldButton) {
-    boldButton.addEventListener('click', () => {
-        if (selectedCell) {
-            selectedCell.classList.toggle('bold');
-        }
-    });
+    boldButton.addEventListener('click', () => toggleCellStyle('bold'));
 }
 
 const italicButton = document.querySelector('.toolbar-button.italic');
 if (italicButton) {
-    italicButton.addEventListener('click', () => {
-        if (selectedCell) {
-            selectedCell.classList.toggle('italic');
-        }
-    });
+    italicButton.addEventListener('click', () => toggleCellStyle('italic'));
 }
 
 // Format as currency
 const currencyButton = document.querySelector('.toolbar-button:nth-child(3)');
 if (currencyButton) {
     currencyButton.addEventListener('click', () => {
-        if (selectedCell && selectedCell.textContent) {
-            const value = parseFloat(selectedCell.textContent);
+        if (selectedCellId && gridData[selectedCellId]) {
+            const value = parseFloat(gridData[selectedCellId]);
             if (!isNaN(value)) {
-                selectedCell.textContent = '$' + value.toFixed(2);
+                setCellValue(selectedCellId, '$' + value.toFixed(2));
             }
         }
     });
@@ -761,10 +1399,10 @@ if (currencyButton) {
 const percentButton = document.querySelector('.toolbar-button:nth-child(4)');
 if (percentButton) {
     percentButton.addEventListener('click', () => {
-        if (selectedCell && selectedCell.textContent) {
-            const value = parseFloat(selectedCell.textContent);
+        if (selectedCellId && gridData[selectedCellId]) {
+            const value = parseFloat(gridData[selectedCellId]);
             if (!isNaN(value)) {
-                selectedCell.textContent = (value * 100).toFixed(1) + '%';
+                setCellValue(selectedCellId, (value * 100).toFixed(1) + '%');
             }
         }
     });
@@ -775,13 +1413,24 @@ async function fetchExpenses(forceRefresh = false) {
     return new Promise((resolve, reject) => {
         try {
             console.log("Fetching expenses with forceRefresh=", forceRefresh);
-            // Use the storage API instead of direct fetch
-            AppStorage.expenses.get(function(data) {
-                expenses = data;
-                console.log(`Loaded ${expenses.length} expenses`);
-                displayExpenses(); // This will call updateTotals()
-                resolve(data);
-            }, forceRefresh); // Pass the forceRefresh parameter
+            
+            // Only the first page is loaded here (from the local store unless
+            // refreshing); loadMoreExpenses pulls the rest while scrolling.
+            // Totals and budgets come from the summary, not from the rows.
+            expensesComplete = false;
+            const firstPage = new Promise(pageLoaded => {
+                AppStorage.expenses.getPage(0, GRID_PAGE_SIZE, function(page, total) {
+                    expenses = page;
+                    expenseTotal = total;
+                    expensesComplete = page.length >= total;
+                    console.log(`Loaded ${expenses.length} of ${expenseTotal} expenses`);
+                    displayExpenses();
+                    pageLoaded();
+                }, !forceRefresh);
+            });
+            const summary = fetchExpenseSummary(forceRefresh).then(updateTotals);
+            
+            Promise.all([firstPage, summary]).then(() => resolve(expenses));
         } catch (error) {
             console.error('Error fetching expenses:', error);
             reject(error);
@@ -789,6 +1438,18 @@ async function fetchExpenses(forceRefresh = false) {
     });
 }
 
+// Fetch the per-currency, per-category totals behind the totals and budgets
+function fetchExpenseSummary(forceRefresh = true) {
+    return new Promise(resolve => {
+        AppStorage.expenses.getSummary(function(summary) {
+            if (summary) {
+                expenseSummary = summary;
+            }
+            resolve(expenseSummary);
+        }, forceRefresh);
+    });
+}
+
 // Format a number to display properly
 function formatNumber(num, isUSD = false) {
     // Ensure num is a number
@@ -815,18 +1476,47 @@ function formatNumber(num, isUSD = false) {
     }
 }
 
-// Display expenses in the grid
-function displayExpenses() {
+// Write one expense into the grid data for a row
+function fillExpenseRow(rowNum, expense) {
+    // Format date
+    const dateObj = new Date(expense.date);
+    const formattedDate = `${dateObj.getFullYear()}-${(dateObj.getMonth() + 1).toString().padStart(2, '0')}-${dateObj.getDate().toString().padStart(2, '0')}`;
+    
+    // Format amounts
+    let amountUSD = expense.amount;
+    let amountARS = 0;
+    
+    if (expense.currency === 'ARS') {
+        // If in ARS, convert to USD
+        amountUSD = exchangeRate > 0 ? expense.amount / exchangeRate : 0;
+        amountARS = expense.amount;
+    } else if (expense.currency === 'USD-Blue' || expense.currency === 'USD') {
+        // If in USD, convert to ARS
+        amountUSD = expense.amount;
+        amountARS = expense.amount * exchangeRate;
+    } else if (expense.currency === 'USD-Tarjeta') {
+        // If in USD-Tarjeta, use tarjeta rate
+        amountUSD = expense.amount;
+        amountARS = expense.amount * exchangeRateTarjeta;
+    }
+    
+    gridData[`A${rowNum}`] = formattedDate;
+    gridData[`B${rowNum}`] = expense.description;
+    gridData[`C${rowNum}`] = formatNumber(amountUSD, true);
+    gridData[`D${rowNum}`] = formatNumber(amountARS);
+    gridData[`E${rowNum}`] = expense.currency;
+    gridData[`F${rowNum}`] = expense.category;
+    // Account plus a delete link; defaults to Payoneer if not specified
+    gridData[`G${rowNum}`] = `${expense.account || 'Payoneer'} | Delete`;
+}
+
+// Display expenses in the grid. Only the grid data is rebuilt; the
+// DOM is limited to the rows currently in view (see renderGrid).
+function displayExpenses(recalculate = true) {
     // Clear old expense data (starting from row 2)
-    for (let r = 1; r < GRID_ROWS; r++) {
-        for (let c = 0; c < GRID_COLS; c++) {
-            const cellId = `${COL_LETTERS[c]}${r + 1}`;
-            const cell = document.getElementById(cellId);
-            if (cell) {
-                cell.textContent = '';
-                cell.innerHTML = '';
-                gridData[cellId] = '';
-            }
+    for (const cellId in gridData) {
+        if (splitCellId(cellId).row > 1) {
+            delete gridData[cellId];
         }
     }
     
@@ -835,60 +1525,19 @@ function displayExpenses() {
         return new Date(b.date) - new Date(a.date);
     });
     
-    // Populate expenses into grid
-    for (let i = 0; i < expenses.length && i < GRID_ROWS - 2; i++) {
-        const expense = expenses[i];
-        const rowNum = i + 2; // Start from row 2
-        
-        // Format date
-        const dateObj = new Date(expense.date);
-        const formattedDate = `${dateObj.getFullYear()}-${(dateObj.getMonth() + 1).toString().padStart(2, '0')}-${dateObj.getDate().toString().padStart(2, '0')}`;
-        
-        // Format amounts
-        let amountUSD = expense.amount;
-        let amountARS = 0;
-        
-        if (expense.currency === 'ARS') {
-            // If in ARS, convert to USD
-            amountUSD = exchangeRate > 0 ? expense.amount / exchangeRate : 0;
-            amountARS = expense.amount;
-        } else if (expense.currency === 'USD-Blue' || expense.currency === 'USD') {
-            // If in USD, convert to ARS
-            amountUSD = expense.amount;
-            amountARS = expense.amount * exchangeRate;
-        } else if (expense.currency === 'USD-Tarjeta') {
-            // If in USD-Tarjeta, use tarjeta rate
-            amountUSD = expense.amount;
-            amountARS = expense.amount * exchangeRateTarjeta;
-        }
-        
-        // Set cell values
-        setCellValue(`A${rowNum}`, formattedDate);
-        setCellValue(`B${rowNum}`, expense.description);
-        setCellValue(`C${rowNum}`, formatNumber(amountUSD, true));
-        setCellValue(`D${rowNum}`, formatNumber(amountARS));
-        setCellValue(`E${rowNum}`, expense.currency);
-        setCellValue(`F${rowNum}`, expense.category);
-        setCellValue(`G${rowNum}`, expense.account || 'Payoneer'); // Default to Payoneer if not specified
-        
-        // Add a delete link
-        const deleteCell = document.getElementById(`G${rowNum}`);
-        if (deleteCell) {
-            deleteCell.innerHTML = '';
-            const deleteLink = document.createElement('a');
-            deleteLink.href = '#';
-            deleteLink.textContent = `${expense.account || 'Payoneer'} | Delete`;
-            deleteLink.addEventListener('click', function(e) {
-                e.preventDefault();
-                deleteExpense(expense.id);
-            });
-            deleteCell.appendChild(deleteLink);
-            gridData[`G${rowNum}`] = `${expense.account || 'Payoneer'} | Delete`;
-        }
+    if (expensesComplete) {
+        expenseTotal = expenses.length;
     }
     
-    // Update totals
-    updateTotals();
+    // Populate expenses into grid, starting from row 2
+    expenses.forEach((expense, i) => fillExpenseRow(i + 2, expense));
+    
+    invalidateGrid();
+    
+    // Every cell may have changed: recalculate all formulas (also updates totals)
+    if (recalculate) {
+        recalculateFormulas();
+    }
 }
 
 // Update expenses with current exchange rate
@@ -990,6 +1639,7 @@ async function addExpense(date, description, amount, currency, category, account
             
             // Update expenses and totals, then refresh budgets
             expenses = data;
+            expensesComplete = true;
             displayExpenses();
             
             // Update account balance if an account was specified
@@ -997,10 +1647,11 @@ async function addExpense(date, description, amount, currency, category, account
                 updateAccountBalanceFromExpense(account, preciseAmount, currency);
             }
             
-            // Refresh budgets after the totals are updated
-            setTimeout(() => {
+            // Refresh totals and budgets; they are drawn in the same frame
+            fetchExpenseSummary().then(() => {
+                updateTotals();
                 fetchBudgetAllocations();
-            }, 50);
+            });
         });
     } catch (error) {
         console.error('Error adding expense:', error);
@@ -1016,20 +1667,20 @@ async function fetchBudgetAllocations(forceRefresh = true) {
             const categoryMap = {};
             
             // Sum all expenses by category
-            expenses.forEach(expense => {
-                if (!expense.category) return;
+            expenseSummary.forEach(group => {
+                if (!group.category) return;
                 
                 // Normalize the category name
-                const category = expense.category;
+                const category = group.category;
                 
                 // Convert amount to USD if needed
-                let amountUSD = expense.amount;
-                if (expense.currency === 'ARS') {
-                    amountUSD = exchangeRate > 0 ? expense.amount / exchangeRate : 0;
-                } else if (expense.currency === 'USD-Tarjeta') {
+                let amountUSD = group.amount;
+                if (group.currency === 'ARS') {
+                    amountUSD = exchangeRate > 0 ? group.amount / exchangeRate : 0;
+                } else if (group.currency === 'USD-Tarjeta') {
                     // If tarjeta rate is available, use it; otherwise use the same as blue
                     const rate = exchangeRateTarjeta > 0 ? exchangeRateTarjeta : exchangeRate;
-                    amountUSD = expense.amount;
+                    amountUSD = group.amount;
                 }
                 
                 // Add to category total
@@ -1077,15 +1728,9 @@ async function fetchBudgetAllocations(forceRefresh = true) {
                         console.log('Updated budget data with local calculations:', data);
                     }
                     
+                    // Table, chart and warnings are drawn together in the next frame
                     displayBudgetAllocations(data);
                     
-                    // Ensure Chart.js is loaded before trying to update the chart
-                    if (typeof Chart !== 'undefined') {
-                        updateBudgetChart(data);
-                    } else {
-                        console.error("Chart.js not loaded yet. Will not update budget chart.");
-                    }
-                    
                     resolve(data);
                 } else {
                     resolve(null);
@@ -1098,56 +1743,51 @@ async function fetchBudgetAllocations(forceRefresh = true) {
     });
 }
 
-// Display budget allocations in the grid
+// Display budget allocations (table, chart and warnings) in the next frame
 function displayBudgetAllocations(data) {
+    renderState.budgetData = data;
+    scheduleRender('budget');
+}
+
+// Make a container hold exactly `count` budget cells, reusing existing ones
+function ensureBudgetCells(container, count) {
+    while (container.children.length < count) {
+        const cell = document.createElement('div');
+        cell.className = 'budget-grid-cell';
+        container.appendChild(cell);
+    }
+    while (container.children.length > count) {
+        container.lastChild.remove();
+    }
+    return container.children;
+}
+
+// Fill the budget table; rows are only rebuilt when the category count changes
+function renderBudgetAllocations(data) {
     console.log("Displaying budget data:", data);
     
     const budgetGrid = document.getElementById('budget-allocation-body');
     const budgetTotals = document.getElementById('budget-allocation-totals');
     
-    // Clear existing content
-    budgetGrid.innerHTML = '';
-    budgetTotals.innerHTML = '';
+    if (budgetGrid.children.length !== data.allocations.length) {
+        budgetGrid.innerHTML = '';
+        data.allocations.forEach(() => {
+            const row = document.createElement('div');
+            row.className = 'budget-grid-row';
+            ensureBudgetCells(row, 5);
+            budgetGrid.appendChild(row);
+        });
+    }
     
-    // Add each budget category row
-    data.allocations.forEach(allocation => {
-        const row = document.createElement('div');
-        row.className = 'budget-grid-row';
-        
-        // Category name
-        const nameCell = document.createElement('div');
-        nameCell.className = 'budget-grid-cell';
-        nameCell.textContent = allocation.name;
-        row.appendChild(nameCell);
-        
-        // Percentage
-        const percentCell = document.createElement('div');
-        percentCell.className = 'budget-grid-cell';
-        percentCell.textContent = `${allocation.percentage.toFixed(1)}%`;
-        row.appendChild(percentCell);
-        
-        // Allocated amount
-        const allocatedCell = document.createElement('div');
-        allocatedCell.className = 'budget-grid-cell';
-        allocatedCell.textContent = `$${formatNumber(allocation.allocated, true)}`;
-        row.appendChild(allocatedCell);
-        
-        // Actual spend
-        const actualCell = document.createElement('div');
-        actualCell.className = 'budget-grid-cell';
-        actualCell.textContent = `$${formatNumber(allocation.actual, true)}`;
-        row.appendChild(actualCell);
-        
-        // Remaining balance
-        const remainingCell = document.createElement('div');
-        remainingCell.className = 'budget-grid-cell';
-        if (allocation.remaining < 0) {
-            remainingCell.classList.add('over-budget');
-        }
-        remainingCell.textContent = `$${formatNumber(allocation.remaining, true)}`;
-        row.appendChild(remainingCell);
-        
-        budgetGrid.appendChild(row);
+    // Add each budget category row: name, percentage, allocated, actual, remaining
+    data.allocations.forEach((allocation, i) => {
+        const cells = budgetGrid.children[i].children;
+        setText(cells[0], allocation.name);
+        setText(cells[1], `${allocation.percentage.toFixed(1)}%`);
+        setText(cells[2], `$${formatNumber(allocation.allocated, true)}`);
+        setText(cells[3], `$${formatNumber(allocation.actual, true)}`);
+        setText(cells[4], `$${formatNumber(allocation.remaining, true)}`);
+        cells[4].classList.toggle('over-budget', allocation.remaining < 0);
     });
     
     // Manually calculate totals to ensure we have values
@@ -1168,39 +1808,15 @@ function displayBudgetAllocations(data) {
         totalRemaining = data.total_remaining || 0;
     }
     
-    // Instead of creating a separate row, let's directly add cells to the footer
-    // This ensures alignment with the header which is also constructed this way
-    const nameCell = document.createElement('div');
-    nameCell.className = 'budget-grid-cell';
-    nameCell.textContent = 'Total';
-    budgetTotals.appendChild(nameCell);
-    
-    const percentCell = document.createElement('div');
-    percentCell.className = 'budget-grid-cell';
-    percentCell.textContent = '100%';
-    budgetTotals.appendChild(percentCell);
-    
-    const allocatedCell = document.createElement('div');
-    allocatedCell.className = 'budget-grid-cell';
-    allocatedCell.textContent = `$${formatNumber(totalAllocated, true)}`;
-    budgetTotals.appendChild(allocatedCell);
-    
-    const actualCell = document.createElement('div');
-    actualCell.className = 'budget-grid-cell';
-    actualCell.textContent = `$${formatNumber(totalActual, true)}`;
-    budgetTotals.appendChild(actualCell);
-    
-    const remainingCell = document.createElement('div');
-    remainingCell.className = 'budget-grid-cell';
-    if (totalRemaining < 0) {
-        remainingCell.classList.add('over-budget');
-    }
-    remainingCell.textContent = `$${formatNumber(totalRemaining, true)}`;
-    budgetTotals.appendChild(remainingCell);
-    
-    // Add these calls to update budget chart and warnings
-    updateBudgetChart(data);
-    checkBudgetWarnings(data);
+    // The footer cells sit directly in the totals container, which keeps
+    // them aligned with the header
+    const totalCells = ensureBudgetCells(budgetTotals, 5);
+    setText(totalCells[0], 'Total');
+    setText(totalCells[1], '100%');
+    setText(totalCells[2], `$${formatNumber(totalAllocated, true)}`);
+    setText(totalCells[3], `$${formatNumber(totalActual, true)}`);
+    setText(totalCells[4], `$${formatNumber(totalRemaining, true)}`);
+    totalCells[4].classList.toggle('over-budget', totalRemaining < 0);
 }
 
 // Update budget chart
@@ -1249,9 +1865,22 @@ function updateBudgetChart(data) {
         });
     }
     
-    // Destroy existing chart if exists
+    // Update the existing chart in place; skip it if nothing changed
     if (budgetChart) {
-        budgetChart.destroy();
+        const chartData = budgetChart.data;
+        const same = (a, b) => a.length === b.length && a.every((value, i) => value === b[i]);
+        
+        if (same(chartData.labels, labels) &&
+            same(chartData.datasets[0].data, allocatedData) &&
+            same(chartData.datasets[1].data, actualData)) {
+            return;
+        }
+        
+        chartData.labels = labels;
+        chartData.datasets[0].data = allocatedData;
+        chartData.datasets[1].data = actualData;
+        budgetChart.update();
+        return;
     }
     
     // Create new chart
@@ -1341,12 +1970,14 @@ async function deleteExpense(id) {
             AppStorage.expenses.delete(id, function(data) {
                 // Update expenses and totals
                 expenses = data;
+                expensesComplete = true;
                 displayExpenses();
                 
-                // Refresh budgets after the totals are updated
-                setTimeout(() => {
+                // Refresh totals and budgets; they are drawn in the same frame
+                fetchExpenseSummary().then(() => {
+                    updateTotals();
                     fetchBudgetAllocations();
-                }, 50);
+                });
             });
         } catch (error) {
             console.error('Error deleting expense:', error);
@@ -1354,8 +1985,13 @@ async function deleteExpense(id) {
     }
 }
 
-// Update total calculations
+// Update total calculations (drawn in the next frame)
 function updateTotals() {
+    scheduleRender('totals');
+}
+
+// Recompute and display the expense totals
+function renderTotals() {
     // Use a more precise approach to prevent floating point errors
     let totalUSD = 0;
     let totalARS = 0;
@@ -1363,16 +1999,16 @@ function updateTotals() {
     // Create a map to track category totals
     const categoryTotals = {};
     
-    console.log("Calculating totals for", expenses.length, "expenses");
+    console.log("Calculating totals for", expenseTotal, "expenses");
     
-    expenses.forEach((expense, index) => {
+    expenseSummary.forEach(group => {
         // Determine exchange rate to use based on the currency
         let rate;
-        if (expense.currency === 'USD-Blue') {
+        if (group.currency === 'USD-Blue') {
             rate = exchangeRate;
-        } else if (expense.currency === 'USD-Tarjeta') {
+        } else if (group.currency === 'USD-Tarjeta') {
             rate = exchangeRateTarjeta;
-        } else if (expense.currency === 'ARS') {
+        } else if (group.currency === 'ARS') {
             rate = selectedDolarType === 'blue' ? exchangeRate : exchangeRateTarjeta;
         } else {
             // Legacy USD handling
@@ -1380,10 +2016,10 @@ function updateTotals() {
         }
         
         // Ensure we're working with a numeric value, precisely rounded
-        const amount = parseFloat(parseFloat(expense.amount).toFixed(2));
+        const amount = parseFloat(parseFloat(group.amount).toFixed(2));
         
         // Get category (default to Fixed Expenses if not specified)
-        const category = expense.category || 'Fixed Expenses';
+        const category = group.category || 'Fixed Expenses';
         
         // Initialize category total if needed
         if (!categoryTotals[category]) {
@@ -1391,16 +2027,13 @@ function updateTotals() {
         }
         
         // Use parseFloat and toFixed to avoid floating point errors
-        if (expense.currency === 'USD-Blue' || expense.currency === 'USD-Tarjeta' || expense.currency === 'USD') {
+        if (group.currency === 'USD-Blue' || group.currency === 'USD-Tarjeta' || group.currency === 'USD') {
             // Add USD amount with proper precision handling
             totalUSD = parseFloat((totalUSD + amount).toFixed(2));
             totalARS = parseFloat((totalARS + amount * rate).toFixed(2));
             
             // Add to category total
             categoryTotals[category] = parseFloat((categoryTotals[category] + amount).toFixed(2));
-            
-            // Log for debugging
-            console.log(`Expense ${index + 1}: ${amount} USD (${expense.currency}) -> Total USD: ${totalUSD}`);
         } else {
             // For ARS, convert to USD with proper precision handling
             const usdAmount = parseFloat((amount / rate).toFixed(2));
@@ -1409,9 +2042,6 @@ function updateTotals() {
             
             // Add to category total
             categoryTotals[category] = parseFloat((categoryTotals[category] + usdAmount).toFixed(2));
-            
-            // Log for debugging
-            console.log(`Expense ${index + 1}: ${amount} ARS -> ${usdAmount} USD -> Total USD: ${totalUSD}`);
         }
     });
     
@@ -1422,8 +2052,8 @@ function updateTotals() {
     monthlySalary = parseFloat(monthlySalary) || 0;
     
     // Format the displayed values
-    document.getElementById('total-usd').textContent = `$${formatNumber(totalUSD, true)}`;
-    document.getElementById('total-ars').textContent = `ARS ${formatNumber(totalARS)}`;
+    setText(document.getElementById('total-usd'), `$${formatNumber(totalUSD, true)}`);
+    setText(document.getElementById('total-ars'), `ARS ${formatNumber(totalARS)}`);
     
     // Calculate remaining budget
     const remainingUSD = parseFloat((monthlySalary - totalUSD).toFixed(2));
@@ -1436,24 +2066,15 @@ function updateTotals() {
     console.log("Remaining ARS:", remainingARS);
     
     // Update displayed values
-    document.getElementById('remaining-usd').textContent = `$${formatNumber(remainingUSD, true)}`;
-    document.getElementById('remaining-ars').textContent = `ARS ${formatNumber(remainingARS)}`;
+    setText(document.getElementById('remaining-usd'), `$${formatNumber(remainingUSD, true)}`);
+    setText(document.getElementById('remaining-ars'), `ARS ${formatNumber(remainingARS)}`);
     
     // Update style for negative remaining budget
     const remainingUsdElement = document.getElementById('remaining-usd');
     const remainingArsElement = document.getElementById('remaining-ars');
     
-    if (remainingUSD < 0) {
-        remainingUsdElement.classList.add('negative');
-    } else {
-        remainingUsdElement.classList.remove('negative');
-    }
-    
-    if (remainingARS < 0) {
-        remainingArsElement.classList.add('negative');
-    } else {
-        remainingArsElement.classList.remove('negative');
-    }
+    remainingUsdElement.classList.toggle('negative', remainingUSD < 0);
+    remainingArsElement.classList.toggle('negative', remainingARS < 0);
     
     // Also color total expenses
     document.getElementById('total-usd').style.color = '';
@@ -1492,11 +2113,9 @@ async function redistributeBudget(adjustments) {
             // Reload with forced refresh
             await fetchBudgetAllocations();
             
-            // Force UI update after a short delay to ensure data is ready
-            setTimeout(() => {
-                updateBudgetDashboard();
-                updateTotals();
-            }, 300);
+            // Redraw the dashboard; totals are flushed with the budget above
+            updateBudgetDashboard();
+            updateTotals();
             
             console.log('Budget redistributed successfully');
         } else {
@@ -1615,16 +2234,15 @@ document.getElementById('cancel-budget-adjustments').addEventListener('click', (
 // Fetch exchange rate
 async function fetchExchangeRate() {
     try {
-        // Use the storage API for exchange rates
-        const type = selectedDolarType || 'blue';
-        
-        AppStorage.exchangeRate.get(type, function(data) {
-            if (data) {
-                if (type === 'blue') {
-                    exchangeRate = data.usd_to_ars;
-                } else {
-                    exchangeRateTarjeta = data.usd_to_ars;
-                }
+        // Both rates are needed for conversions, fetch them in one request
+        AppStorage.exchangeRate.getAll(['blue', 'tarjeta'], function(rates) {
+            if (rates.blue) {
+                exchangeRate = rates.blue.usd_to_ars;
+            }
+            if (rates.tarjeta) {
+                exchangeRateTarjeta = rates.tarjeta.usd_to_ars;
+            }
+            if (rates.blue || rates.tarjeta) {
                 updateExpenses();
             }
         });
@@ -1760,6 +2378,13 @@ async function initApp() {
 // Start the app when the document is loaded
 document.addEventListener('DOMContentLoaded', initApp);
 
+// Reload once writes queued while offline have been replayed
+window.addEventListener('appstorage:synced', function() {
+    fetchExpenses(true);
+    fetchBudgetAllocations(true);
+    loadAccountBalances();
+});
+
 // Convert between currencies
 function convertCurrency(amount, fromCurrency, toCurrency) {
     if (fromCurrency === toCurrency) {
@@ -1865,11 +2490,8 @@ function calculateMonthlyExpenses() {
 
 // Set cell value (helper function for grid updates)
 function setCellValue(cellId, value) {
-    const cell = document.getElementById(cellId);
-    if (cell) {
-        cell.textContent = value;
-        gridData[cellId] = value;
-    }
+    gridData[cellId] = value;
+    refreshGridCell(cellId);
 }
 
 // Función para configurar la funcionalidad de transferencias y comisiones
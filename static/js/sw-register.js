@@ -0,0 +1,38 @@
+/**
+ * Registers the service worker (offline cache and write queue, see sw.js)
+ * and applies the results of replayed offline writes.
+ */
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', function() {
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.error('Service worker registration failed:', error);
+        });
+    });
+    
+    // Replay queued writes as soon as the connection is back
+    window.addEventListener('online', function() {
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ type: 'flush' });
+        }
+    });
+    
+    navigator.serviceWorker.addEventListener('message', function(event) {
+        if (!event.data || event.data.type !== 'sync-result') return;
+        
+        const results = event.data.results || [];
+        
+        // Cached data predates the replayed writes
+        if (typeof AppStorage !== 'undefined') {
+            AppStorage.invalidateAll();
+        }
+        
+        const conflicts = results.filter(result => result.conflict);
+        if (conflicts.length > 0) {
+            console.warn('Offline changes in conflict with the server:', conflicts);
+            alert(`${conflicts.length} offline change(s) were not applied because the data changed on the server in the meantime.`);
+        }
+        
+        // Pages listen for this to reload their data
+        window.dispatchEvent(new CustomEvent('appstorage:synced', { detail: results }));
+    });
+}
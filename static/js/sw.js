@@ -0,0 +1,381 @@
+/**
+ * RetroMoney service worker
+ * - Precaches the pages and static assets so the app shell opens offline
+ *   (pages are loaded network-first, since they embed first-screen data)
+ * - Serves API reads stale-while-revalidate (requests made with
+ *   cache: 'no-cache', i.e. forced refreshes, go to the network first)
+ * - Queues writes made while offline in IndexedDB and replays them, in
+ *   order, through /api/sync/batch once the connection is back
+ */
+
+const CACHE_VERSION = 'v1';
+const STATIC_CACHE = `retro-money-static-${CACHE_VERSION}`;
+const API_CACHE = `retro-money-api-${CACHE_VERSION}`;
+
+const PRECACHE_URLS = [
+    '/',
+    '/todos',
+    '/investments',
+    '/transfers',
+    '/static/manifest.json',
+    '/static/css/excel-retro.css',
+    '/static/css/mobile-fix.css',
+    '/static/css/broker.css',
+    '/static/js/app-storage.js',
+    '/static/js/chart.min.js',
+    '/static/js/grid.js',
+    '/static/js/investments.js',
+    '/static/js/mobile-fix.js',
+    '/static/js/transfers.js',
+    '/static/js/sw-register.js'
+];
+
+// API paths that are never cached or queued
+const BYPASS_PREFIXES = ['/api/broker', '/api/sync', '/api/formula'];
+
+// Writes to a single row, which are checked for conflicts
+const ROW_PATH = /^\/api\/(expenses|investments|todos)\/(\d+)/;
+
+const OUTBOX_DB = 'retro-money-sync';
+const OUTBOX_STORE = 'outbox';
+const SYNC_TAG = 'outbox';
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        Promise.all([caches.open(STATIC_CACHE), bundleUrls()]).then(([cache, bundles]) => Promise.all(
+            // One missing asset should not fail the whole install
+            PRECACHE_URLS.concat(bundles).map(url => cache.add(url).catch(error => {
+                console.warn('Precache failed for', url, error);
+            }))
+        )).then(() => self.skipWaiting())
+    );
+});
+
+// Fingerprinted bundles the pages load instead of the plain files, when
+// build_assets.py has been run
+function bundleUrls() {
+    return fetch('/static/dist/manifest.json')
+        .then(response => response.ok ? response.json() : {})
+        .then(manifest => Object.values(manifest).map(path => `/static/dist/${path}`))
+        .catch(() => []);
+}
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key !== STATIC_CACHE && key !== API_CACHE)
+                    .map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+            .then(() => flushOutbox().catch(() => {}))
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    if (url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/api/')) {
+        if (BYPASS_PREFIXES.some(prefix => url.pathname.startsWith(prefix))) return;
+
+        if (request.method === 'GET') {
+            event.respondWith(staleWhileRevalidate(event, request, API_CACHE));
+        } else {
+            event.respondWith(sendMutation(request));
+        }
+        return;
+    }
+
+    // Fingerprinted bundles never change under the same URL
+    if (request.method === 'GET' && url.pathname.startsWith('/static/dist/')) {
+        event.respondWith(cacheFirst(request, STATIC_CACHE));
+        return;
+    }
+
+    // Pages carry their first-screen data, so a cached copy is only used offline
+    if (request.method === 'GET' && request.mode === 'navigate') {
+        event.respondWith(networkFirst(request, STATIC_CACHE));
+        return;
+    }
+
+    if (request.method === 'GET' && url.pathname.startsWith('/static/')) {
+        event.respondWith(staleWhileRevalidate(event, request, STATIC_CACHE));
+    }
+});
+
+// Background Sync (where supported) retries the queue when back online
+self.addEventListener('sync', event => {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(flushOutbox());
+    }
+});
+
+// Pages ask for a flush on the 'online' event, for browsers without Background Sync
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'flush') {
+        event.waitUntil(flushOutbox().catch(() => {}));
+    }
+});
+
+/**
+ * Answer from the cache right away and refresh it in the background.
+ * Forced refreshes wait for the network and only fall back to the cache offline.
+ */
+async function staleWhileRevalidate(event, request, cacheName) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+
+    const network = fetch(request).then(response => {
+        if (response.ok) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    });
+
+    const forced = request.cache === 'no-cache' || request.cache === 'reload' || request.cache === 'no-store';
+    if (cached && !forced) {
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+    }
+
+    try {
+        return await network;
+    } catch (error) {
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+async function networkFirst(request, cacheName) {
+    const cache = await caches.open(cacheName);
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+async function cacheFirst(request, cacheName) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+
+    const response = await fetch(request);
+    if (response.ok) {
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+/**
+ * Send a write to the server, or queue it if we are offline (or earlier
+ * writes are still queued, so that order is preserved).
+ */
+async function sendMutation(request) {
+    const body = await request.clone().text();
+
+    if (await countOutbox() === 0) {
+        try {
+            const response = await fetch(request);
+            if (response.ok) {
+                // Cached reads may now be out of date
+                await caches.delete(API_CACHE);
+            }
+            return response;
+        } catch (error) {
+            // Offline: queue it below
+        }
+    }
+
+    const url = new URL(request.url);
+    await addToOutbox({
+        method: request.method,
+        url: url.pathname + url.search,
+        body: body ? parseBody(body) : null,
+        expected: await findCachedRecord(url.pathname),
+        queued_at: Date.now()
+    });
+
+    if (self.registration.sync) {
+        self.registration.sync.register(SYNC_TAG).catch(() => {});
+    }
+    flushOutbox().catch(() => {});
+
+    return new Response(JSON.stringify({
+        status: 'success',
+        queued: true,
+        message: 'Saved offline, will sync when the connection is back'
+    }), {
+        status: 202,
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+function parseBody(body) {
+    try {
+        return JSON.parse(body);
+    } catch (error) {
+        return null;
+    }
+}
+
+/**
+ * The row a write to /api/<collection>/<id> targets, as last seen in a
+ * cached read of /api/<collection>. Sent along for conflict detection.
+ */
+async function findCachedRecord(pathname) {
+    const match = pathname.match(ROW_PATH);
+    if (!match) return null;
+
+    const collection = `/api/${match[1]}`;
+    const id = parseInt(match[2]);
+    const cache = await caches.open(API_CACHE);
+
+    for (const request of await cache.keys()) {
+        if (new URL(request.url).pathname !== collection) continue;
+
+        const response = await cache.match(request);
+        const record = findRecord(fromColumnar(await response.json().catch(() => null)), id);
+        if (record) {
+            const { subtasks, total_value, profit_loss, ...fields } = record;
+            return fields;
+        }
+    }
+    return null;
+}
+
+// Lists requested with ?format=columnar come as {columns, rows}
+function fromColumnar(data) {
+    if (!data || !Array.isArray(data.columns) || !Array.isArray(data.rows)) return data;
+    return data.rows.map(row => Object.fromEntries(data.columns.map((column, i) => [column, row[i]])));
+}
+
+function findRecord(data, id) {
+    if (Array.isArray(data)) {
+        for (const item of data) {
+            const found = findRecord(item, id);
+            if (found) return found;
+        }
+    } else if (data && typeof data === 'object') {
+        if (data.id === id) return data;
+        for (const value of Object.values(data)) {
+            if (value && typeof value === 'object') {
+                const found = findRecord(value, id);
+                if (found) return found;
+            }
+        }
+    }
+    return null;
+}
+
+let flushing = null;
+
+/**
+ * Replay queued writes in one batch, then any queued while it was sent.
+ * Every mutation the server answered (applied, rejected or in conflict)
+ * leaves the queue; results are posted to open pages so they can refresh
+ * and report conflicts.
+ */
+function flushOutbox() {
+    if (!flushing) {
+        flushing = replayOutbox().finally(() => {
+            flushing = null;
+        });
+    }
+    return flushing;
+}
+
+async function replayOutbox() {
+    // Rows written by earlier batches of this flush. Writes queued while a
+    // batch was on its way still carry the snapshot from before it, so they
+    // are sent without one rather than conflicting with our own write.
+    const written = new Set();
+    let mutations = await readOutbox();
+
+    while (mutations.length > 0) {
+        mutations = mutations.map(mutation => {
+            const row = mutation.url.match(ROW_PATH);
+            return row && written.has(row[0]) ? { ...mutation, expected: null } : mutation;
+        });
+
+        const response = await fetch('/api/sync/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ mutations })
+        });
+        if (!response.ok) {
+            throw new Error(`Sync failed with status ${response.status}`);
+        }
+
+        const data = await response.json();
+        await deleteFromOutbox(data.results.map(result => result.id));
+        await caches.delete(API_CACHE);
+
+        data.results.forEach((result, i) => {
+            const row = mutations[i].url.match(ROW_PATH);
+            if (row && result.status < 400) written.add(row[0]);
+        });
+
+        const clients = await self.clients.matchAll({ includeUncontrolled: true });
+        clients.forEach(client => client.postMessage({ type: 'sync-result', results: data.results }));
+
+        mutations = await readOutbox();
+    }
+}
+
+// IndexedDB outbox helpers
+
+function openOutbox() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(OUTBOX_DB, 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore(OUTBOX_STORE, { keyPath: 'id', autoIncrement: true });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function outboxRequest(mode, operation) {
+    const db = await openOutbox();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(OUTBOX_STORE, mode);
+        const request = operation(transaction.objectStore(OUTBOX_STORE));
+        transaction.oncomplete = () => {
+            db.close();
+            resolve(request ? request.result : undefined);
+        };
+        transaction.onerror = () => {
+            db.close();
+            reject(transaction.error);
+        };
+    });
+}
+
+function addToOutbox(mutation) {
+    return outboxRequest('readwrite', store => store.add(mutation));
+}
+
+function countOutbox() {
+    return outboxRequest('readonly', store => store.count());
+}
+
+function readOutbox() {
+    return outboxRequest('readonly', store => store.getAll());
+}
+
+function deleteFromOutbox(ids) {
+    return outboxRequest('readwrite', store => {
+        ids.forEach(id => store.delete(id));
+        return null;
+    });
+}
@@ -36,22 +36,20 @@ async function initTransfersPage() {
 
 // Load exchange rate
 async function fetchExchangeRate() {
-    // Fetch crypto dollar rate directly from the API
-    try {
-        const cryptoResponse = await fetch('https://dolarapi.com/v1/dolares/cripto');
-        if (!cryptoResponse.ok) {
-            throw new Error(`HTTP error! status: ${cryptoResponse.status}`);
-        }
-        const cryptoData = await cryptoResponse.json();
-        cryptoRate = cryptoData.venta;
-        console.log('Crypto exchange rate updated:', cryptoRate);
-    } catch (error) {
-        console.error('Error fetching crypto rate:', error);
-        cryptoRate = 1230; // Default value if it fails
-        console.warn('Using default crypto exchange rate:', cryptoRate);
-    }
-    
-    return cryptoRate;
+    // Fetch crypto dollar rate through the backend's shared rate cache
+    return new Promise((resolve) => {
+        AppStorage.exchangeRate.getAll(['cripto'], function(rates) {
+            if (rates.cripto) {
+                cryptoRate = rates.cripto.venta;
+                console.log('Crypto exchange rate updated:', cryptoRate);
+            } else {
+                console.error('Error fetching crypto rate');
+                cryptoRate = 1230; // Default value if it fails
+                console.warn('Using default crypto exchange rate:', cryptoRate);
+            }
+            resolve(cryptoRate);
+        }, true);
+    });
 }
 
 // Load accounts from API